@@ -0,0 +1,428 @@
+"""Streaming anomaly and threshold detection over saved readings
+
+DetectionEngine is a save listener: every saved reading updates its
+device's running statistics (an exponentially weighted mean and variance,
+O(1) per reading) and is checked against the rules right away, without
+querying the database. A background task finds devices whose readings have
+stopped, records events and hands them to the sinks (log, webhook).
+
+Rules are given as "spike=4,max_power=1500,stale=10m,left_on=30@00:00-05:00":
+
+- spike: power at least ``z`` EWMA standard deviations (and ``min_delta``
+  watts) away from the device's EWMA mean
+- max_power: power at or above the given watts, reported again only after
+  power has dropped ``max_power_margin`` (a fraction of the limit, at least
+  ``min_delta`` watts) below it
+- stale: no reading for the given time (s, m, h or d)
+- left_on: power at or above the given watts for ``left_on_hold`` seconds
+  within a local time window (which may cross midnight), once per night
+
+A rule prefixed with a device ID ("6055F9000001:max_power=800") applies to
+that device only and overrides the general rule; "off" disables a rule.
+"""
+
+import asyncio
+import math
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+import httpx
+
+RULES = ("spike", "max_power", "stale", "left_on")
+
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+# Rule settings: float (spike, max_power), seconds (stale), or (watts, window start, window end in minutes)
+RuleSet = Dict[Optional[str], Dict[str, object]]
+
+
+def _parse_clock(value: str) -> int:
+    match = re.fullmatch(r"(\d{1,2}):(\d{2})", value)
+    minutes = int(match.group(1)) * 60 + int(match.group(2)) if match else -1
+    if not 0 <= minutes <= 1440 or int(match.group(2)) > 59:
+        raise ValueError(f"Invalid time '{value}' (expected HH:MM)")
+    return minutes
+
+
+def _parse_rule(rule: str, value: str):
+    if value == "off":
+        return None
+    if rule in ("spike", "max_power"):
+        try:
+            return float(value)
+        except ValueError:
+            raise ValueError(f"Invalid {rule} value '{value}' (expected a number)") from None
+    if rule == "stale":
+        match = re.fullmatch(r"(\d+)([smhd]?)", value)
+        if not match:
+            raise ValueError(f"Invalid stale duration '{value}' (e.g. 300s, 10m or 1h)")
+        return int(match.group(1)) * DURATION_UNITS[match.group(2) or "s"]
+    watts, _, window = value.partition("@")
+    start, _, end = window.partition("-")
+    try:
+        return float(watts), _parse_clock(start), _parse_clock(end)
+    except ValueError:
+        raise ValueError(f"Invalid left_on value '{value}' (e.g. 30@00:00-05:00)") from None
+
+
+def _format_age(seconds: float) -> str:
+    if seconds < 120:
+        return f"{round(seconds)} s"
+    if seconds < 7200:
+        return f"{round(seconds / 60)} min"
+    return f"{seconds / 3600:.1f} h"
+
+
+def parse_detection_rules(spec: str) -> RuleSet:
+    """Parse a rule spec into {device_id or None (every device): {rule: setting}}"""
+    rules: RuleSet = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        name, _, value = entry.partition("=")
+        device_id, _, rule = name.strip().rpartition(":")
+        rule = rule.strip()
+        if rule not in RULES:
+            raise ValueError(f"Unknown detection rule '{rule}' (expected one of: {', '.join(RULES)})")
+        rules.setdefault(device_id.strip() or None, {})[rule] = _parse_rule(rule, value.strip().lower())
+    return rules
+
+
+class _DeviceState:
+    """Running statistics and rule state of one device"""
+
+    __slots__ = ("mean", "var", "samples", "last_timestamp", "on_since", "stale", "over_max",
+                 "left_on_night", "last_spike")
+
+    def __init__(self):
+        self.mean = 0.0
+        self.var = 0.0
+        self.samples = 0
+        self.last_timestamp: Optional[int] = None
+        self.on_since: Optional[int] = None
+        self.stale = False
+        self.over_max = False
+        self.left_on_night: Optional[str] = None
+        self.last_spike: Optional[int] = None
+
+    def update(self, power: float, alpha: float):
+        """Fold a reading into the exponentially weighted mean and variance"""
+        if self.samples == 0:
+            self.mean = power
+        else:
+            diff = power - self.mean
+            increment = alpha * diff
+            self.mean += increment
+            self.var = (1 - alpha) * (self.var + diff * increment)
+        self.samples += 1
+
+
+class LogSink:
+    """Prints every event (to the service journal)"""
+
+    async def send(self, events: List[Dict]):
+        for event in events:
+            print(f"{datetime.fromtimestamp(event['timestamp']).isoformat()}: "
+                  f"[{event['rule']}] {event['device_id']}: {event['message']}")
+
+    async def close(self):
+        pass
+
+
+class WebhookSink:
+    """POSTs each batch of events as JSON ({"events": [...]}) to a URL"""
+
+    def __init__(self, url: str, timeout: float = 5.0):
+        self.url = url
+        self._http = httpx.AsyncClient(timeout=timeout)
+        self.sent = 0
+        self.failed = 0
+
+    async def send(self, events: List[Dict]):
+        try:
+            response = await self._http.post(self.url, json={"events": events})
+            response.raise_for_status()
+            self.sent += len(events)
+        except httpx.HTTPError as e:
+            self.failed += len(events)
+            print(f"Error sending events to webhook: {e}")
+
+    async def close(self):
+        await self._http.aclose()
+
+
+class DetectionEngine:
+    """Evaluates detection rules on every saved reading and on a stale-reading timer
+
+    ``process`` may be called from any thread (it is a save listener); the
+    events it finds are passed to the event loop bound with ``start``, where
+    they are stored with ``store`` and sent to every sink. Spikes of a device
+    are reported at most once per ``cooldown`` seconds; max_power, stale and
+    left_on once per episode (until the condition clears, or per night).
+    """
+
+    def __init__(self,
+                 rules: RuleSet,
+                 store: Optional[Callable[[List[Dict]], Awaitable]] = None,
+                 sinks: Iterable = (),
+                 active_devices: Optional[Callable[[], Iterable[str]]] = None,
+                 alpha: float = 0.1,
+                 warmup: int = 10,
+                 min_delta: float = 10.0,
+                 cooldown: float = 600.0,
+                 max_power_margin: float = 0.1,
+                 left_on_hold: float = 3600.0,
+                 clock: Callable[[], float] = time.time):
+        self.rules = rules
+        self.store = store
+        self.sinks = list(sinks)
+        self.active_devices = active_devices
+        self.alpha = alpha
+        self.warmup = warmup
+        self.min_delta = min_delta
+        self.cooldown = cooldown
+        self.max_power_margin = max_power_margin
+        self.left_on_hold = left_on_hold
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._devices: Dict[str, _DeviceState] = {}
+        self._rule_cache: Dict[str, Dict[str, object]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+        self.readings = 0
+        self.events: Dict[str, int] = {rule: 0 for rule in RULES}
+        self.last_event: Optional[Dict] = None
+        self.last_error: Optional[str] = None
+
+    def device_rules(self, device_id: str) -> Dict[str, object]:
+        """Rules that apply to a device: the general ones with its own overrides"""
+        rules = self._rule_cache.get(device_id)
+        if rules is None:
+            rules = {**self.rules.get(None, {}), **self.rules.get(device_id, {})}
+            rules = self._rule_cache[device_id] = {rule: value for rule, value in rules.items() if value is not None}
+        return rules
+
+    def seed(self, latest: Dict[str, Dict]):
+        """Start stale detection from the latest stored reading of each device"""
+        with self._lock:
+            for device_id, data in latest.items():
+                if data.get("timestamp") is not None:
+                    self._state(device_id).last_timestamp = data["timestamp"]
+
+    def forget(self, device_id: str):
+        """Drop a device's statistics (after its data is deleted)"""
+        with self._lock:
+            self._devices.pop(device_id, None)
+            self._rule_cache.pop(device_id, None)
+
+    def _state(self, device_id: str) -> _DeviceState:
+        state = self._devices.get(device_id)
+        if state is None:
+            state = self._devices[device_id] = _DeviceState()
+        return state
+
+    def _event(self, device_id: str, rule: str, timestamp: int, value: Optional[float], message: str) -> Dict:
+        return {"device_id": device_id, "rule": rule, "timestamp": timestamp, "value": value, "message": message}
+
+    def _check(self, device_id: str, state: _DeviceState, timestamp: int, power: float) -> List[Dict]:
+        rules = self.device_rules(device_id)
+        events = []
+
+        z = rules.get("spike")
+        if z is not None and state.samples >= self.warmup:
+            deviation = power - state.mean
+            std = math.sqrt(state.var)
+            if abs(deviation) >= max(self.min_delta, z * std) and (
+                    state.last_spike is None or timestamp - state.last_spike >= self.cooldown):
+                state.last_spike = timestamp
+                score = deviation / std if std else math.inf
+                events.append(self._event(
+                    device_id, "spike", timestamp, power,
+                    f"power {power:g} W vs. usual {state.mean:.1f} W (z={score:.1f})"
+                ))
+
+        limit = rules.get("max_power")
+        if limit is not None:
+            if power >= limit and not state.over_max:
+                state.over_max = True
+                events.append(self._event(device_id, "max_power", timestamp, power,
+                                          f"power {power:g} W at or above {limit:g} W"))
+            elif power < limit - max(self.min_delta, limit * self.max_power_margin):
+                # Re-arm only once clearly below the limit, so hovering around it is one excursion
+                state.over_max = False
+
+        left_on = rules.get("left_on")
+        if left_on is not None:
+            watts, start, end = left_on
+            if power < watts:
+                state.on_since = None
+            else:
+                if state.on_since is None:
+                    state.on_since = timestamp
+                night = self._night(timestamp, start, end)
+                if night is not None and night != state.left_on_night and timestamp - state.on_since >= self.left_on_hold:
+                    state.left_on_night = night
+                    events.append(self._event(
+                        device_id, "left_on", timestamp, power,
+                        f"on at {power:g} W for {_format_age(timestamp - state.on_since)} during the night"
+                    ))
+        return events
+
+    @staticmethod
+    def _night(timestamp: int, start: int, end: int) -> Optional[str]:
+        """Date the window started on, if ``timestamp`` falls inside it (local time)"""
+        local = datetime.fromtimestamp(timestamp)
+        minute = local.hour * 60 + local.minute
+        if start <= end:
+            return local.date().isoformat() if start <= minute < end else None
+        if minute >= start:
+            return local.date().isoformat()
+        if minute < end:
+            return datetime.fromtimestamp(timestamp - 86400).date().isoformat()
+        return None
+
+    def process(self, readings: Iterable[Dict]) -> List[Dict]:
+        """Update statistics with saved readings and return (and dispatch) the events they raise"""
+        events = []
+        with self._lock:
+            for data in readings:
+                device_id, timestamp, power = data.get("device_id"), data.get("timestamp"), data.get("power")
+                if device_id is None or device_id == "all" or timestamp is None:
+                    continue
+                state = self._state(device_id)
+                if state.last_timestamp is not None and timestamp <= state.last_timestamp:
+                    # Replayed or out-of-order reading
+                    continue
+                state.last_timestamp = timestamp
+                state.stale = False
+                self.readings += 1
+                if power is None:
+                    continue
+                events.extend(self._check(device_id, state, timestamp, power))
+                state.update(power, self.alpha)
+        self._dispatch(events)
+        return events
+
+    def check_stale(self, now: Optional[float] = None) -> List[Dict]:
+        """Report devices whose last reading is older than their stale rule"""
+        now = int(now if now is not None else self.clock())
+        active = set(self.active_devices()) if self.active_devices else None
+        events = []
+        with self._lock:
+            for device_id, state in self._devices.items():
+                limit = self.device_rules(device_id).get("stale")
+                if limit is None or state.stale or state.last_timestamp is None:
+                    continue
+                if active is not None and device_id not in active:
+                    continue
+                age = now - state.last_timestamp
+                if age > limit:
+                    state.stale = True
+                    events.append(self._event(device_id, "stale", now, float(age),
+                                              f"no reading for {_format_age(age)}"))
+        self._dispatch(events)
+        return events
+
+    def _dispatch(self, events: List[Dict]):
+        if not events:
+            return
+        with self._lock:
+            for event in events:
+                self.events[event["rule"]] += 1
+            self.last_event = events[-1]
+        if self._loop is None or self._loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._queue.put_nowait(events)
+        else:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, events)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self):
+        """Start delivering events and checking for stale devices on the running event loop"""
+        if not self.running:
+            self._loop = asyncio.get_running_loop()
+            self._queue = asyncio.Queue()
+            self._task = self._loop.create_task(self._run())
+
+    async def stop(self):
+        """Deliver queued events, then stop the task and close the sinks"""
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        while self._queue is not None and not self._queue.empty():
+            await self._deliver(self._queue.get_nowait())
+        for sink in self.sinks:
+            await sink.close()
+
+    def _stale_interval(self) -> float:
+        limits = [rules.get("stale") for rules in self.rules.values() if rules.get("stale")]
+        # Check often enough that a device is reported within a quarter of its limit
+        return min([60.0] + [limit / 4 for limit in limits])
+
+    async def _run(self):
+        interval = self._stale_interval()
+        next_check = time.monotonic() + interval
+        while True:
+            try:
+                events = await asyncio.wait_for(self._queue.get(), max(0.0, next_check - time.monotonic()))
+                await self._deliver(events)
+            except asyncio.TimeoutError:
+                next_check = time.monotonic() + interval
+                self.check_stale()
+
+    async def _deliver(self, events: List[Dict]):
+        try:
+            if self.store is not None:
+                await self.store(events)
+            for sink in self.sinks:
+                await sink.send(events)
+            self.last_error = None
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"Error delivering detection events: {e}")
+
+    def status(self) -> Dict:
+        """Rules, tracked devices and event counters"""
+        with self._lock:
+            devices = {
+                device_id: {
+                    "samples": state.samples,
+                    "ewma_power": round(state.mean, 2) if state.samples else None,
+                    "ewma_std": round(math.sqrt(state.var), 2) if state.samples else None,
+                    "last_timestamp": state.last_timestamp,
+                    "stale": state.stale,
+                }
+                for device_id, state in sorted(self._devices.items())
+            }
+            events = dict(self.events)
+            last_event = self.last_event
+        return {
+            "running": self.running,
+            "rules": {device_id or "*": rules for device_id, rules in self.rules.items()},
+            "ewma_alpha": self.alpha,
+            "warmup_samples": self.warmup,
+            "spike_cooldown_seconds": self.cooldown,
+            "max_power_margin": self.max_power_margin,
+            "readings_processed": self.readings,
+            "events": events,
+            "last_event": last_event,
+            "last_error": self.last_error,
+            "sinks": [type(sink).__name__ for sink in self.sinks],
+            "devices": devices,
+        }
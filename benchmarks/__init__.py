@@ -0,0 +1 @@
+"""Benchmarks for the SwitchBot power monitor (run with ``python -m benchmarks.<name>``)"""
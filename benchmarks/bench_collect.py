@@ -0,0 +1,99 @@
+"""Collection cycle time against a fake SwitchBot API as the device count grows
+
+Compares the sequential loop the collector used to run, once opening a new
+connection per request (as the requests.get based client did) and once over
+the client's pooled keep-alive connection, with the threaded
+SwitchBotClient.get_many_power_data and AsyncSwitchBotClient.get_many_power_data.
+Prints the per-phase latency breakdown of the pooled clients afterwards.
+
+Usage: python -m benchmarks.bench_collect --devices 1 5 10 15 20 --latency 0.2
+"""
+
+import argparse
+import asyncio
+import time
+
+from switchbot_client import AsyncSwitchBotClient, LATENCY_PHASES, LatencyStats, SwitchBotClient
+from benchmarks.fake_switchbot_api import FakeSwitchBotAPI
+from benchmarks.synthetic import device_ids
+
+
+def fresh_connection_cycle(api: FakeSwitchBotAPI, ids) -> float:
+    start = time.perf_counter()
+    readings = []
+    for device_id in ids:
+        client = SwitchBotClient("token", "secret", base_url=api.base_url)
+        readings.append(client.get_plug_power_data(device_id))
+        client.close()
+    elapsed = time.perf_counter() - start
+    assert all(readings)
+    return elapsed
+
+
+def sequential_cycle(client: SwitchBotClient, ids) -> float:
+    start = time.perf_counter()
+    readings = [client.get_plug_power_data(device_id) for device_id in ids]
+    elapsed = time.perf_counter() - start
+    assert all(readings)
+    return elapsed
+
+
+def threaded_cycle(client: SwitchBotClient, ids) -> float:
+    start = time.perf_counter()
+    readings = client.get_many_power_data(ids)
+    elapsed = time.perf_counter() - start
+    assert all(readings.values())
+    return elapsed
+
+
+async def concurrent_cycle(client: AsyncSwitchBotClient, ids) -> float:
+    start = time.perf_counter()
+    readings = await client.get_many_power_data(ids)
+    elapsed = time.perf_counter() - start
+    assert all(readings.values())
+    return elapsed
+
+
+def print_latency(name: str, latency: LatencyStats):
+    summary = latency.summary()
+    print(f"\n{name}: {summary['requests']} requests, {summary['new_connections']} new connections, "
+          f"{summary['retries']} retries")
+    print(f"{'phase':>10}{'p50 (ms)':>12}{'p95 (ms)':>12}{'max (ms)':>12}")
+    for phase in LATENCY_PHASES:
+        values = summary["phases"].get(phase)
+        if values:
+            print(f"{phase:>10}{values['p50_ms']:>12.2f}{values['p95_ms']:>12.2f}{values['max_ms']:>12.2f}")
+
+
+async def run(args):
+    with FakeSwitchBotAPI(latency=args.latency) as api:
+        sync_client = SwitchBotClient("token", "secret", base_url=api.base_url, max_concurrency=args.max_concurrency)
+        async_client = AsyncSwitchBotClient("token", "secret", base_url=api.base_url, max_concurrency=args.max_concurrency)
+        try:
+            print(f"fake API latency {args.latency}s, max_concurrency {args.max_concurrency}")
+            print(f"{'devices':>8}{'new conn (s)':>16}{'sequential (s)':>16}{'threaded (s)':>16}{'async (s)':>16}")
+            for count in args.devices:
+                ids = device_ids(count)
+                fresh = fresh_connection_cycle(api, ids)
+                sequential = sequential_cycle(sync_client, ids)
+                threaded = threaded_cycle(sync_client, ids)
+                concurrent = await concurrent_cycle(async_client, ids)
+                print(f"{count:>8}{fresh:>16.2f}{sequential:>16.2f}{threaded:>16.2f}{concurrent:>16.2f}")
+            print_latency("SwitchBotClient", sync_client.latency)
+            print_latency("AsyncSwitchBotClient", async_client.latency)
+        finally:
+            sync_client.close()
+            await async_client.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, nargs="+", default=[1, 5, 10, 15, 20])
+    parser.add_argument("--latency", type=float, default=0.2, help="fake API response latency (s)")
+    parser.add_argument("--max-concurrency", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Latency of a cheap endpoint while heavy database requests run
+
+Starts the API server (uvicorn, in a subprocess) on a synthetic database
+and polls ``/power/db/latest`` back to back while another client repeatedly
+runs a heavy request: a full CSV export, the database statistics scan or a
+long bulk history query. If the heavy request blocks the event loop, every
+probe queued behind it waits for its whole duration, which shows up as p99.
+
+Usage: python -m benchmarks.bench_concurrency --devices 5 --days 30 --seconds 5
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.synthetic import device_ids, fill_database
+from benchmarks.bench_indexes import BASELINE_SCHEMA
+from data_storage import PowerDataStorage
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = {
+    "idle": None,
+    "csv export": ("POST", "/database/export/all?hours=0&format=csv"),
+    "stats": ("GET", "/database/stats"),
+    "bulk history": ("GET", "/power/history?hours=720&format=columnar"),
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(workdir: str, port: int, env: dict) -> subprocess.Popen:
+    # No real SwitchBot credentials, unless the caller passes (fake API) ones
+    env = {**{name: value for name, value in os.environ.items() if name not in ("SWITCHBOT_TOKEN", "SWITCHBOT_SECRET")},
+           "PYTHONPATH": ROOT, **env}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL
+    )
+    deadline = time.time() + 120
+    while time.time() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/health", timeout=1).raise_for_status()
+            return server
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError("server did not start")
+
+
+async def heavy_load(client: httpx.AsyncClient, request, stop: asyncio.Event) -> int:
+    count = 0
+    while not stop.is_set():
+        async with client.stream(*request) as response:
+            async for _ in response.aiter_raw():
+                pass
+        count += 1
+    return count
+
+
+async def probe(client: httpx.AsyncClient, seconds: float):
+    latencies = []
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = await client.get("/power/db/latest")
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+    return sorted(latencies)
+
+
+async def run_scenario(base_url: str, request, seconds: float):
+    async with httpx.AsyncClient(base_url=base_url, timeout=600) as heavy, \
+            httpx.AsyncClient(base_url=base_url, timeout=600) as light:
+        stop = asyncio.Event()
+        load = asyncio.create_task(heavy_load(heavy, request, stop)) if request else None
+        # Let the heavy request get going first
+        await asyncio.sleep(0.2)
+        latencies = await probe(light, seconds)
+        stop.set()
+        completed = await load if load else 0
+    return latencies, completed
+
+
+def percentile(values, fraction: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * fraction))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=5)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--seconds", type=float, default=5.0, help="probe duration per scenario")
+    parser.add_argument("--env", nargs="*", default=[], metavar="NAME=VALUE",
+                        help="extra server environment, e.g. DB_READ_THREADS=1")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "power_data.db")
+        conn = sqlite3.connect(db_path)
+        conn.execute(BASELINE_SCHEMA)
+        conn.close()
+        rows = fill_database(db_path, device_ids(args.devices), args.days * 86400 // 20)
+        # Migrate and build rollups/energy once, outside the measurement
+        PowerDataStorage(db_path).close()
+
+        port = free_port()
+        server = start_server(tmp, port, dict(entry.split("=", 1) for entry in args.env))
+        try:
+            print(f"{rows:,} readings ({args.devices} devices x {args.days} days), {args.seconds}s per scenario")
+            print(f"{'while':<14}{'heavy done':>11}{'probes':>8}{'p50 (ms)':>10}{'p99 (ms)':>10}{'max (ms)':>10}")
+            for name, request in SCENARIOS.items():
+                latencies, completed = asyncio.run(run_scenario(f"http://127.0.0.1:{port}", request, args.seconds))
+                print(f"{name:<14}{completed:>11}{len(latencies):>8}{percentile(latencies, 0.5):>10.1f}"
+                      f"{percentile(latencies, 0.99):>10.1f}{latencies[-1] * 1000:>10.1f}")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Export peak memory, fetchall + StringIO copies vs. streaming chunks
+
+Peak memory is Python heap usage traced with tracemalloc while the whole
+export is produced and discarded chunk by chunk, as a client download would.
+Timings include tracemalloc's overhead, so compare them only with each other.
+
+Usage: python -m benchmarks.bench_export --devices 2 --days 30
+"""
+
+import argparse
+import csv
+import io
+import os
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from benchmarks.synthetic import device_ids, fill_database
+from benchmarks.bench_indexes import BASELINE_SCHEMA
+from data_storage import PowerDataStorage
+from exporting import csv_chunks, gzip_chunks, parquet_available, parquet_chunks
+
+
+def legacy_csv(storage: PowerDataStorage, hours: int):
+    """The export as it was before streaming: fetchall, StringIO, then one BytesIO copy"""
+    cursor = storage.connection().cursor()
+    hours_ago = int(datetime.now().timestamp()) - (hours * 3600)
+    cursor.execute("""
+        SELECT * FROM power_readings
+        WHERE timestamp >= ? AND device_id != ?
+        ORDER BY timestamp DESC
+    """, (hours_ago, 'all'))
+    readings = cursor.fetchall()
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(['timestamp', 'datetime', 'device_id', 'voltage', 'electric_current', 'power', 'electricity_of_day', 'power_on'])
+    for reading in readings:
+        writer.writerow([
+            reading['timestamp'],
+            datetime.fromtimestamp(reading['timestamp']).isoformat(),
+            reading['device_id'],
+            reading['voltage'],
+            reading['electric_current'],
+            reading['power'],
+            reading['electricity_of_day'],
+            reading['power_on']
+        ])
+    yield io.BytesIO(output.getvalue().encode('utf-8')).getvalue()
+
+
+def variants(storage: PowerDataStorage):
+    yield "legacy csv", lambda hours: legacy_csv(storage, hours)
+    yield "stream csv", lambda hours: csv_chunks(storage.iter_readings(None, hours, 5000))
+    yield "stream csv.gz", lambda hours: gzip_chunks(csv_chunks(storage.iter_readings(None, hours, 5000)))
+    if parquet_available():
+        yield "stream parquet", lambda hours: parquet_chunks(storage.iter_readings(None, hours, 50000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=2)
+    parser.add_argument("--days", type=int, default=30)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        conn = sqlite3.connect(db_path)
+        conn.execute(BASELINE_SCHEMA)
+        conn.close()
+        fill_database(db_path, device_ids(args.devices), args.days * 86400 // 20)
+        storage = PowerDataStorage(db_path)
+
+        print(f"{args.devices} devices x {args.days} days of 20s samples")
+        print(f"{'range':<7}{'variant':<16}{'bytes':>14}{'peak MB':>10}{'seconds':>10}")
+        ranges = [days for days in (1, 7, 30, 365) if days <= args.days]
+        for days in ranges:
+            for name, export in variants(storage):
+                tracemalloc.start()
+                start = time.perf_counter()
+                size = sum(len(chunk) for chunk in export(days * 24))
+                elapsed = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print(f"{str(days) + 'd':<7}{name:<16}{size:>14,}{peak / 1e6:>10.1f}{elapsed:>10.2f}")
+        storage.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""History endpoint payload size and latency, full rows vs. server-side downsampling
+
+Usage: python -m benchmarks.bench_history --devices 2 --days 7
+"""
+
+import argparse
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+import warnings
+
+from benchmarks.synthetic import device_ids, fill_database
+from benchmarks.bench_indexes import BASELINE_SCHEMA
+
+VARIANTS = {
+    "full rows": "",
+    "rollup only": "&points=2000&downsample=none",
+    "lttb 2000": "&points=2000&downsample=lttb",
+    "minmax 2000": "&points=2000&downsample=minmax",
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=2)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        conn = sqlite3.connect(db_path)
+        conn.execute(BASELINE_SCHEMA)
+        conn.close()
+        ids = device_ids(args.devices)
+        fill_database(db_path, ids, args.days * 86400 // 20)
+
+        # main creates its default database in the working directory on import
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            warnings.filterwarnings("ignore")
+            from fastapi.testclient import TestClient
+            import main as app_module
+            from data_storage import PowerDataStorage
+        finally:
+            os.chdir(cwd)
+        # Measure the queries themselves, not history cache hits
+        app_module.storage = PowerDataStorage(db_path, history_cache_size=0)
+        client = TestClient(app_module.app)
+
+        print(f"{args.devices} devices x {args.days} days of 20s samples")
+        print(f"{'range':<6}{'variant':<14}{'rows':>8}{'source':>8}{'bytes':>12}{'p50 ms':>10}{'max ms':>10}")
+        for hours in (24, 168):
+            for name, query in VARIANTS.items():
+                samples = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    response = client.get(f"/power/history/{ids[0]}?hours={hours}{query}")
+                    samples.append((time.perf_counter() - start) * 1000)
+                body = response.json()
+                label = "24h" if hours == 24 else "1w"
+                print(f"{label:<6}{name:<14}{body['total_readings']:>8}{body['source_readings']:>8}"
+                      f"{len(response.content):>12,}{statistics.median(samples):>10.1f}{max(samples):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
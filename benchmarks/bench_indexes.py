@@ -0,0 +1,113 @@
+"""Query latency on power_readings before and after the schema migrations
+
+Usage: python -m benchmarks.bench_indexes --rows 1000000 10000000
+"""
+
+import argparse
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from data_storage import PowerDataStorage
+from benchmarks.synthetic import device_ids, fill_database
+
+BASELINE_SCHEMA = '''
+    CREATE TABLE power_readings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        device_id TEXT NOT NULL,
+        timestamp INTEGER NOT NULL,
+        voltage REAL,
+        electric_current REAL,
+        power REAL,
+        electricity_of_day REAL,
+        power_on BOOLEAN,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+# The statements behind the dashboard's hot endpoints
+QUERIES = {
+    "latest_reading": (
+        "SELECT * FROM power_readings WHERE device_id = ? ORDER BY timestamp DESC LIMIT 1",
+        lambda device, now: (device,),
+    ),
+    "history_24h": (
+        "SELECT * FROM power_readings WHERE device_id = ? AND timestamp >= ? ORDER BY timestamp DESC",
+        lambda device, now: (device, now - 86400),
+    ),
+    "db_latest_group_by": (
+        "SELECT device_id, MAX(timestamp) FROM power_readings WHERE device_id != 'all' GROUP BY device_id",
+        lambda device, now: (),
+    ),
+    "stats_per_device": (
+        "SELECT device_id, COUNT(*), MIN(timestamp), MAX(timestamp) FROM power_readings "
+        "WHERE device_id != 'all' GROUP BY device_id ORDER BY device_id",
+        lambda device, now: (),
+    ),
+    "stats_recent_24h": (
+        "SELECT device_id, COUNT(*) FROM power_readings WHERE timestamp >= ? AND device_id != 'all' "
+        "GROUP BY device_id",
+        lambda device, now: (now - 86400,),
+    ),
+}
+
+
+def time_queries(db_path: str, device: str, now: int, repeat: int) -> dict:
+    """Median wall time in milliseconds for each query"""
+    conn = sqlite3.connect(db_path)
+    results = {}
+    for name, (sql, params) in QUERIES.items():
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            conn.execute(sql, params(device, now)).fetchall()
+            samples.append((time.perf_counter() - start) * 1000)
+        results[name] = statistics.median(samples)
+    conn.close()
+    return results
+
+
+def run(rows: int, devices: int, repeat: int):
+    now = int(time.time())
+    ids = device_ids(devices)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "bench.db")
+        conn = sqlite3.connect(db_path)
+        conn.execute(BASELINE_SCHEMA)
+        conn.close()
+
+        start = time.perf_counter()
+        fill_database(db_path, ids, rows // devices, end=now)
+        print(f"\n== {rows:,} rows, {devices} devices (generated in {time.perf_counter() - start:.1f}s)")
+
+        phases = {"baseline": time_queries(db_path, ids[0], now, repeat)}
+
+        start = time.perf_counter()
+        storage = PowerDataStorage(db_path)
+        print(f"migrate to v{storage.get_schema_version()}: {time.perf_counter() - start:.1f}s")
+        phases["indexed"] = time_queries(db_path, ids[0], now, repeat)
+
+        start = time.perf_counter()
+        storage.rebuild_without_rowid()
+        print(f"rebuild WITHOUT ROWID: {time.perf_counter() - start:.1f}s")
+        phases["without_rowid"] = time_queries(db_path, ids[0], now, repeat)
+
+        print(f"{'query (median ms)':<22}" + "".join(f"{phase:>16}" for phase in phases))
+        for name in QUERIES:
+            print(f"{name:<22}" + "".join(f"{phases[phase][name]:>16.2f}" for phase in phases))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000_000])
+    parser.add_argument("--devices", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    for rows in args.rows:
+        run(rows, args.devices, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
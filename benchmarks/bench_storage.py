@@ -0,0 +1,91 @@
+"""Bytes per sample and scan throughput of the raw-reading storage layouts
+
+Every layout is built from the same synthetic readings: the original table
+(rowid, device_id text and created_at in every row), WITHOUT ROWID, and the
+compact "rows" and "chunks" modes. Bytes per sample count the pages of the
+raw-reading tables and their indexes (rollups excluded) using SQLite's
+dbstat table, or the whole file if dbstat is not compiled in. The full scan
+reads everything through iter_readings, as an export does; history is the
+uncached 24-hour raw query behind the dashboard chart.
+
+Usage: python -m benchmarks.bench_storage --devices 4 --days 30
+"""
+
+import argparse
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from benchmarks.bench_indexes import BASELINE_SCHEMA
+from benchmarks.synthetic import device_ids, fill_database
+from data_storage import PowerDataStorage
+
+LAYOUTS = {
+    "original": {},
+    "without_rowid": {"without_rowid": True},
+    "compact rows": {"compact": "rows"},
+    "compact chunks": {"compact": "chunks"},
+}
+
+
+def raw_bytes(db_path: str) -> int:
+    """Bytes used by raw-reading tables and indexes"""
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name").fetchall()
+        return sum(size for name, size in rows if "rollup" not in name and name != "sqlite_schema")
+    except sqlite3.OperationalError:
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        return conn.execute("PRAGMA page_count").fetchone()[0] * page_size
+    finally:
+        conn.close()
+
+
+def run(devices: int, days: int, repeat: int):
+    now = int(time.time())
+    ids = device_ids(devices)
+    samples = days * 86400 // 20
+    print(f"{devices} devices x {days} days of 20s samples ({devices * samples:,} readings)")
+    print(f"{'layout':<16}{'bytes/sample':>14}{'raw MB':>10}{'convert s':>11}{'scan rows/s':>14}{'24h ms':>9}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, options in LAYOUTS.items():
+            db_path = os.path.join(tmp, name.replace(" ", "_") + ".db")
+            conn = sqlite3.connect(db_path)
+            conn.execute(BASELINE_SCHEMA)
+            conn.close()
+            fill_database(db_path, ids, samples, end=now)
+
+            start = time.perf_counter()
+            storage = PowerDataStorage(db_path, history_cache_size=0, **options)
+            convert = time.perf_counter() - start
+            size = raw_bytes(db_path)
+
+            start = time.perf_counter()
+            scanned = sum(len(rows) for rows in storage.iter_readings(None, 0, batch_size=50000))
+            scan_rate = scanned / (time.perf_counter() - start)
+
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                storage.get_history_columns(ids[0], 24)
+                timings.append((time.perf_counter() - start) * 1000)
+            storage.close()
+
+            print(f"{name:<16}{size / scanned:>14.1f}{size / 1e6:>10.1f}{convert:>11.1f}"
+                  f"{scan_rate:>14,.0f}{statistics.median(timings):>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=4)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    run(args.devices, args.days, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+"""End-to-end benchmark suite with machine-readable results
+
+One run measures the whole stack on a synthetic database:
+
+- ingest: collection-sized save_many_power_data batches (one row per device,
+  20s apart) into a database that already holds ``--days`` of readings
+- collection: POST /power/collect/all cycles against the local fake
+  SwitchBot API (``--latency``, ``--error-rate``)
+- endpoints: sequential latency of the latest, history, bulk history,
+  stats, energy and export endpoints (history cache off, so repeated
+  requests reach SQLite)
+- throughput: requests per second of the dashboard's polled endpoints with
+  ``--concurrency`` clients
+- memory: server RSS after startup and at the end, and its peak
+
+Results are printed and, with ``--output``, written as JSON together with
+the git commit, Python/SQLite versions and parameters. ``--compare`` prints
+every metric of a previous results file next to this run's:
+
+    python -m benchmarks.bench_suite --output before.json
+    (change something)
+    python -m benchmarks.bench_suite --output after.json --compare before.json
+
+Usage: python -m benchmarks.bench_suite --devices 5 --days 30
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from itertools import groupby
+from typing import Dict, List, Optional
+
+import httpx
+
+from benchmarks.bench_concurrency import ROOT, free_port, percentile, start_server
+from benchmarks.bench_indexes import BASELINE_SCHEMA
+from benchmarks.fake_switchbot_api import FakeSwitchBotAPI
+from benchmarks.synthetic import device_ids, fill_database, generate_readings
+from data_storage import READING_FIELDS, PowerDataStorage
+
+# Storage layout: (PowerDataStorage arguments, server environment)
+MODES = {
+    "original": ({}, {}),
+    "without_rowid": ({"without_rowid": True}, {"POWER_DB_WITHOUT_ROWID": "true"}),
+    "partition": ({"partition": "month"}, {"POWER_DB_PARTITION": "month"}),
+    "compact-rows": ({"compact": "rows"}, {"POWER_DB_COMPACT": "rows"}),
+    "compact-chunks": ({"compact": "chunks"}, {"POWER_DB_COMPACT": "chunks"}),
+}
+
+SERVER_ENV = {"HISTORY_CACHE_SIZE": "0", "DEVICE_SYNC_INTERVAL": "0"}
+
+
+def endpoints(device: str) -> Dict[str, tuple]:
+    """Requests timed one after another; {device} is the first synthetic plug"""
+    return {
+        "latest": ("GET", "/power/db/latest"),
+        "history 24h": ("GET", f"/power/history/{device}?hours=24"),
+        "history 7d": ("GET", f"/power/history/{device}?hours=168"),
+        "bulk history 24h": ("GET", "/power/history?hours=24&format=columnar"),
+        "stats": ("GET", "/database/stats"),
+        "energy": ("GET", "/power/energy?period=day"),
+        "export 7d": ("POST", f"/database/export/{device}?hours=168"),
+    }
+
+
+THROUGHPUT = ("latest", "stats")
+
+
+def summarize(seconds: List[float]) -> Dict:
+    """Count and p50/p95/p99/max in milliseconds"""
+    values = sorted(seconds)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50_ms": round(percentile(values, 0.5), 2),
+        "p95_ms": round(percentile(values, 0.95), 2),
+        "p99_ms": round(percentile(values, 0.99), 2),
+        "max_ms": round(values[-1] * 1000, 2),
+    }
+
+
+def process_memory(pid: int) -> Dict[str, Optional[int]]:
+    """Current and peak RSS of a process in KiB (Linux /proc; None elsewhere)"""
+    memory = {"rss_kib": None, "peak_rss_kib": None}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    memory["rss_kib"] = int(line.split()[1])
+                elif line.startswith("VmHWM:"):
+                    memory["peak_rss_kib"] = int(line.split()[1])
+    except OSError:
+        pass
+    return memory
+
+
+def environment() -> Dict:
+    """Where and on what the run happened"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        commit, dirty = None, None
+    return {
+        "git_commit": commit,
+        "git_dirty": dirty,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def build_database(db_path: str, ids: List[str], days: int, ingest_cycles: int, storage_args: Dict) -> Dict:
+    """Bulk-load history, then time collection-sized saves of the newest readings"""
+    now = int(time.time())
+    conn = sqlite3.connect(db_path)
+    conn.execute(BASELINE_SCHEMA)
+    conn.close()
+    history_end = now - ingest_cycles * 20
+    rows = fill_database(db_path, ids, days * 86400 // 20, end=history_end - 20)
+
+    start = time.perf_counter()
+    storage = PowerDataStorage(db_path, **storage_args)
+    startup = time.perf_counter() - start
+
+    saves = []
+    newest = generate_readings(ids, ingest_cycles, end=now - 20, seed=1)
+    start = time.perf_counter()
+    for _, cycle in groupby(newest, key=lambda row: row[1]):
+        readings = [dict(zip(READING_FIELDS, row)) for row in cycle]
+        save_start = time.perf_counter()
+        storage.save_many_power_data(readings)
+        saves.append(time.perf_counter() - save_start)
+    elapsed = time.perf_counter() - start
+    storage.close()
+    return {
+        "history_rows": rows,
+        "first_open_s": round(startup, 2),
+        "cycles": len(saves),
+        "rows_per_s": round(len(saves) * len(ids) / elapsed, 1) if elapsed else None,
+        "save": summarize(saves),
+        "db_size_mib": round(os.path.getsize(db_path) / 1024 / 1024, 1),
+    }
+
+
+async def time_collection(client: httpx.AsyncClient, cycles: int, interval: float) -> Dict:
+    times, collected, failed = [], 0, 0
+    for _ in range(cycles):
+        start = time.perf_counter()
+        response = await client.post("/power/collect/all")
+        times.append(time.perf_counter() - start)
+        if response.status_code == 200:
+            results = response.json()["results"].values()
+            collected += sum(1 for result in results if result["success"])
+            failed += sum(1 for result in results if not result["success"])
+        else:
+            failed += 1
+        await asyncio.sleep(interval)
+    return {**summarize(times), "devices_collected": collected, "devices_failed": failed}
+
+
+async def time_request(client: httpx.AsyncClient, method: str, path: str) -> tuple:
+    start = time.perf_counter()
+    size = 0
+    async with client.stream(method, path) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_raw():
+            size += len(chunk)
+    return time.perf_counter() - start, size
+
+
+async def time_endpoints(client: httpx.AsyncClient, requests: Dict[str, tuple], repeat: int) -> Dict:
+    results = {}
+    for name, (method, path) in requests.items():
+        # One untimed request first, so lazy imports and page cache do not count
+        await time_request(client, method, path)
+        times, size = [], 0
+        for _ in range(repeat):
+            elapsed, size = await time_request(client, method, path)
+            times.append(elapsed)
+        results[name] = {**summarize(times), "bytes": size}
+    return results
+
+
+async def time_throughput(base_url: str, method: str, path: str, concurrency: int, seconds: float) -> Dict:
+    times = []
+    deadline = time.perf_counter() + seconds
+
+    async def worker(client: httpx.AsyncClient):
+        while time.perf_counter() < deadline:
+            elapsed, _ = await time_request(client, method, path)
+            times.append(elapsed)
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return {"requests_per_s": round(len(times) / elapsed, 1), **summarize(times)}
+
+
+async def run_server_benchmarks(base_url: str, args, device: str) -> Dict:
+    results = {}
+    async with httpx.AsyncClient(base_url=base_url, timeout=600) as client:
+        results["collection"] = await time_collection(client, args.cycles, args.cycle_interval)
+        requests = endpoints(device)
+        results["endpoints"] = await time_endpoints(client, requests, args.repeat)
+    results["throughput"] = {
+        name: await time_throughput(base_url, *requests[name], args.concurrency, args.seconds)
+        for name in THROUGHPUT
+    }
+    return results
+
+
+def flatten(results: Dict, prefix: str = "") -> Dict[str, float]:
+    """Numeric leaves keyed by their dotted path"""
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def print_results(results: Dict):
+    ingest = results["ingest"]
+    print(f"\n{ingest['history_rows']:,} history rows, {ingest['db_size_mib']} MiB, first open {ingest['first_open_s']}s")
+    print(f"ingest: {ingest['rows_per_s']:,} rows/s over {ingest['cycles']} cycles, "
+          f"save p50 {ingest['save']['p50_ms']} ms, p99 {ingest['save']['p99_ms']} ms")
+    collection = results["collection"]
+    print(f"collection cycle: p50 {collection['p50_ms']} ms, p95 {collection['p95_ms']} ms, "
+          f"{collection['devices_collected']} collected / {collection['devices_failed']} failed")
+    print(f"\n{'endpoint':<18}{'p50 (ms)':>10}{'p95 (ms)':>10}{'p99 (ms)':>10}{'max (ms)':>10}{'bytes':>12}")
+    for name, stats in results["endpoints"].items():
+        print(f"{name:<18}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}"
+              f"{stats['max_ms']:>10.1f}{stats['bytes']:>12,}")
+    print(f"\n{'throughput':<18}{'req/s':>10}{'p50 (ms)':>10}{'p99 (ms)':>10}")
+    for name, stats in results["throughput"].items():
+        print(f"{name:<18}{stats['requests_per_s']:>10.1f}{stats['p50_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+    memory = results["memory"]
+    if memory["end"]["rss_kib"] is not None:
+        print(f"\nserver RSS: {memory['startup']['rss_kib'] // 1024} MiB after startup, "
+              f"{memory['end']['rss_kib'] // 1024} MiB at the end, peak {memory['end']['peak_rss_kib'] // 1024} MiB")
+
+
+def print_comparison(baseline: Dict, current: Dict):
+    old, new = flatten(baseline["results"]), flatten(current["results"])
+    print(f"\ncompared with {baseline['environment'].get('git_commit')} ({baseline['started']})")
+    differing = {key: (value, current["parameters"].get(key)) for key, value in baseline["parameters"].items()
+                 if current["parameters"].get(key) != value}
+    if differing:
+        print("parameters differ (before, after): "
+              + ", ".join(f"{key}={before!r}/{after!r}" for key, (before, after) in differing.items()))
+    print(f"{'metric':<44}{'before':>12}{'after':>12}{'change':>9}")
+    for key in sorted(old.keys() & new.keys()):
+        change = f"{(new[key] - old[key]) / old[key] * 100:+.0f}%" if old[key] else ""
+        print(f"{key:<44}{old[key]:>12,}{new[key]:>12,}{change:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=5)
+    parser.add_argument("--days", type=int, default=30, help="days of 20s readings already stored")
+    parser.add_argument("--mode", choices=MODES, default="original", help="raw-reading storage layout")
+    parser.add_argument("--ingest-cycles", type=int, default=500, help="timed collection-sized saves")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake API response latency (s)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of fake API 500 responses")
+    parser.add_argument("--cycles", type=int, default=10, help="collection cycles through the API server")
+    parser.add_argument("--cycle-interval", type=float, default=0.5, help="pause between collection cycles (s)")
+    parser.add_argument("--repeat", type=int, default=20, help="timed requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=8, help="clients in the throughput test")
+    parser.add_argument("--seconds", type=float, default=5.0, help="duration of each throughput test")
+    parser.add_argument("--env", nargs="*", default=[], metavar="NAME=VALUE",
+                        help="extra server environment, e.g. DB_READ_THREADS=1")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="results JSON of an earlier run to compare with")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    ids = device_ids(args.devices)
+    storage_args, mode_env = MODES[args.mode]
+    report = {
+        "suite": "bench_suite",
+        "started": datetime.now().isoformat(timespec="seconds"),
+        "environment": environment(),
+        "parameters": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+        "results": {},
+    }
+    results = report["results"]
+
+    with tempfile.TemporaryDirectory() as tmp, \
+            FakeSwitchBotAPI(latency=args.latency, error_rate=args.error_rate, seed=0, devices=ids) as api:
+        print(f"Building {args.days} days x {args.devices} devices ({args.mode})...", file=sys.stderr)
+        results["ingest"] = build_database(os.path.join(tmp, "power_data.db"), ids, args.days,
+                                           args.ingest_cycles, storage_args)
+
+        env = {
+            **SERVER_ENV,
+            **mode_env,
+            "SWITCHBOT_TOKEN": "benchmark",
+            "SWITCHBOT_SECRET": "benchmark",
+            "SWITCHBOT_API_BASE_URL": api.base_url,
+            **dict(entry.split("=", 1) for entry in args.env),
+        }
+        port = free_port()
+        server = start_server(tmp, port, env)
+        try:
+            results["memory"] = {"startup": process_memory(server.pid)}
+            results.update(asyncio.run(run_server_benchmarks(f"http://127.0.0.1:{port}", args, ids[0])))
+            results["memory"]["end"] = process_memory(server.pid)
+            results["fake_api"] = {"requests": api.request_count}
+        finally:
+            server.terminate()
+            server.wait()
+
+    report["finished"] = datetime.now().isoformat(timespec="seconds")
+    print_results(results)
+    if baseline:
+        print_comparison(baseline, report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
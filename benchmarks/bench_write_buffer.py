@@ -0,0 +1,101 @@
+"""fsyncs, commits and bytes written per collection cycle with and without the write buffer
+
+Saves one reading per device per cycle the ways the collector can: one
+commit per reading (as save_power_data was called before save_many), one
+save_many commit per cycle, and the write buffer with the spool fsynced on
+every batch or at most once per --fsync-seconds. Cycles are --interval
+seconds apart, so the interval-limited fsyncs scale to a real 20 s cycle by
+the ratio of the two settings.
+
+Spool fsyncs are counted by the buffer. SQLite's own fsyncs depend on the
+synchronous pragma: with the default WAL + synchronous=NORMAL commits do not
+fsync and only checkpoints do, with synchronous=FULL every commit is one
+fsync, so the commits column is the database fsync count in that mode.
+Write calls and bytes come from /proc/self/io (Linux only) and cover the
+database, WAL and spool together.
+
+Usage: python -m benchmarks.bench_write_buffer --devices 10 --cycles 200 --interval 0.02
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from typing import Dict, Optional
+
+from benchmarks.synthetic import device_ids, generate_readings
+from data_storage import DEFAULT_PRAGMAS, READING_FIELDS, PowerDataStorage
+
+
+def io_counters() -> Dict[str, int]:
+    """syscw/wchar of this process, or zeros where /proc/self/io is unavailable"""
+    try:
+        with open("/proc/self/io") as io:
+            return {key: int(value) for key, value in (line.split(": ") for line in io)}
+    except OSError:
+        return {"syscw": 0, "wchar": 0}
+
+
+def run_variant(db_path: str, ids, cycles: int, interval: float, synchronous: str,
+                mode: str, fsync_interval: Optional[float] = None) -> Dict[str, float]:
+    storage = PowerDataStorage(db_path, pragmas=dict(DEFAULT_PRAGMAS, synchronous=synchronous))
+    if fsync_interval is not None:
+        storage.enable_write_buffer(max_rows=len(ids) * 15, max_age=3600, fsync_interval=fsync_interval)
+    rows = generate_readings(ids, cycles, end=int(time.time()))
+    before = io_counters()
+    commits = 0
+    for _ in range(cycles):
+        readings = [dict(zip(READING_FIELDS, next(rows))) for _ in ids]
+        if mode == "per-row":
+            for reading in readings:
+                storage.save_power_data(reading)
+            commits += len(readings)
+        else:
+            storage.save_many_power_data(readings)
+            commits += 1
+        time.sleep(interval)
+    buffer = storage.write_buffer
+    storage.close()
+    after = io_counters()
+    if buffer is not None:
+        commits = buffer.flushes
+    return {
+        "commits": commits / cycles,
+        "spool_fsyncs": buffer.fsyncs / cycles if buffer is not None else 0.0,
+        "write_calls": (after["syscw"] - before["syscw"]) / cycles,
+        "kib": (after["wchar"] - before["wchar"]) / 1024 / cycles,
+    }
+
+
+def run(devices: int, cycles: int, interval: float, fsync_seconds: float, synchronous: str):
+    ids = device_ids(devices)
+    variants = {
+        "per-row commits": ("per-row", None),
+        "save_many": ("batch", None),
+        "buffer, fsync each": ("batch", 0.0),
+        f"buffer, fsync {fsync_seconds:g}s": ("batch", fsync_seconds),
+    }
+    print(f"{devices} devices, {cycles} cycles {interval}s apart, synchronous={synchronous}")
+    print(f"{'variant':<22}{'commits':>10}{'spool fsyncs':>14}{'write calls':>13}{'KiB':>9}   (per cycle)")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, (mode, fsync_interval) in variants.items():
+            db_path = os.path.join(tmp, name.replace(" ", "_").replace(",", "") + ".db")
+            result = run_variant(db_path, ids, cycles, interval, synchronous, mode, fsync_interval)
+            print(f"{name:<22}{result['commits']:>10.2f}{result['spool_fsyncs']:>14.2f}"
+                  f"{result['write_calls']:>13.1f}{result['kib']:>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=10)
+    parser.add_argument("--cycles", type=int, default=200)
+    parser.add_argument("--interval", type=float, default=0.02, help="seconds between collection cycles")
+    parser.add_argument("--fsync-seconds", type=float, default=0.2,
+                        help="spool fsync interval of the last variant (0.2 with 0.02 s cycles ~ 200 s with 20 s cycles)")
+    parser.add_argument("--synchronous", default="NORMAL", choices=["NORMAL", "FULL"])
+    args = parser.parse_args()
+    run(args.devices, args.cycles, args.interval, args.fsync_seconds, args.synchronous)
+
+
+if __name__ == "__main__":
+    main()
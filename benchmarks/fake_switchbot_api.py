@@ -0,0 +1,176 @@
+"""Local fake of the SwitchBot cloud API for benchmarks and manual testing
+
+Serves ``GET /v1.1/devices/{device_id}/status`` with Plug Mini style bodies,
+with configurable response latency and error rate, and ``GET /v1.1/devices``
+listing the configured plugs plus a hub that does not report power. With a
+``quota``, requests beyond it get 429 (with ``retry_after`` seconds) like
+the real API's daily limit; ``idle_devices`` always report the same small load.
+
+Usage: python -m benchmarks.fake_switchbot_api --port 8100 --latency 0.2
+Then point the server at it with SWITCHBOT_API_BASE_URL=http://127.0.0.1:8100/v1.1
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+from benchmarks.synthetic import device_ids
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops concurrent connects and adds 1s SYN retries
+    request_queue_size = 128
+
+
+class FakeSwitchBotAPI:
+    """Threaded fake SwitchBot API server, usable as a context manager"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0,
+                 error_rate: float = 0.0, seed: Optional[int] = None,
+                 devices: Optional[List[str]] = None, quota: Optional[int] = None,
+                 idle_devices: Optional[List[str]] = None, retry_after: float = 60.0):
+        self.latency = latency
+        self.devices = list(devices or [])
+        self.quota = quota
+        self.idle_devices = set(idle_devices or [])
+        self.retry_after = retry_after
+        self.rate_limited_count = 0
+        self.error_rate = error_rate
+        self.request_count = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), self._handler_class())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1.1"
+
+    def _handler_class(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written separately; without this, delayed ACKs stall keep-alive clients
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status: int, payload: dict):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                with api._lock:
+                    api.request_count += 1
+                    limited = api.quota is not None and api.request_count > api.quota
+                    api.rate_limited_count += limited
+                    fail = api._rng.random() < api.error_rate
+                    power = round(api._rng.uniform(0, 120), 1)
+                if api.latency:
+                    time.sleep(api.latency)
+                if not self.headers.get("Authorization") or not self.headers.get("sign"):
+                    self._send_json(401, {"message": "Unauthorized"})
+                    return
+                if limited:
+                    self.send_response(429)
+                    self.send_header("Retry-After", str(api.retry_after))
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                parts = self.path.strip("/").split("/")
+                if parts[1:] == ["devices"]:
+                    if fail:
+                        self._send_json(500, {"message": "Internal Server Error"})
+                        return
+                    self._send_json(200, {
+                        "statusCode": 100,
+                        "body": {
+                            "deviceList": [{
+                                "deviceId": device_id,
+                                "deviceName": f"Plug {index + 1}",
+                                "deviceType": "Plug Mini (JP)",
+                                "enableCloudService": True,
+                                "hubDeviceId": "",
+                            } for index, device_id in enumerate(api.devices)] + [{
+                                "deviceId": "C0FFEE000000",
+                                "deviceName": "Hub",
+                                "deviceType": "Hub Mini",
+                                "hubDeviceId": "000000000000",
+                            }],
+                            "infraredRemoteList": [],
+                        },
+                        "message": "success",
+                    })
+                    return
+                if len(parts) != 4 or parts[1] != "devices" or parts[3] != "status":
+                    self._send_json(404, {"message": "Not Found"})
+                    return
+                if fail:
+                    self._send_json(500, {"message": "Internal Server Error"})
+                    return
+                if parts[2] in api.idle_devices:
+                    power = 1.2
+                self._send_json(200, {
+                    "statusCode": 100,
+                    "body": {
+                        "deviceId": parts[2],
+                        "deviceType": "Plug Mini (JP)",
+                        "power": "on" if power > 0 else "off",
+                        "voltage": 100.8,
+                        "weight": power,
+                        "electricityOfDay": 120,
+                        "electricCurrent": round(power / 100.8 * 1000, 1),
+                    },
+                    "message": "success",
+                })
+
+        return Handler
+
+    def start(self) -> "FakeSwitchBotAPI":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "FakeSwitchBotAPI":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per response")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of 500 responses")
+    parser.add_argument("--devices", type=int, default=0, help="plugs returned by the device list")
+    parser.add_argument("--quota", type=int, default=None, help="requests served before answering 429")
+    args = parser.parse_args()
+    api = FakeSwitchBotAPI(args.host, args.port, args.latency, args.error_rate,
+                           devices=device_ids(args.devices), quota=args.quota)
+    print(f"Fake SwitchBot API at {api.base_url} (latency {args.latency}s, error rate {args.error_rate})")
+    try:
+        api._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Synthetic SwitchBot Plug Mini readings for benchmarks"""
+
+import math
+import random
+import sqlite3
+import time
+from typing import Iterator, List, Optional, Tuple
+
+INSERT_SQL = '''
+    INSERT INTO power_readings
+    (device_id, timestamp, voltage, electric_current, power, electricity_of_day, power_on)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+def device_ids(count: int) -> List[str]:
+    """Generate Plug Mini style device IDs"""
+    return [f"6055F9{index:06X}" for index in range(count)]
+
+
+def generate_readings(devices: List[str], samples_per_device: int, interval: int = 20,
+                      end: Optional[int] = None, seed: int = 0) -> Iterator[Tuple]:
+    """Yield power_readings rows in insert order (time-major, like the collector)
+
+    Each device follows a daily load curve with noise, so values change slowly
+    between samples the way a real plug does.
+    """
+    rng = random.Random(seed)
+    end = end if end is not None else int(time.time())
+    start = end - (samples_per_device - 1) * interval
+    base_load = {device_id: rng.uniform(5, 120) for device_id in devices}
+    energy = {device_id: 0.0 for device_id in devices}
+    last_day = {device_id: None for device_id in devices}
+
+    for sample in range(samples_per_device):
+        timestamp = start + sample * interval
+        hour = (timestamp % 86400) / 3600
+        day = timestamp // 86400
+        daily_curve = 0.6 + 0.4 * math.sin((hour - 6) / 24 * 2 * math.pi)
+        for device_id in devices:
+            power_on = rng.random() > 0.02
+            power = round(base_load[device_id] * daily_curve * rng.uniform(0.9, 1.1), 1) if power_on else 0.0
+            voltage = round(rng.gauss(101.0, 0.6), 1)
+            if last_day[device_id] != day:
+                energy[device_id] = 0.0
+                last_day[device_id] = day
+            energy[device_id] += power * interval / 3600 / 1000
+            yield (
+                device_id,
+                timestamp,
+                voltage,
+                round(power / voltage * 1000, 1),
+                power,
+                round(energy[device_id] * 1000, 0),
+                power_on,
+            )
+
+
+def fill_database(db_path: str, devices: List[str], samples_per_device: int, batch_size: int = 50000,
+                  interval: int = 20, end: Optional[int] = None) -> int:
+    """Bulk-load synthetic readings into an existing power_readings table"""
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    rows = generate_readings(devices, samples_per_device, interval=interval, end=end)
+    total = 0
+    while True:
+        batch = [row for _, row in zip(range(batch_size), rows)]
+        if not batch:
+            break
+        conn.executemany(INSERT_SQL, batch)
+        total += len(batch)
+    conn.commit()
+    conn.close()
+    return total
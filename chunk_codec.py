@@ -0,0 +1,185 @@
+"""Delta/XOR encoded blocks of readings for compact storage
+
+A chunk holds one device's readings for one period, oldest first, as one
+encoded column per CHUNK_COLUMNS entry behind a small header:
+
+    uint8 version | uint16 rows | for each column: uint8 kind | payload
+
+Timestamps are stored as delta-of-delta (0 for a steady sampling interval)
+and sensor values as deltas of decimal-scaled integers (101.3 V -> 1013),
+each column bit-packed at the width of its largest zigzag value. Columns
+that are not short decimals fall back to Gorilla-style XOR of consecutive
+float64 bit patterns, shifted right by their common trailing zero bits.
+Missing values are kept in a null bitmap (kind | NULLS), so decoding returns
+exactly what was encoded (power_on as bool, like every other storage mode).
+"""
+
+import struct
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+CHUNK_VERSION = 1
+
+# Encoded columns (device_id is implied by the chunk's key)
+CHUNK_COLUMNS = ("timestamp", "voltage", "electric_current", "power", "electricity_of_day", "power_on")
+
+# Integer columns and the delta order they are stored with; the rest are floats
+INTEGER_ORDERS = {"timestamp": 2, "power_on": 0}
+
+# Integer columns decoded as bool
+BOOLEAN_COLUMNS = ("power_on",)
+
+# Column kinds; NULLS is or-ed in when a null bitmap follows the kind byte
+KIND_EMPTY = 0      # every value is null
+KIND_INTEGER = 1    # order, heads, packed zigzag deltas
+KIND_DECIMAL = 2    # decimals, then as KIND_INTEGER
+KIND_XOR = 3        # first bit pattern, shift, packed XORs
+NULLS = 0x80
+
+MAX_DECIMALS = 4
+
+
+def _zigzag(values: np.ndarray) -> np.ndarray:
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def _unzigzag(values: np.ndarray) -> np.ndarray:
+    return (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+
+
+def _pack_bits(values: np.ndarray) -> bytes:
+    """Bit-pack unsigned values at the width of the largest one (uint8 width, then bits)"""
+    width = int(values.max()).bit_length() if values.size else 0
+    if width == 0:
+        return bytes([0])
+    shifts = np.arange(width - 1, -1, -1, dtype=np.uint64)
+    bits = ((values[:, None] >> shifts) & np.uint64(1)).astype(np.uint8)
+    return bytes([width]) + np.packbits(bits).tobytes()
+
+
+def _unpack_bits(data: bytes, offset: int, count: int) -> Tuple[np.ndarray, int]:
+    width = data[offset]
+    offset += 1
+    if width == 0 or count == 0:
+        return np.zeros(count, dtype=np.uint64), offset
+    size = (count * width + 7) // 8
+    bits = np.unpackbits(np.frombuffer(data, np.uint8, size, offset), count=count * width)
+    shifts = np.arange(width - 1, -1, -1, dtype=np.uint64)
+    values = (bits.reshape(count, width).astype(np.uint64) << shifts).sum(axis=1, dtype=np.uint64)
+    return values, offset + size
+
+
+def _encode_integers(values: np.ndarray, order: int) -> bytes:
+    """Store the first value of each of ``order`` difference levels, then the packed last level"""
+    heads = []
+    for _ in range(order):
+        if not values.size:
+            break
+        heads.append(int(values[0]))
+        values = np.diff(values)
+    return struct.pack(f"<B{len(heads)}q", len(heads), *heads) + _pack_bits(_zigzag(values))
+
+
+def _decode_integers(data: bytes, offset: int, count: int) -> Tuple[np.ndarray, int]:
+    levels = data[offset]
+    heads = struct.unpack_from(f"<{levels}q", data, offset + 1)
+    values, offset = _unpack_bits(data, offset + 1 + 8 * levels, count - levels)
+    values = _unzigzag(values)
+    for head in reversed(heads):
+        values = np.concatenate(([head], head + np.cumsum(values)))
+    return values, offset
+
+
+def _decimal_places(values: np.ndarray) -> Optional[int]:
+    """Smallest number of decimals that represents every value exactly, if any"""
+    for decimals in range(MAX_DECIMALS + 1):
+        scale = 10.0 ** decimals
+        scaled = np.round(values * scale)
+        if np.all(np.abs(scaled) < 2 ** 53) and np.array_equal(scaled / scale, values):
+            return decimals
+    return None
+
+
+def _encode_floats(values: np.ndarray) -> bytes:
+    decimals = _decimal_places(values)
+    if decimals is not None:
+        scaled = np.round(values * 10.0 ** decimals).astype(np.int64)
+        return bytes([KIND_DECIMAL, decimals]) + _encode_integers(scaled, 1)
+
+    patterns = values.view(np.uint64)
+    xors = patterns[1:] ^ patterns[:-1]
+    nonzero = xors[xors != 0]
+    # Lowest set bit of each XOR gives its trailing zeros; share the smallest
+    shift = int(np.log2((nonzero & (~nonzero + np.uint64(1))).astype(np.float64)).min()) if nonzero.size else 0
+    return struct.pack("<BQB", KIND_XOR, int(patterns[0]), shift) + _pack_bits(xors >> np.uint64(shift))
+
+
+def _decode_floats(kind: int, data: bytes, offset: int, count: int) -> Tuple[np.ndarray, int]:
+    if kind == KIND_DECIMAL:
+        decimals = data[offset]
+        scaled, offset = _decode_integers(data, offset + 1, count)
+        return scaled / 10.0 ** decimals, offset
+    first, shift = struct.unpack_from("<QB", data, offset)
+    xors, offset = _unpack_bits(data, offset + 9, count - 1)
+    patterns = np.bitwise_xor.accumulate(np.concatenate(([np.uint64(first)], xors << np.uint64(shift))))
+    return patterns.view(np.float64), offset
+
+
+def encode_chunk(columns: Sequence[Sequence]) -> bytes:
+    """Encode CHUNK_COLUMNS value lists (equal length, ascending timestamps) into a chunk"""
+    count = len(columns[0])
+    parts = [struct.pack("<BH", CHUNK_VERSION, count)]
+    for name, values in zip(CHUNK_COLUMNS, columns):
+        nulls = np.fromiter((value is None for value in values), dtype=bool, count=count)
+        present = [value for value in values if value is not None]
+        if not present:
+            parts.append(bytes([KIND_EMPTY]))
+            continue
+
+        if name in INTEGER_ORDERS:
+            encoded = bytes([KIND_INTEGER]) + _encode_integers(np.asarray(present, dtype=np.int64), INTEGER_ORDERS[name])
+        else:
+            encoded = _encode_floats(np.asarray(present, dtype=np.float64))
+        if nulls.any():
+            encoded = bytes([encoded[0] | NULLS]) + np.packbits(nulls).tobytes() + encoded[1:]
+        parts.append(encoded)
+    return b"".join(parts)
+
+
+def decode_chunk(data: bytes) -> List[list]:
+    """Decode a chunk into CHUNK_COLUMNS value lists (None for missing values)"""
+    version, count = struct.unpack_from("<BH", data)
+    if version != CHUNK_VERSION:
+        raise ValueError(f"Unsupported chunk version: {version}")
+    offset = 3
+    columns = []
+    for name in CHUNK_COLUMNS:
+        kind = data[offset]
+        offset += 1
+        nulls = None
+        if kind & NULLS:
+            kind &= ~NULLS
+            size = (count + 7) // 8
+            nulls = np.unpackbits(np.frombuffer(data, np.uint8, size, offset), count=count).astype(bool)
+            offset += size
+        if kind == KIND_EMPTY:
+            columns.append([None] * count)
+            continue
+
+        present = count - int(nulls.sum()) if nulls is not None else count
+        if kind == KIND_INTEGER:
+            values, offset = _decode_integers(data, offset, present)
+        elif kind in (KIND_DECIMAL, KIND_XOR):
+            values, offset = _decode_floats(kind, data, offset, present)
+        else:
+            raise ValueError(f"Unknown chunk column kind: {kind}")
+
+        values = values.tolist()
+        if name in BOOLEAN_COLUMNS:
+            values = [bool(value) for value in values]
+        if nulls is not None:
+            remaining = iter(values)
+            values = [None if missing else next(remaining) for missing in nulls]
+        columns.append(values)
+    return columns
@@ -1,7 +1,9 @@
 #!/usr/bin/env python3
 """
 Data collection script for multiple SwitchBot Plug Mini devices
-This script is called by systemd timer to collect power data from all devices
+This script is called by systemd timer to collect power data from all devices.
+With COLLECTION_SCHEDULER=true the server collects on its own and this script
+is only needed as a manual trigger.
 """
 
 import requests
@@ -1,98 +1,1689 @@
+import heapq
 import json
 import sqlite3
 import os
-from datetime import datetime
-from typing import Dict, List, Optional
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from itertools import groupby, islice, repeat, takewhile
+from operator import itemgetter
+from typing import Callable, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple, Union
+
+from chunk_codec import CHUNK_COLUMNS, decode_chunk, encode_chunk
+from energy import DEFAULT_MAX_GAP, PERIODS as ENERGY_PERIODS, DayTotals, integrate, month_totals
+from exporting import parquet_available, parquet_chunks, read_archive_batches
+
+READING_FIELDS = ("device_id", "timestamp", "voltage", "electric_current", "power", "electricity_of_day", "power_on")
+
+
+def _migration_device_timestamp_index(cursor: sqlite3.Cursor):
+    """Index readings by device and time for latest/range/group-by queries"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_power_readings_device_timestamp
+        ON power_readings (device_id, timestamp)
+    ''')
+
+
+def _migration_timestamp_index(cursor: sqlite3.Cursor):
+    """Index readings by time for all-device exports and retention deletes"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_power_readings_timestamp
+        ON power_readings (timestamp)
+    ''')
+
+
+# Rollup tables, finest first: name -> bucket width in seconds
+ROLLUP_RESOLUTIONS: Dict[str, int] = {
+    "1m": 60,
+    "15m": 900,
+    "1h": 3600,
+}
+
+
+def _rollup_table(resolution: str) -> str:
+    return f"power_rollup_{resolution}"
+
+
+def _rollup_upsert_sql(resolution: str) -> str:
+    """UPSERT that folds one reading into its bucket
+
+    usage_minutes accumulates increments of the electricity_of_day counter,
+    which counts minutes of use (not energy), between consecutive readings
+    (a drop means the counter reset at midnight, so the new value itself is
+    the increment). The first reading of a bucket is compared with the last
+    reading of the previous bucket.
+    """
+    table = _rollup_table(resolution)
+    return f'''
+        INSERT INTO {table} (
+            device_id, bucket, samples,
+            power_min, power_max, power_sum,
+            voltage_min, voltage_max, voltage_sum,
+            current_min, current_max, current_sum,
+            usage_last, usage_minutes
+        )
+        VALUES (
+            :device_id, :bucket, 1,
+            :power, :power, coalesce(:power, 0),
+            :voltage, :voltage, coalesce(:voltage, 0),
+            :electric_current, :electric_current, coalesce(:electric_current, 0),
+            :usage,
+            coalesce((
+                SELECT CASE
+                    WHEN usage_last IS NULL THEN 0
+                    WHEN :usage >= usage_last THEN :usage - usage_last
+                    ELSE :usage
+                END
+                FROM {table}
+                WHERE device_id = :device_id AND bucket < :bucket
+                ORDER BY bucket DESC
+                LIMIT 1
+            ), 0)
+        )
+        ON CONFLICT (device_id, bucket) DO UPDATE SET
+            samples = samples + 1,
+            power_min = coalesce(min(power_min, excluded.power_min), power_min, excluded.power_min),
+            power_max = coalesce(max(power_max, excluded.power_max), power_max, excluded.power_max),
+            power_sum = power_sum + excluded.power_sum,
+            voltage_min = coalesce(min(voltage_min, excluded.voltage_min), voltage_min, excluded.voltage_min),
+            voltage_max = coalesce(max(voltage_max, excluded.voltage_max), voltage_max, excluded.voltage_max),
+            voltage_sum = voltage_sum + excluded.voltage_sum,
+            current_min = coalesce(min(current_min, excluded.current_min), current_min, excluded.current_min),
+            current_max = coalesce(max(current_max, excluded.current_max), current_max, excluded.current_max),
+            current_sum = current_sum + excluded.current_sum,
+            usage_minutes = usage_minutes + coalesce(CASE
+                WHEN usage_last IS NULL THEN 0
+                WHEN excluded.usage_last >= usage_last THEN excluded.usage_last - usage_last
+                ELSE excluded.usage_last
+            END, 0),
+            usage_last = coalesce(excluded.usage_last, usage_last)
+    '''
+
+
+ROLLUP_UPSERT_SQL = {resolution: _rollup_upsert_sql(resolution) for resolution in ROLLUP_RESOLUTIONS}
+
+# Raw columns returned by bulk queries (no id/created_at bookkeeping columns)
+RAW_SELECT_COLUMNS = ", ".join(READING_FIELDS)
+
+# Rollup rows exposed with the same names as raw readings (averages) plus min/max/samples
+ROLLUP_SELECT_COLUMNS = '''
+    device_id, bucket AS timestamp, samples,
+    power_sum / samples AS power, power_min, power_max,
+    voltage_sum / samples AS voltage, voltage_min, voltage_max,
+    current_sum / samples AS electric_current,
+    current_min AS electric_current_min, current_max AS electric_current_max,
+    usage_last AS electricity_of_day, usage_minutes
+'''
+
+
+def _migration_rollup_tables(cursor: sqlite3.Cursor):
+    """Create per-resolution rollup tables and backfill them from raw readings"""
+    for resolution, seconds in ROLLUP_RESOLUTIONS.items():
+        table = _rollup_table(resolution)
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                device_id TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                samples INTEGER NOT NULL,
+                power_min REAL,
+                power_max REAL,
+                power_sum REAL NOT NULL DEFAULT 0,
+                voltage_min REAL,
+                voltage_max REAL,
+                voltage_sum REAL NOT NULL DEFAULT 0,
+                current_min REAL,
+                current_max REAL,
+                current_sum REAL NOT NULL DEFAULT 0,
+                energy_last REAL,
+                energy_delta REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (device_id, bucket)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute(f'''
+            INSERT OR REPLACE INTO {table}
+            SELECT device_id, bucket, COUNT(*),
+                   MIN(power), MAX(power), TOTAL(power),
+                   MIN(voltage), MAX(voltage), TOTAL(voltage),
+                   MIN(electric_current), MAX(electric_current), TOTAL(electric_current),
+                   MAX(energy_last), TOTAL(energy_increment)
+            FROM (
+                SELECT device_id, bucket, power, voltage, electric_current,
+                       FIRST_VALUE(electricity_of_day) OVER (
+                           PARTITION BY device_id, bucket ORDER BY timestamp DESC
+                       ) AS energy_last,
+                       CASE
+                           WHEN previous_energy IS NULL THEN 0
+                           WHEN electricity_of_day >= previous_energy THEN electricity_of_day - previous_energy
+                           ELSE electricity_of_day
+                       END AS energy_increment
+                FROM (
+                    SELECT *, timestamp - timestamp % {seconds} AS bucket,
+                           LAG(electricity_of_day) OVER (
+                               PARTITION BY device_id ORDER BY timestamp
+                           ) AS previous_energy
+                    FROM power_readings
+                )
+            )
+            GROUP BY device_id, bucket
+        ''')
+
+
+def _migration_rollup_bucket_indexes(cursor: sqlite3.Cursor):
+    """Index rollup tables on bucket so retention can find expired rows without a scan"""
+    for resolution in ROLLUP_RESOLUTIONS:
+        table = _rollup_table(resolution)
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_bucket ON {table}(bucket)")
+
+
+# Energy totals per device and local day/month, integrated from power as
+# readings are saved (see energy.py). power_energy_state holds each device's
+# last integrated reading, so integration continues across batches.
+ENERGY_TABLES = {"day": "power_energy_daily", "month": "power_energy_monthly"}
+
+
+def _migration_energy_tables(cursor: sqlite3.Cursor):
+    """Create the daily/monthly energy tables (filled by PowerDataStorage.rebuild_energy)"""
+    for period, table in ENERGY_TABLES.items():
+        cursor.execute(f'''
+            CREATE TABLE IF NOT EXISTS {table} (
+                device_id TEXT NOT NULL,
+                {period} TEXT NOT NULL,
+                energy_wh REAL NOT NULL DEFAULT 0,
+                covered_seconds INTEGER NOT NULL DEFAULT 0,
+                gap_seconds INTEGER NOT NULL DEFAULT 0,
+                samples INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (device_id, {period})
+            ) WITHOUT ROWID
+        ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS power_energy_state (
+            device_id TEXT PRIMARY KEY,
+            timestamp INTEGER NOT NULL,
+            power REAL
+        ) WITHOUT ROWID
+    ''')
+
+
+def _energy_upsert_sql(period: str) -> str:
+    """UPSERT that adds integrated totals to a device's day or month"""
+    table = ENERGY_TABLES[period]
+    return f'''
+        INSERT INTO {table} (device_id, {period}, energy_wh, covered_seconds, gap_seconds, samples)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (device_id, {period}) DO UPDATE SET
+            energy_wh = energy_wh + excluded.energy_wh,
+            covered_seconds = covered_seconds + excluded.covered_seconds,
+            gap_seconds = gap_seconds + excluded.gap_seconds,
+            samples = samples + excluded.samples
+    '''
+
+
+ENERGY_UPSERT_SQL = {period: _energy_upsert_sql(period) for period in ENERGY_TABLES}
+
+
+# Device registry: one row per known device, so discovering devices never
+# scans readings. first_seen/last_seen follow saved readings; name, type and
+# synced_at come from the SwitchBot device list; disabled devices are kept
+# but not collected.
+DEVICE_FIELDS = ("device_id", "name", "device_type", "enabled", "first_seen", "last_seen", "synced_at")
+
+
+def _migration_devices_table(cursor: sqlite3.Cursor):
+    """Create the device registry (filled from readings on the next start)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS devices (
+            device_id TEXT PRIMARY KEY,
+            name TEXT,
+            device_type TEXT,
+            enabled INTEGER NOT NULL DEFAULT 1,
+            first_seen INTEGER,
+            last_seen INTEGER,
+            synced_at INTEGER
+        ) WITHOUT ROWID
+    ''')
+
+
+DEVICE_SEEN_SQL = '''
+    INSERT INTO devices (device_id, first_seen, last_seen) VALUES (?, ?, ?)
+    ON CONFLICT (device_id) DO UPDATE SET
+        first_seen = MIN(COALESCE(first_seen, excluded.first_seen), excluded.first_seen),
+        last_seen = MAX(COALESCE(last_seen, excluded.last_seen), excluded.last_seen)
+'''
+
+
+# Reading counters: each device's raw reading count and first/last timestamp,
+# updated in the same transaction as every insert and delete so statistics
+# never scan readings. A reading that replaces one with the same device and
+# timestamp is counted again until an exact recount reconciles the counters.
+READING_STATS_FIELDS = ("device_id", "record_count", "first_record", "last_record")
+
+
+def _migration_reading_stats_table(cursor: sqlite3.Cursor):
+    """Create the reading counters table (counted from readings on the next start)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reading_stats (
+            device_id TEXT PRIMARY KEY,
+            record_count INTEGER NOT NULL,
+            first_record INTEGER,
+            last_record INTEGER
+        ) WITHOUT ROWID
+    ''')
+
+
+READING_STATS_ADD_SQL = '''
+    INSERT INTO reading_stats (device_id, record_count, first_record, last_record) VALUES (?, ?, ?, ?)
+    ON CONFLICT (device_id) DO UPDATE SET
+        record_count = record_count + excluded.record_count,
+        first_record = MIN(COALESCE(first_record, excluded.first_record), excluded.first_record),
+        last_record = MAX(COALESCE(last_record, excluded.last_record), excluded.last_record)
+'''
+
+
+def _migration_rollup_usage_columns(cursor: sqlite3.Cursor):
+    """Rename rollup energy_last/energy_delta, which hold electricity_of_day (minutes of use), not energy"""
+    for resolution in ROLLUP_RESOLUTIONS:
+        table = _rollup_table(resolution)
+        cursor.execute(f"ALTER TABLE {table} RENAME COLUMN energy_last TO usage_last")
+        cursor.execute(f"ALTER TABLE {table} RENAME COLUMN energy_delta TO usage_minutes")
+
+
+# Detection events: anomalies and threshold crossings found by the anomaly
+# detection engine, newest looked up first.
+EVENT_FIELDS = ("id", "device_id", "rule", "timestamp", "value", "message")
+
+
+def _migration_events_table(cursor: sqlite3.Cursor):
+    """Create the detection events table"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            device_id TEXT NOT NULL,
+            rule TEXT NOT NULL,
+            timestamp INTEGER NOT NULL,
+            value REAL,
+            message TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_events_timestamp ON events (timestamp)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_events_device_timestamp ON events (device_id, timestamp)")
+
+
+# Time partitioning: raw readings live in one WITHOUT ROWID table per period
+# (e.g. power_readings_p202610) and power_readings becomes a UNION ALL view
+# over them, so retention drops whole tables instead of deleting rows.
+PARTITION_PERIODS = ("month", "day")
+PARTITION_PREFIX = "power_readings_p"
+PARTITION_COLUMNS = "device_id, timestamp, voltage, electric_current, power, electricity_of_day, power_on, created_at"
+
+
+def _with_timestamps(readings: List[Dict]) -> List[Dict]:
+    """Stamp readings that have no timestamp with the write time (timestamp is NOT NULL everywhere)"""
+    if all(data.get("timestamp") is not None for data in readings):
+        return readings
+    now = int(time.time())
+    return [data if data.get("timestamp") is not None else {**data, "timestamp": now} for data in readings]
+
+
+def _partition_key(timestamp: int, period: str) -> str:
+    """Partition key (UTC YYYYMM or YYYYMMDD) of a timestamp"""
+    moment = datetime.fromtimestamp(timestamp, timezone.utc)
+    return moment.strftime("%Y%m" if period == "month" else "%Y%m%d")
+
+
+def _partition_bounds(key: str) -> Tuple[int, int]:
+    """[start, end) timestamps covered by a partition key"""
+    if len(key) == 6:
+        start = datetime(int(key[:4]), int(key[4:]), 1, tzinfo=timezone.utc)
+        end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1, tzinfo=timezone.utc)
+    else:
+        start = datetime(int(key[:4]), int(key[4:6]), int(key[6:]), tzinfo=timezone.utc)
+        end = start + timedelta(days=1)
+    return int(start.timestamp()), int(end.timestamp())
+
+
+def _create_partition(cursor: sqlite3.Cursor, key: str):
+    """Create a partition table and its timestamp index if missing"""
+    table = PARTITION_PREFIX + key
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            device_id TEXT NOT NULL,
+            timestamp INTEGER NOT NULL,
+            voltage REAL,
+            electric_current REAL,
+            power REAL,
+            electricity_of_day REAL,
+            power_on BOOLEAN,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (device_id, timestamp)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_timestamp ON {table}(timestamp)")
+
+
+def _create_partition_view(cursor: sqlite3.Cursor, keys: List[str]):
+    """(Re)create the power_readings view over the given partitions"""
+    cursor.execute("DROP VIEW IF EXISTS power_readings")
+    cursor.execute("CREATE VIEW power_readings AS " + " UNION ALL ".join(
+        f"SELECT {PARTITION_COLUMNS} FROM {PARTITION_PREFIX}{key}" for key in sorted(keys)
+    ))
+
+
+# Compact storage: device IDs become integer keys from a dictionary table and
+# rows drop the id/created_at bookkeeping columns. In "chunks" mode, closed
+# device-hours are also sealed into delta/XOR encoded blobs (chunk_codec).
+# power_readings becomes a view over the unsealed rows, and the raw readers
+# below merge in the decoded chunks.
+COMPACT_MODES = ("rows", "chunks")
+COMPACT_COLUMNS = ", ".join(CHUNK_COLUMNS)
+CHUNK_SECONDS = 3600
+
+
+def _create_compact_tables(cursor: sqlite3.Cursor):
+    """Create the device dictionary, unsealed sample and chunk tables if missing"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS device_keys (
+            device_key INTEGER PRIMARY KEY,
+            device_id TEXT NOT NULL UNIQUE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS power_samples (
+            device_key INTEGER NOT NULL,
+            timestamp INTEGER NOT NULL,
+            voltage REAL,
+            electric_current REAL,
+            power REAL,
+            electricity_of_day REAL,
+            power_on BOOLEAN,
+            PRIMARY KEY (device_key, timestamp)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_power_samples_timestamp ON power_samples(timestamp)")
+    # A rowid table: chunks are several hundred bytes, too wide for WITHOUT ROWID
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS power_chunks (
+            chunk_id INTEGER PRIMARY KEY,
+            device_key INTEGER NOT NULL,
+            bucket INTEGER NOT NULL,
+            samples INTEGER NOT NULL,
+            first_timestamp INTEGER NOT NULL,
+            last_timestamp INTEGER NOT NULL,
+            data BLOB NOT NULL,
+            UNIQUE (device_key, bucket)
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_power_chunks_bucket ON power_chunks(bucket)")
+
+
+def _create_compact_view(cursor: sqlite3.Cursor):
+    """(Re)create the power_readings view over the unsealed compact rows"""
+    cursor.execute("DROP VIEW IF EXISTS power_readings")
+    cursor.execute(f'''
+        CREATE VIEW power_readings AS
+        SELECT k.device_id, {", ".join("s." + column for column in CHUNK_COLUMNS)}
+        FROM power_samples s JOIN device_keys k ON k.device_key = s.device_key
+    ''')
+
+
+POWER_ON_INDEX = READING_FIELDS.index("power_on")
+
+
+def _reading_tuple(row: tuple) -> tuple:
+    """A READING_FIELDS row with power_on as bool (SQLite stores it as 0/1), like decoded chunks"""
+    power_on = row[POWER_ON_INDEX]
+    if power_on is None or isinstance(power_on, bool):
+        return row
+    return (*row[:POWER_ON_INDEX], bool(power_on), *row[POWER_ON_INDEX + 1:])
+
+
+def _reading_dict(row: sqlite3.Row) -> Dict:
+    """A power_readings row as a dict with power_on as bool"""
+    data = dict(row)
+    if data.get("power_on") is not None:
+        data["power_on"] = bool(data["power_on"])
+    return data
+
+
+def _decode_chunk_rows(device_id: str, data: bytes) -> List[tuple]:
+    """Decode a chunk into READING_FIELDS tuples, oldest first"""
+    return list(zip(repeat(device_id), *decode_chunk(data)))
+
+
+# Ordered schema migrations. The database records the last applied version in
+# PRAGMA user_version, so only append new entries and never renumber old ones.
+MIGRATIONS: List[Tuple[int, str, Callable[[sqlite3.Cursor], None]]] = [
+    (1, "index power_readings on (device_id, timestamp)", _migration_device_timestamp_index),
+    (2, "index power_readings on (timestamp)", _migration_timestamp_index),
+    (3, "add 1m/15m/1h rollup tables", _migration_rollup_tables),
+    (4, "index rollup tables on (bucket)", _migration_rollup_bucket_indexes),
+    (5, "add daily/monthly energy tables", _migration_energy_tables),
+    (6, "add devices registry table", _migration_devices_table),
+    (7, "add reading counters table", _migration_reading_stats_table),
+    (8, "add detection events table", _migration_events_table),
+    (9, "rename rollup energy columns to electricity_of_day usage minutes", _migration_rollup_usage_columns),
+]
+
+AUTO_VACUUM_MODES = {0: "none", 1: "full", 2: "incremental"}
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# Applied to every pooled connection. WAL lets readers run alongside the
+# collector's writes, and synchronous=NORMAL only fsyncs at checkpoints.
+DEFAULT_PRAGMAS: Dict[str, object] = {
+    "auto_vacuum": "INCREMENTAL",  # only takes effect on a new, empty database
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -16000,        # KiB (16 MB page cache per connection)
+    "mmap_size": 268435456,      # 256 MB of the file mapped for reads
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,        # ms to wait for a lock instead of failing
+}
+
+
+class ConnectionManager:
+    """Thread-local pool of long-lived SQLite connections
+
+    Each thread gets its own connection on first use and keeps it, so the file
+    open, pragma setup and schema parse happen once per thread instead of once
+    per query. Statements are compiled once per connection and reused from
+    sqlite3's statement cache as long as callers pass constant SQL text.
+    """
+
+    def __init__(self, db_path: str, pragmas: Optional[Dict[str, object]] = None,
+                 cached_statements: int = 256):
+        self.db_path = db_path
+        self.pragmas = dict(DEFAULT_PRAGMAS if pragmas is None else pragmas)
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: List[sqlite3.Connection] = []
+
+    def _open(self) -> sqlite3.Connection:
+        # check_same_thread=False only so close_all() can run from the shutdown
+        # thread; each connection is otherwise used by the thread that made it.
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.pragmas.get("busy_timeout", 5000) / 1000,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    def open(self) -> sqlite3.Connection:
+        """Open an unpooled connection with the same pragmas (the caller closes it)"""
+        return self._open()
+
+    def get(self) -> sqlite3.Connection:
+        """Get the calling thread's connection, opening it on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._open()
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Run a block of writes in one transaction, rolling back on error"""
+        conn = self.get()
+        with conn:
+            yield conn
+
+    def close_all(self):
+        """Close every connection handed out by this manager"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+
+
+class WriteBuffer:
+    """Write-behind buffer that batches readings into one transaction per flush
+
+    Readings are appended to a spool file next to the database before they
+    are acknowledged, so a crash or restart replays them on the next start
+    instead of losing them. The spool is fsynced on every batch by default;
+    with ``fsync_interval`` > 0 it is fsynced at most once per that many
+    seconds, trading up to that much data on power loss for fewer flash
+    writes. A flush inserts everything pending with executemany in a single
+    transaction and then truncates the spool (in place and without an fsync
+    when nothing is left). Flushes happen when ``max_rows`` readings are pending, when the
+    oldest pending reading is ``max_age`` seconds old, and on close().
+    Readings that would take the buffer past ``capacity`` first flush it in
+    the caller's thread; if that flush fails they are rejected, so a locked
+    or broken database surfaces as failed saves instead of unbounded growth.
+    Delivery is at-least-once: a crash or power loss between commit and spool
+    truncation leaves already committed rows in the spool, so the first flush
+    after recovery goes through ``replay`` (defaulting to ``insert``), which
+    is expected to skip readings that are already stored.
+    """
+
+    def __init__(self, insert: Callable[[List[Dict]], None], spool_path: str,
+                 max_rows: int = 100, max_age: float = 60.0, capacity: int = 10000,
+                 fsync_interval: float = 0.0, replay: Optional[Callable[[List[Dict]], None]] = None):
+        self.insert = insert
+        self.replay = replay or insert
+        self.spool_path = spool_path
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.capacity = capacity
+        self.fsync_interval = fsync_interval
+        
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._pending: List[Dict] = []
+        self._oldest: Optional[float] = None
+        self._last_fsync = 0.0
+        
+        self.rows_buffered = 0
+        self.rows_flushed = 0
+        self.rows_recovered = 0
+        self.flushes = 0
+        self.flush_failures = 0
+        self.forced_flushes = 0
+        self.rows_rejected = 0
+        self.fsyncs = 0
+        self.high_water_mark = 0
+        self.last_flush_duration: Optional[float] = None
+        self.last_flush_error: Optional[str] = None
+        
+        self._recover()
+        self._spool = open(self.spool_path, "a", encoding="utf-8")
+        self._thread = threading.Thread(target=self._flush_loop, name="write-buffer", daemon=True)
+        self._thread.start()
+    
+    def _recover(self):
+        """Load readings left in the spool by a previous run"""
+        if not os.path.exists(self.spool_path):
+            return
+        with open(self.spool_path, encoding="utf-8") as spool:
+            for line in spool:
+                try:
+                    self._pending.append(json.loads(line))
+                except ValueError:
+                    # A torn final line from a crash mid-write
+                    continue
+        if self._pending:
+            self._oldest = time.monotonic()
+            self.rows_recovered = len(self._pending)
+            self.high_water_mark = len(self._pending)
+            print(f"Recovered {self.rows_recovered} buffered readings from {self.spool_path}")
+    
+    def add(self, data: Dict) -> bool:
+        """Buffer one reading; flushes inline when the buffer is at capacity"""
+        return self.add_many([data])
+    
+    def add_many(self, readings: List[Dict]) -> bool:
+        """Buffer readings with at most one spool fsync; False if they were rejected
+
+        At capacity the buffer is flushed inline first, and the readings are
+        rejected if that flush fails. Once the buffer is closed, readings are
+        inserted directly instead.
+        """
+        batch = [{field: data.get(field) for field in READING_FIELDS} for data in readings]
+        if self._full(len(batch)):
+            # Backpressure: the caller pays for the flush instead of growing the buffer
+            self.forced_flushes += 1
+            if not self.flush() or self._full(len(batch)):
+                self.rows_rejected += len(batch)
+                return False
+        with self._lock:
+            closed = self._closed
+            if not closed:
+                self._spool.write("".join(json.dumps(reading) + "\n" for reading in batch))
+                self._spool.flush()
+                self._sync_spool()
+                self._pending.extend(batch)
+                if self._oldest is None:
+                    self._oldest = time.monotonic()
+                self.rows_buffered += len(batch)
+                pending = len(self._pending)
+                self.high_water_mark = max(self.high_water_mark, pending)
+        if closed:
+            self.insert(batch)
+            return True
+        
+        if pending >= self.max_rows:
+            self._wake.set()
+        return True
+    
+    def _sync_spool(self):
+        """fsync the spool unless it was fsynced less than ``fsync_interval`` seconds ago"""
+        now = time.monotonic()
+        if self.fsync_interval <= 0 or now - self._last_fsync >= self.fsync_interval:
+            os.fsync(self._spool.fileno())
+            self._last_fsync = now
+            self.fsyncs += 1
+    
+    def _full(self, rows: int) -> bool:
+        """Whether adding ``rows`` readings would take a non-empty buffer past capacity"""
+        with self._lock:
+            return not self._closed and bool(self._pending) and len(self._pending) + rows > self.capacity
+    
+    def pending_readings(self) -> List[Dict]:
+        """Get copies of the readings not yet written"""
+        with self._lock:
+            return [dict(reading) for reading in self._pending]
+    
+    def flush(self) -> bool:
+        """Write all pending readings in one transaction"""
+        with self._flush_lock:
+            with self._lock:
+                batch = list(self._pending)
+            if not batch:
+                return True
+            
+            started = time.monotonic()
+            try:
+                # Recovered rows may already have been committed before the crash
+                (self.replay if self.rows_recovered and not self.flushes else self.insert)(batch)
+            except Exception as e:
+                self.flush_failures += 1
+                self.last_flush_error = str(e)
+                print(f"Error flushing write buffer: {e}")
+                return False
+            
+            with self._lock:
+                # Keep readings that arrived while the batch was being written
+                self._pending = self._pending[len(batch):]
+                self._oldest = time.monotonic() if self._pending else None
+                self._rewrite_spool()
+            self.rows_flushed += len(batch)
+            self.flushes += 1
+            self.last_flush_duration = round(time.monotonic() - started, 4)
+            self.last_flush_error = None
+            return True
+    
+    def _rewrite_spool(self):
+        if not self._pending:
+            # Not fsynced: if the truncation is lost, replay skips the stored rows
+            self._spool.truncate(0)
+            return
+        self._spool.close()
+        tmp_path = self.spool_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as spool:
+            spool.writelines(json.dumps(reading) + "\n" for reading in self._pending)
+            spool.flush()
+            os.fsync(spool.fileno())
+            self.fsyncs += 1
+        os.replace(tmp_path, self.spool_path)
+        self._spool = open(self.spool_path, "a", encoding="utf-8")
+    
+    def _flush_loop(self):
+        while not self._closed:
+            with self._lock:
+                oldest = self._oldest
+                pending = len(self._pending)
+            if oldest is None:
+                timeout = self.max_age
+            else:
+                timeout = max(0.0, oldest + self.max_age - time.monotonic())
+            if pending >= self.max_rows or (oldest is not None and timeout == 0.0):
+                if not self.flush():
+                    # Retry later instead of spinning on a locked or broken database
+                    self._wake.wait(self.max_age)
+                    self._wake.clear()
+                continue
+            self._wake.wait(timeout)
+            self._wake.clear()
+    
+    def close(self):
+        """Flush remaining readings and stop the background flusher (later readings are inserted directly)"""
+        with self._lock:
+            self._closed = True
+        self._wake.set()
+        self._thread.join(timeout=5)
+        self.flush()
+        with self._lock:
+            self._spool.close()
+            if not self._pending:
+                os.remove(self.spool_path)
+    
+    def metrics(self) -> Dict:
+        """Buffer depth, throughput and backpressure counters"""
+        with self._lock:
+            pending = len(self._pending)
+            oldest = self._oldest
+        return {
+            "pending_rows": pending,
+            "oldest_pending_age_seconds": round(time.monotonic() - oldest, 1) if oldest is not None else None,
+            "capacity": self.capacity,
+            "utilization": round(pending / self.capacity, 4),
+            "high_water_mark": self.high_water_mark,
+            "max_rows": self.max_rows,
+            "max_age_seconds": self.max_age,
+            "rows_buffered": self.rows_buffered,
+            "rows_flushed": self.rows_flushed,
+            "rows_recovered": self.rows_recovered,
+            "flushes": self.flushes,
+            "forced_flushes": self.forced_flushes,
+            "flush_failures": self.flush_failures,
+            "rows_rejected": self.rows_rejected,
+            "fsyncs": self.fsyncs,
+            "fsync_interval_seconds": self.fsync_interval,
+            "last_flush_duration_seconds": self.last_flush_duration,
+            "last_flush_error": self.last_flush_error,
+        }
+
+
+class LatestReadingCache:
+    """Newest reading of every device, kept in memory
+
+    Warmed from the database once and then updated on every save, so
+    latest-value lookups never touch SQLite. Readings only replace the cached
+    one if they are at least as new, and callers get copies.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.readings: Dict[str, Dict] = {}
+    
+    def warm(self, conn: sqlite3.Connection):
+        """Replace the cache with each device's newest stored reading"""
+        # SQLite takes bare columns from the row holding MAX(timestamp)
+        columns = ", ".join("MAX(timestamp)" if field == "timestamp" else field for field in READING_FIELDS)
+        rows = conn.execute(f'''
+            SELECT {columns}
+            FROM power_readings
+            GROUP BY device_id
+        ''').fetchall()
+        with self.lock:
+            self.readings = {row[0]: dict(zip(READING_FIELDS, _reading_tuple(row))) for row in rows}
+    
+    def update(self, readings: Iterable[Dict]):
+        """Record saved readings that are newer than the cached ones"""
+        with self.lock:
+            for data in readings:
+                device_id, timestamp = data.get("device_id"), data.get("timestamp")
+                if device_id is None or timestamp is None:
+                    continue
+                current = self.readings.get(device_id)
+                if current is None or timestamp >= current["timestamp"]:
+                    self.readings[device_id] = {field: data.get(field) for field in READING_FIELDS}
+    
+    def get(self, device_id: str) -> Optional[Dict]:
+        """Get a copy of a device's newest reading"""
+        with self.lock:
+            reading = self.readings.get(device_id)
+            return dict(reading) if reading is not None else None
+    
+    def get_all(self) -> Dict[str, Dict]:
+        """Get copies of every device's newest reading"""
+        with self.lock:
+            return {device_id: dict(reading) for device_id, reading in self.readings.items()}
+
+
+class DeviceRegistry:
+    """Rows of the devices table, kept in memory
+
+    Loaded once and reloaded after registry writes (the table is small);
+    saves only move first_seen/last_seen here, so listing devices on every
+    collection cycle or dashboard refresh never touches SQLite. Callers get
+    copies.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.devices: Dict[str, Dict] = {}
+    
+    def load(self, conn: sqlite3.Connection):
+        """Replace the registry with the devices table"""
+        rows = conn.execute(f"SELECT {', '.join(DEVICE_FIELDS)} FROM devices").fetchall()
+        devices = {}
+        for row in rows:
+            device = dict(zip(DEVICE_FIELDS, row))
+            device["enabled"] = bool(device["enabled"])
+            devices[device["device_id"]] = device
+        with self.lock:
+            self.devices = devices
+    
+    def seen(self, spans: Iterable[Tuple[str, int, int]]):
+        """Widen devices' first/last seen timestamps, adding devices not seen before"""
+        with self.lock:
+            for device_id, first, last in spans:
+                device = self.devices.get(device_id)
+                if device is None:
+                    self.devices[device_id] = {
+                        **dict.fromkeys(DEVICE_FIELDS),
+                        "device_id": device_id,
+                        "enabled": True,
+                        "first_seen": first,
+                        "last_seen": last
+                    }
+                    continue
+                device["first_seen"] = first if device["first_seen"] is None else min(device["first_seen"], first)
+                device["last_seen"] = last if device["last_seen"] is None else max(device["last_seen"], last)
+    
+    def get(self, device_id: str) -> Optional[Dict]:
+        """Get a copy of a device's registry entry"""
+        with self.lock:
+            device = self.devices.get(device_id)
+            return dict(device) if device is not None else None
+    
+    def get_all(self) -> List[Dict]:
+        """Get copies of every registry entry, ordered by device ID"""
+        with self.lock:
+            return [dict(self.devices[device_id]) for device_id in sorted(self.devices)]
+
+
+class ReadingCounters:
+    """Rows of the reading_stats table, kept in memory
+
+    Saves and deletes apply the same change to the counters after they
+    commit, so statistics never touch SQLite.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats: Dict[str, List] = {}
+    
+    def load(self, conn: sqlite3.Connection):
+        """Replace the counters with the reading_stats table"""
+        rows = conn.execute(f"SELECT {', '.join(READING_STATS_FIELDS)} FROM reading_stats").fetchall()
+        with self.lock:
+            self.stats = {row[0]: list(row[1:]) for row in rows}
+    
+    def add(self, counts: Iterable[Tuple[str, int, int, int]]):
+        """Count saved readings, given as (device_id, count, first timestamp, last timestamp)"""
+        with self.lock:
+            for device_id, count, first, last in counts:
+                stats = self.stats.get(device_id)
+                if stats is None:
+                    self.stats[device_id] = [count, first, last]
+                    continue
+                stats[0] += count
+                stats[1] = first if stats[1] is None else min(stats[1], first)
+                stats[2] = last if stats[2] is None else max(stats[2], last)
+    
+    def remove(self, device_id: str, count: int, first: Optional[int]):
+        """Count deleted readings; ``first`` is the oldest remaining one (None if none remain)"""
+        with self.lock:
+            stats = self.stats.get(device_id)
+            if stats is None:
+                return
+            if first is None:
+                del self.stats[device_id]
+                return
+            stats[0] = max(stats[0] - count, 0)
+            stats[1] = first
+    
+    def get_all(self) -> Dict[str, Tuple[int, Optional[int], Optional[int]]]:
+        """Get (record_count, first_record, last_record) of every device with readings"""
+        with self.lock:
+            return {device_id: tuple(stats) for device_id, stats in self.stats.items()}
+
+
+class HistoryCache:
+    """Bounded LRU of recent history query results with a TTL
+
+    Entries are tagged with the devices they cover and dropped whenever one of
+    those devices is written, so the TTL only bounds how far a relative
+    ("last N hours") window may slide before it is re-read. Cached values are
+    shared between callers and must be treated as read-only.
+    """
+    
+    def __init__(self, max_entries: int = 128, ttl: float = 30.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[Hashable, Tuple[float, frozenset, object]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+    
+    def get(self, key: Hashable):
+        """Get a fresh cached value, or None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl:
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+    
+    def put(self, key: Hashable, device_ids: Iterable[str], value):
+        """Cache a value covering ``device_ids``, evicting the least recently used"""
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic(), frozenset(device_ids), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def invalidate(self, device_ids: Optional[Iterable[str]] = None):
+        """Drop entries covering any of ``device_ids`` (all entries if None)"""
+        with self.lock:
+            if device_ids is None:
+                self.invalidations += len(self.entries)
+                self.entries.clear()
+                return
+            device_ids = set(device_ids)
+            stale = [key for key, (_, devices, _) in self.entries.items() if devices & device_ids]
+            for key in stale:
+                del self.entries[key]
+            self.invalidations += len(stale)
+    
+    def metrics(self) -> Dict:
+        """Cache counters for monitoring"""
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
 
 
 class PowerDataStorage:
-    def __init__(self, db_path: str = "power_data.db"):
+    def __init__(self, db_path: str = "power_data.db", without_rowid: bool = False,
+                 pragmas: Optional[Dict[str, object]] = None,
+                 history_cache_size: int = 128, history_cache_ttl: float = 30.0,
+                 partition: Optional[str] = None, compact: Optional[str] = None,
+                 energy_max_gap: int = DEFAULT_MAX_GAP):
+        if partition is not None and partition not in PARTITION_PERIODS:
+            raise ValueError(f"partition must be one of: {', '.join(PARTITION_PERIODS)}")
+        if compact is not None and compact not in COMPACT_MODES:
+            raise ValueError(f"compact must be one of: {', '.join(COMPACT_MODES)}")
+        if partition and compact:
+            raise ValueError("partition and compact storage cannot be combined")
         self.db_path = db_path
+        self.without_rowid = without_rowid
+        self.partition = partition
+        self.compact = compact
+        self.energy_max_gap = energy_max_gap
+        self.archive_dir = db_path + ".archive"
+        # Retention age in seconds per "raw"/rollup resolution (None = kept forever),
+        # set by the retention policy so history never picks a truncated source
+        self.retention: Dict[str, Optional[int]] = {}
+        self._partition_keys: Optional[set] = None
+        self._device_keys: Dict[str, int] = {}
+        self._sealed_before = 0
+        self.connections = ConnectionManager(db_path, pragmas)
+        self.write_buffer: Optional[WriteBuffer] = None
+        self.latest_cache = LatestReadingCache()
+        self.devices = DeviceRegistry()
+        self.reading_counters = ReadingCounters()
+        self.history_cache = HistoryCache(history_cache_size, history_cache_ttl)
+        self.save_listeners: List[Callable[[List[Dict]], None]] = []
         self.init_database()
+        self._warm_latest_cache()
+    
+    def connection(self) -> sqlite3.Connection:
+        """Get the calling thread's pooled connection (do not close it)"""
+        return self.connections.get()
+    
+    def enable_write_buffer(self, max_rows: int = 100, max_age: float = 60.0,
+                            capacity: int = 10000, fsync_interval: float = 0.0) -> WriteBuffer:
+        """Route saves through a WriteBuffer, replaying any readings spooled by a previous run"""
+        if self.write_buffer is None:
+            self.write_buffer = WriteBuffer(
+                self._insert_readings,
+                self.db_path + ".spool",
+                max_rows=max_rows,
+                max_age=max_age,
+                capacity=capacity,
+                fsync_interval=fsync_interval,
+                replay=self._replay_readings
+            )
+            self.latest_cache.update(self.write_buffer.pending_readings())
+        return self.write_buffer
+    
+    def add_save_listener(self, listener: Callable[[List[Dict]], None]):
+        """Call ``listener`` with every batch of successfully saved readings"""
+        self.save_listeners.append(listener)
+    
+    def close(self):
+        """Flush buffered readings and close all pooled connections"""
+        if self.write_buffer is not None:
+            self.write_buffer.close()
+            self.write_buffer = None
+        self.connections.close_all()
     
     def init_database(self):
         """Initialize SQLite database for power data storage"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self.connections.transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS power_readings (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    device_id TEXT NOT NULL,
+                    timestamp INTEGER NOT NULL,
+                    voltage REAL,
+                    electric_current REAL,
+                    power REAL,
+                    electricity_of_day REAL,
+                    power_on BOOLEAN,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
         
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS power_readings (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                device_id TEXT NOT NULL,
-                timestamp INTEGER NOT NULL,
-                voltage REAL,
-                electric_current REAL,
-                power REAL,
-                electricity_of_day REAL,
-                power_on BOOLEAN,
-                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        self.migrate()
+        if not (self.partition or self.compact) and self.is_compact():
+            # Keep reading and writing a database converted by an earlier run
+            self.compact = "rows"
+        converted = False
+        if self.partition:
+            # Partitions are WITHOUT ROWID already
+            converted = self.partition_readings()
+        elif self.compact:
+            # So are compact rows
+            converted = self.compact_readings()
+            if self.compact == "chunks":
+                self.seal_chunks()
+            if converted:
+                # The dropped table's pages are only free pages until the file is rebuilt
+                self.vacuum()
+        elif self.without_rowid:
+            converted = self.rebuild_without_rowid()
+        
+        self.reading_counters.load(self.connection())
+        if converted or not self.reading_counters.get_all():
+            # First start with the counters, or a conversion that may have merged duplicate readings
+            self.rebuild_reading_stats()
+        
+        self.devices.load(self.connection())
+        if not self.devices.get_all():
+            # First start with the registry: register every device with stored readings
+            registered = self.rebuild_devices()
+            if registered:
+                print(f"Registered {registered} devices from stored readings")
         
-        conn.commit()
-        conn.close()
+        if self.connection().execute("SELECT 1 FROM power_energy_state LIMIT 1").fetchone() is None:
+            # First start with the energy tables: integrate the readings stored so far
+            integrated = self.rebuild_energy()
+            if integrated:
+                print(f"Built energy totals from {integrated} readings")
     
-    def save_power_data(self, data: Dict) -> bool:
-        """Save power data to database"""
+    def get_schema_version(self) -> int:
+        """Get the schema version recorded in the database"""
+        return self.connection().execute("PRAGMA user_version").fetchone()[0]
+    
+    def migrate(self) -> int:
+        """Apply pending schema migrations and return the resulting version"""
+        conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+        cursor = conn.cursor()
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            # BEGIN IMMEDIATE takes the write lock up front, so a second process
+            # starting at the same time waits here and then sees the new version.
+            cursor.execute("BEGIN IMMEDIATE")
+            version = cursor.execute("PRAGMA user_version").fetchone()[0]
+            for migration_version, description, apply in MIGRATIONS:
+                if migration_version <= version:
+                    continue
+                print(f"Applying schema migration {migration_version}: {description}")
+                apply(cursor)
+                cursor.execute(f"PRAGMA user_version = {migration_version}")
+                version = migration_version
+            cursor.execute("COMMIT")
+            return version
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+    
+    def is_partitioned(self) -> bool:
+        """Check whether power_readings is a view over time partitions"""
+        row = self.connection().execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'view' AND name = 'power_readings'"
+        ).fetchone()
+        return row is not None and PARTITION_PREFIX in row[0]
+    
+    def get_partitions(self) -> List[str]:
+        """Get the keys of all partition tables, oldest first"""
+        rows = self.connection().execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB ?",
+            (PARTITION_PREFIX + "[0-9]*",)
+        ).fetchall()
+        return sorted(row[0][len(PARTITION_PREFIX):] for row in rows)
+    
+    def partition_readings(self) -> bool:
+        """Move power_readings into per-period partition tables behind a view
+
+        Rows are copied into one WITHOUT ROWID table per ``partition`` period
+        (duplicate (device_id, timestamp) rows keep the last one), the old
+        table is dropped and power_readings is recreated as a UNION ALL view,
+        so every reader keeps working. Returns True if the table was converted,
+        False if it already was partitioned.
+        """
+        if self.is_partitioned():
+            return False
+        if self.is_compact():
+            raise ValueError("a compact database cannot be partitioned")
+        
+        conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            row = cursor.execute("SELECT MIN(timestamp), MAX(timestamp) FROM power_readings").fetchone()
+            keys = {_partition_key(int(datetime.now().timestamp()), self.partition)}
+            if row[0] is not None:
+                moment = row[0]
+                while moment <= row[1]:
+                    key = _partition_key(moment, self.partition)
+                    keys.add(key)
+                    moment = _partition_bounds(key)[1]
             
-            cursor.execute('''
-                INSERT INTO power_readings 
-                (device_id, timestamp, voltage, electric_current, power, electricity_of_day, power_on)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                data.get("device_id"),
-                data.get("timestamp"),
-                data.get("voltage"),
-                data.get("electric_current"),
-                data.get("power"),
-                data.get("electricity_of_day"),
-                data.get("power_on")
-            ))
-            
-            conn.commit()
+            has_id = any(column[1] == "id" for column in cursor.execute("PRAGMA table_info(power_readings)"))
+            for key in sorted(keys):
+                start, end = _partition_bounds(key)
+                _create_partition(cursor, key)
+                cursor.execute(f'''
+                    INSERT OR REPLACE INTO {PARTITION_PREFIX}{key} ({PARTITION_COLUMNS})
+                    SELECT {PARTITION_COLUMNS} FROM power_readings
+                    WHERE timestamp >= ? AND timestamp < ?
+                    ORDER BY device_id, timestamp{", id" if has_id else ""}
+                ''', (start, end))
+            cursor.execute("DROP TABLE power_readings")
+            _create_partition_view(cursor, sorted(keys))
+            cursor.execute("COMMIT")
+            self._partition_keys = None
+            return True
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        finally:
             conn.close()
+    
+    def _reading_tables(self, start: Optional[int] = None) -> List[str]:
+        """Tables holding raw readings newer than ``start``, newest first"""
+        if not self.partition:
+            return ["power_readings"]
+        return [
+            PARTITION_PREFIX + key for key in reversed(self.get_partitions())
+            if start is None or _partition_bounds(key)[1] > start
+        ]
+    
+    def _ensure_partitions(self, conn: sqlite3.Connection, timestamps: Iterable[int]):
+        """Create partitions for new periods and add them to the view"""
+        keys = {_partition_key(timestamp, self.partition) for timestamp in timestamps}
+        if self._partition_keys is None:
+            self._partition_keys = set(self.get_partitions())
+        if keys <= self._partition_keys:
+            return
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        cursor = conn.cursor()
+        for key in keys - self._partition_keys:
+            _create_partition(cursor, key)
+        self._partition_keys |= keys
+        _create_partition_view(cursor, sorted(self._partition_keys))
+    
+    def is_compact(self) -> bool:
+        """Check whether raw readings use the compact device-keyed layout"""
+        row = self.connection().execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'power_samples'"
+        ).fetchone()
+        return row is not None
+    
+    def compact_readings(self) -> bool:
+        """Move power_readings into the compact device-keyed layout behind a view
+
+        Each device ID is stored once in device_keys, and rows are kept in a
+        WITHOUT ROWID table keyed on (device_key, timestamp) without the
+        id/created_at columns (duplicate rows keep the last one). The old
+        table is dropped and power_readings is recreated as a view, so every
+        reader keeps working. Returns True if the table was converted, False
+        if it already was compact.
+        """
+        if self.is_compact():
+            return False
+        if self.is_partitioned():
+            raise ValueError("a partitioned database cannot be converted to compact storage")
+        
+        conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+        cursor = conn.cursor()
+        try:
+            cursor.execute("BEGIN IMMEDIATE")
+            _create_compact_tables(cursor)
+            cursor.execute('''
+                INSERT OR IGNORE INTO device_keys (device_id)
+                SELECT DISTINCT device_id FROM power_readings ORDER BY device_id
+            ''')
+            has_id = any(column[1] == "id" for column in cursor.execute("PRAGMA table_info(power_readings)"))
+            cursor.execute(f'''
+                INSERT OR REPLACE INTO power_samples (device_key, {COMPACT_COLUMNS})
+                SELECT k.device_key, {", ".join("r." + column for column in CHUNK_COLUMNS)}
+                FROM power_readings r JOIN device_keys k ON k.device_id = r.device_id
+                ORDER BY k.device_key, r.timestamp{", r.id" if has_id else ""}
+            ''')
+            cursor.execute("DROP TABLE power_readings")
+            _create_compact_view(cursor)
+            cursor.execute("COMMIT")
             return True
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+    
+    def _ensure_device_keys(self, device_ids: Iterable[str]) -> Dict[str, int]:
+        """Get the dictionary key of every device ID, adding new devices first"""
+        missing = set(device_ids) - self._device_keys.keys()
+        if missing:
+            # Committed on their own, so a failed insert never leaves a cached key behind
+            with self.connections.transaction() as conn:
+                conn.executemany("INSERT OR IGNORE INTO device_keys (device_id) VALUES (?)", [(device_id,) for device_id in missing])
+                self._device_keys = dict(conn.execute("SELECT device_id, device_key FROM device_keys").fetchall())
+        return self._device_keys
+    
+    def seal_chunks(self, before: Optional[int] = None) -> int:
+        """Encode unsealed compact rows older than ``before`` into per-device-hour chunks
+
+        ``before`` is rounded down to a whole hour and defaults to the start
+        of the previous hour, so the latest hour stays as plain rows for late
+        readings. Rows that arrive for an hour that is already sealed are
+        merged into its chunk by the next call. Returns the number of rows
+        sealed.
+        """
+        if before is None:
+            now = int(datetime.now().timestamp())
+            before = now - now % CHUNK_SECONDS - CHUNK_SECONDS
+        before -= before % CHUNK_SECONDS
+        
+        sealed = 0
+        with self.connections.transaction() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            cursor.execute(f'''
+                SELECT device_key, {COMPACT_COLUMNS} FROM power_samples
+                WHERE timestamp < ?
+                ORDER BY device_key, timestamp
+            ''', (before,))
+            chunks = []
+            for (device_key, bucket), rows in groupby(cursor, key=lambda row: (row[0], row[1] - row[1] % CHUNK_SECONDS)):
+                rows = [row[1:] for row in rows]
+                sealed += len(rows)
+                existing = conn.execute(
+                    "SELECT data FROM power_chunks WHERE device_key = ? AND bucket = ?", (device_key, bucket)
+                ).fetchone()
+                if existing is not None:
+                    # Late rows replace sealed ones with the same timestamp
+                    merged = {row[0]: row for row in zip(*decode_chunk(existing[0]))}
+                    merged.update((row[0], row) for row in rows)
+                    rows = [merged[timestamp] for timestamp in sorted(merged)]
+                chunks.append((device_key, bucket, len(rows), rows[0][0], rows[-1][0], encode_chunk(list(zip(*rows)))))
+                if len(chunks) >= 1000:
+                    self._write_chunks(conn, chunks)
+                    chunks = []
+            self._write_chunks(conn, chunks)
+            conn.execute("DELETE FROM power_samples WHERE timestamp < ?", (before,))
+        self._sealed_before = max(self._sealed_before, before)
+        return sealed
+    
+    def _write_chunks(self, conn: sqlite3.Connection, chunks: List[tuple]):
+        conn.executemany('''
+            INSERT OR REPLACE INTO power_chunks
+            (device_key, bucket, samples, first_timestamp, last_timestamp, data)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', chunks)
+    
+    def _seal_due_chunks(self):
+        """Seal the hours that closed since the last seal (chunks mode only)"""
+        now = int(datetime.now().timestamp())
+        if now - now % CHUNK_SECONDS - CHUNK_SECONDS <= self._sealed_before:
+            return
+        try:
+            self.seal_chunks()
         except Exception as e:
-            print(f"Error saving data: {e}")
-            return False
+            print(f"Error sealing chunks: {e}")
     
-    def get_latest_reading(self, device_id: str) -> Optional[Dict]:
-        """Get the latest power reading for a device"""
+    def _compact_rows(self, conn: sqlite3.Connection, device_id: Optional[str], start: Optional[int],
+                      descending: bool = False) -> Iterator[tuple]:
+        """Unsealed rows and decoded chunks of a device (or every device but 'all') as READING_FIELDS tuples
+
+        Both sources are read in timestamp order and merged lazily, so only
+        one hour of chunks per device is decoded at a time.
+        """
+        order = "DESC" if descending else "ASC"
+        conditions, params = ["device_id != 'all'"], []
+        if device_id is not None:
+            conditions, params = ["device_id = ?"], [device_id]
+        chunk_conditions, chunk_params = list(conditions), list(params)
+        if start is not None:
+            conditions.append("timestamp >= ?")
+            params.append(start)
+            chunk_conditions.append("c.bucket >= ?")
+            chunk_params.append(start - start % CHUNK_SECONDS)
+        
+        rows = conn.cursor()
+        rows.row_factory = None
+        rows.execute(f'''
+            SELECT {RAW_SELECT_COLUMNS} FROM power_readings
+            WHERE {" AND ".join(conditions)}
+            ORDER BY timestamp {order}
+        ''', params)
+        chunks = conn.cursor()
+        chunks.row_factory = None
+        chunks.execute(f'''
+            SELECT k.device_id, c.bucket, c.data
+            FROM power_chunks c JOIN device_keys k ON k.device_key = c.device_key
+            WHERE {" AND ".join(chunk_conditions)}
+            ORDER BY c.bucket {order}
+        ''', chunk_params)
+        
+        def sealed_rows() -> Iterator[tuple]:
+            for _, hour in groupby(chunks, key=itemgetter(1)):
+                decoded = [row for device, _, data in hour for row in _decode_chunk_rows(device, data)]
+                if start is not None:
+                    decoded = [row for row in decoded if row[1] >= start]
+                decoded.sort(key=itemgetter(1), reverse=descending)
+                yield from decoded
+        
+        return heapq.merge(map(_reading_tuple, rows), sealed_rows(), key=itemgetter(1), reverse=descending)
+    
+    def is_without_rowid(self) -> bool:
+        """Check whether power_readings is a WITHOUT ROWID table"""
+        row = self.connection().execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'power_readings'"
+        ).fetchone()
+        return bool(row and "WITHOUT ROWID" in row[0].upper())
+    
+    def rebuild_without_rowid(self) -> bool:
+        """Rebuild power_readings as a WITHOUT ROWID table keyed on (device_id, timestamp)
+
+        Rows are clustered by device and time, so range scans read contiguous
+        pages and need no separate index lookup. The synthetic ``id`` column is
+        dropped, and duplicate (device_id, timestamp) rows keep the last one.
+        Returns True if the table was rebuilt, False if it already was.
+        """
+        if self.is_without_rowid():
+            return False
+        
+        conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+        cursor = conn.cursor()
         try:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            
+            cursor.execute("BEGIN IMMEDIATE")
             cursor.execute('''
-                SELECT * FROM power_readings 
-                WHERE device_id = ? 
-                ORDER BY timestamp DESC 
-                LIMIT 1
-            ''', (device_id,))
-            
-            row = cursor.fetchone()
+                CREATE TABLE power_readings_new (
+                    device_id TEXT NOT NULL,
+                    timestamp INTEGER NOT NULL,
+                    voltage REAL,
+                    electric_current REAL,
+                    power REAL,
+                    electricity_of_day REAL,
+                    power_on BOOLEAN,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (device_id, timestamp)
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute('''
+                INSERT OR REPLACE INTO power_readings_new
+                (device_id, timestamp, voltage, electric_current, power, electricity_of_day, power_on, created_at)
+                SELECT device_id, timestamp, voltage, electric_current, power, electricity_of_day, power_on, created_at
+                FROM power_readings
+                ORDER BY device_id, timestamp, id
+            ''')
+            cursor.execute("DROP TABLE power_readings")
+            cursor.execute("ALTER TABLE power_readings_new RENAME TO power_readings")
+            # The primary key already covers (device_id, timestamp)
+            _migration_timestamp_index(cursor)
+            cursor.execute("COMMIT")
+            return True
+        except Exception:
+            cursor.execute("ROLLBACK")
+            raise
+        finally:
             conn.close()
+    
+    def _insert_readings(self, readings: List[Dict]):
+        """Insert readings and fold them into the rollup tables in a single transaction"""
+        readings = sorted(_with_timestamps(readings), key=lambda data: data["timestamp"])
+        if self.compact:
+            device_keys = self._ensure_device_keys({data.get("device_id") for data in readings})
+        with self.connections.transaction() as conn:
+            if self.compact:
+                conn.executemany(f'''
+                    INSERT OR REPLACE INTO power_samples
+                    (device_key, {COMPACT_COLUMNS})
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', [(device_keys[data.get("device_id")], *(data.get(field) for field in CHUNK_COLUMNS)) for data in readings])
+            elif self.partition:
+                self._ensure_partitions(conn, [data["timestamp"] for data in readings])
+                for key, rows in groupby(readings, key=lambda data: _partition_key(data["timestamp"], self.partition)):
+                    conn.executemany(f'''
+                        INSERT OR REPLACE INTO {PARTITION_PREFIX}{key}
+                        (device_id, timestamp, voltage, electric_current, power, electricity_of_day, power_on)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ''', [tuple(data.get(field) for field in READING_FIELDS) for data in rows])
+            else:
+                conn.executemany('''
+                    INSERT OR REPLACE INTO power_readings 
+                    (device_id, timestamp, voltage, electric_current, power, electricity_of_day, power_on)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', [tuple(data.get(field) for field in READING_FIELDS) for data in readings])
+            
+            for resolution, seconds in ROLLUP_RESOLUTIONS.items():
+                conn.executemany(ROLLUP_UPSERT_SQL[resolution], [{
+                    "device_id": data.get("device_id"),
+                    "bucket": data["timestamp"] - data["timestamp"] % seconds,
+                    "power": data.get("power"),
+                    "voltage": data.get("voltage"),
+                    "electric_current": data.get("electric_current"),
+                    "usage": data.get("electricity_of_day"),
+                } for data in readings if data.get("timestamp") is not None])
             
-            if row:
-                return dict(row)
-            return None
+            timed = sorted(
+                (data for data in readings if data.get("timestamp") is not None),
+                key=lambda data: (data.get("device_id"), data["timestamp"])
+            )
+            spans = []
+            counts = []
+            for device_id, rows in groupby(timed, key=lambda data: data.get("device_id")):
+                rows = list(rows)
+                self._fold_energy(conn, device_id, [(data["timestamp"], data.get("power")) for data in rows])
+                if device_id is not None and device_id != 'all':
+                    spans.append((device_id, rows[0]["timestamp"], rows[-1]["timestamp"]))
+                    counts.append((device_id, len(rows), rows[0]["timestamp"], rows[-1]["timestamp"]))
+            conn.executemany(DEVICE_SEEN_SQL, spans)
+            conn.executemany(READING_STATS_ADD_SQL, counts)
+        self.devices.seen(spans)
+        self.reading_counters.add(counts)
+        self.history_cache.invalidate({data.get("device_id") for data in readings})
+        if self.compact == "chunks":
+            self._seal_due_chunks()
+    
+    def _replay_readings(self, readings: List[Dict]):
+        """Insert spooled readings, skipping those already stored (rollups would count them twice)"""
+        conn = self.connection()
+        fresh = []
+        for device_id, rows in groupby(sorted(readings, key=lambda data: (data["device_id"], data["timestamp"])),
+                                       key=lambda data: data["device_id"]):
+            rows = list(rows)
+            start, end = rows[0]["timestamp"], rows[-1]["timestamp"]
+            if self.compact:
+                stored = {row[1] for row in takewhile(lambda row: row[1] <= end,
+                                                      self._compact_rows(conn, device_id, start))}
+            else:
+                stored = set()
+                for table in self._reading_tables(start):
+                    stored.update(row[0] for row in conn.execute(
+                        f"SELECT timestamp FROM {table} WHERE device_id = ? AND timestamp BETWEEN ? AND ?",
+                        (device_id, start, end)
+                    ))
+            fresh.extend(data for data in rows if data["timestamp"] not in stored)
+        if len(fresh) < len(readings):
+            print(f"Skipped {len(readings) - len(fresh)} replayed readings that were already stored")
+        if fresh:
+            self._insert_readings(fresh)
+    
+    def _fold_energy(self, conn: sqlite3.Connection, device_id: str,
+                     readings: Iterable[Tuple[int, Optional[float]]]) -> int:
+        """Integrate a device's (timestamp, power) readings, oldest first, into the energy tables
+
+        Continues from the device's last integrated reading; readings that are
+        not newer than it (late or duplicate) are skipped. Returns how many
+        readings were integrated.
+        """
+        row = conn.execute("SELECT timestamp, power FROM power_energy_state WHERE device_id = ?", (device_id,)).fetchone()
+        previous = (row[0], row[1]) if row is not None else None
+        days: DayTotals = {}
+        integrated = 0
+        for timestamp, power in readings:
+            if previous is not None and timestamp <= previous[0]:
+                continue
+            integrate(days, previous, (timestamp, power), self.energy_max_gap)
+            previous = (timestamp, power)
+            integrated += 1
+        if not integrated:
+            return 0
+        
+        for period, totals in (("day", days), ("month", month_totals(days))):
+            conn.executemany(ENERGY_UPSERT_SQL[period], [
+                (device_id, key, energy_wh, int(covered), int(gap), int(samples))
+                for key, (energy_wh, covered, gap, samples) in totals.items()
+            ])
+        conn.execute('''
+            INSERT OR REPLACE INTO power_energy_state (device_id, timestamp, power) VALUES (?, ?, ?)
+        ''', (device_id, *previous))
+        return integrated
+    
+    def rebuild_energy(self) -> int:
+        """Recompute the energy tables from every stored raw reading and return how many were integrated
+
+        Archived partitions are not read, so totals of archived periods are
+        lost if they are rebuilt after archiving.
+        """
+        integrated = 0
+        with self.connections.transaction() as conn:
+            for table in ENERGY_TABLES.values():
+                conn.execute(f"DELETE FROM {table}")
+            conn.execute("DELETE FROM power_energy_state")
+            for device_id in self.get_device_ids():
+                if self.compact:
+                    rows = ((row[1], row[4]) for row in self._compact_rows(conn, device_id, None))
+                else:
+                    cursor = conn.cursor()
+                    cursor.row_factory = None
+                    rows = cursor.execute('''
+                        SELECT timestamp, power FROM power_readings
+                        WHERE device_id = ?
+                        ORDER BY timestamp
+                    ''', (device_id,))
+                # Folded in slices so only one slice of readings is in memory
+                while True:
+                    batch = list(islice(rows, 50000))
+                    if not batch:
+                        break
+                    integrated += self._fold_energy(conn, device_id, batch)
+        return integrated
+    
+    def get_energy(self, device_ids: Optional[List[str]] = None, period: str = "day",
+                   start: Optional[str] = None, end: Optional[str] = None) -> Dict[str, List[Dict]]:
+        """Get energy totals per device and day (YYYY-MM-DD) or month (YYYY-MM), oldest first
+
+        ``start`` and ``end`` are inclusive keys of the period. Reads one row
+        per device and period, however many readings it covers.
+        """
+        if period not in ENERGY_PERIODS:
+            raise ValueError(f"period must be one of: {', '.join(ENERGY_PERIODS)}")
+        conditions, params = [f"{period} >= ?", f"{period} <= ?"], [start or "", end or "9999"]
+        if device_ids is not None:
+            conditions.append(f"device_id IN ({', '.join('?' for _ in device_ids)})")
+            params.extend(device_ids)
+        rows = self.connection().execute(f'''
+            SELECT device_id, {period}, energy_wh, covered_seconds, gap_seconds, samples
+            FROM {ENERGY_TABLES[period]}
+            WHERE {" AND ".join(conditions)}
+            ORDER BY device_id, {period}
+        ''', params).fetchall()
+        energy: Dict[str, List[Dict]] = {device_id: [] for device_id in device_ids or []}
+        for device_id, key, energy_wh, covered, gap, samples in rows:
+            energy.setdefault(device_id, []).append({
+                period: key,
+                "energy_wh": energy_wh,
+                "covered_seconds": covered,
+                "gap_seconds": gap,
+                "samples": samples,
+            })
+        return energy
+    
+    def save_power_data(self, data: Dict) -> bool:
+        """Save power data to database"""
+        return self.save_many_power_data([data])
+    
+    def save_many_power_data(self, readings: List[Dict]) -> bool:
+        """Save several readings in one transaction (or hand them to the write buffer)"""
+        readings = _with_timestamps(readings)
+        try:
+            if self.write_buffer is not None:
+                if not self.write_buffer.add_many(readings):
+                    print("Error saving data: write buffer is full and could not be flushed")
+                    return False
+            else:
+                self._insert_readings(readings)
+            self.latest_cache.update(readings)
         except Exception as e:
-            print(f"Error getting latest reading: {e}")
-            return None
+            print(f"Error saving data: {e}")
+            return False
+        
+        saved = [{field: data.get(field) for field in READING_FIELDS} for data in readings]
+        for listener in self.save_listeners:
+            try:
+                listener(saved)
+            except Exception as e:
+                print(f"Error in save listener: {e}")
+        return True
+    
+    def get_latest_reading(self, device_id: str) -> Optional[Dict]:
+        """Get the latest power reading for a device (from memory, including buffered readings)"""
+        return self.latest_cache.get(device_id)
+    
+    def get_latest_readings(self) -> Dict[str, Dict]:
+        """Get the latest power reading of every device (from memory, including buffered readings)"""
+        return self.latest_cache.get_all()
+    
+    def invalidate_caches(self, device_id: Optional[str] = None):
+        """Resync in-memory caches after rows were deleted outside the save path"""
+        self.history_cache.invalidate([device_id] if device_id is not None else None)
+        self._warm_latest_cache()
+    
+    def _warm_latest_cache(self):
+        conn = self.connection()
+        self.latest_cache.warm(conn)
+        if self.write_buffer is not None:
+            # Readings still waiting in the buffer are newer than the tables
+            self.latest_cache.update(self.write_buffer.pending_readings())
+        if self.compact:
+            # Devices that went quiet may only have sealed readings left
+            rows = conn.execute('''
+                SELECT k.device_id, c.data
+                FROM (SELECT device_key, MAX(bucket) AS bucket FROM power_chunks GROUP BY device_key) newest
+                JOIN power_chunks c ON c.device_key = newest.device_key AND c.bucket = newest.bucket
+                JOIN device_keys k ON k.device_key = c.device_key
+            ''').fetchall()
+            self.latest_cache.update(dict(zip(READING_FIELDS, _decode_chunk_rows(device_id, data)[-1])) for device_id, data in rows)
     
     def get_readings_by_timerange(self, device_id: str, hours: int = 24) -> List[Dict]:
         """Get power readings within specified hours"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
+            cursor = self.connection().cursor()
             
             # Calculate timestamp for N hours ago
             hours_ago = int(datetime.now().timestamp()) - (hours * 3600)
             
+            if self.compact:
+                rows = self._compact_rows(self.connection(), device_id, hours_ago, descending=True)
+                return [dict(zip(READING_FIELDS, row)) for row in rows]
+            
             cursor.execute('''
                 SELECT * FROM power_readings 
                 WHERE device_id = ? AND timestamp >= ?
@@ -100,9 +1691,8 @@ class PowerDataStorage:
             ''', (device_id, hours_ago))
             
             rows = cursor.fetchall()
-            conn.close()
             
-            return [dict(row) for row in rows]
+            return [_reading_dict(row) for row in rows]
         except Exception as e:
             print(f"Error getting readings by timerange: {e}")
             return []
@@ -110,9 +1700,11 @@ class PowerDataStorage:
     def get_all_readings(self, device_id: str, limit: int = 1000) -> List[Dict]:
         """Get all power readings for a device"""
         try:
-            conn = sqlite3.connect(self.db_path)
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
+            cursor = self.connection().cursor()
+            
+            if self.compact:
+                rows = self._compact_rows(self.connection(), device_id, None, descending=True)
+                return [dict(zip(READING_FIELDS, row)) for row in islice(rows, limit)]
             
             cursor.execute('''
                 SELECT * FROM power_readings 
@@ -122,9 +1714,789 @@ class PowerDataStorage:
             ''', (device_id, limit))
             
             rows = cursor.fetchall()
-            conn.close()
             
-            return [dict(row) for row in rows]
+            return [_reading_dict(row) for row in rows]
         except Exception as e:
             print(f"Error getting all readings: {e}")
-            return []
\ No newline at end of file
+            return []
+    
+    def count_readings(self, device_id: str, since: int) -> int:
+        """Count raw readings for a device since a timestamp (index-only)"""
+        cursor = self.connection().cursor()
+        cursor.execute('''
+            SELECT COUNT(*) FROM power_readings
+            WHERE device_id = ? AND timestamp >= ?
+        ''', (device_id, since))
+        count = cursor.fetchone()[0]
+        if self.compact:
+            # Later hours count whole; only the chunk of the hour containing since is decoded
+            bucket = since - since % CHUNK_SECONDS
+            cursor.execute('''
+                SELECT TOTAL(c.samples)
+                FROM power_chunks c JOIN device_keys k ON k.device_key = c.device_key
+                WHERE k.device_id = ? AND c.bucket > ?
+            ''', (device_id, bucket))
+            count += int(cursor.fetchone()[0])
+            cursor.execute('''
+                SELECT c.data
+                FROM power_chunks c JOIN device_keys k ON k.device_key = c.device_key
+                WHERE k.device_id = ? AND c.bucket = ?
+            ''', (device_id, bucket))
+            for (data,) in cursor.fetchall():
+                count += sum(1 for timestamp in decode_chunk(data)[0] if timestamp >= since)
+        return count
+    
+    def choose_resolution(self, device_ids: Union[str, List[str]], hours: int, points: int) -> str:
+        """Pick the finest resolution whose row count fits in ``points``
+
+        Returns "raw" when the raw readings already fit (for every device, if
+        several are given), otherwise the finest rollup whose bucket count
+        fits, falling back to the coarsest rollup.
+        """
+        if isinstance(device_ids, str):
+            device_ids = [device_ids]
+        span = hours * 3600
+        since = int(datetime.now().timestamp()) - span
+        
+        def retained(source: str) -> bool:
+            return self.retention.get(source) is None or self.retention[source] >= span
+        
+        if retained("raw") and max((self.count_readings(device_id, since) for device_id in device_ids), default=0) <= points:
+            return "raw"
+        for resolution, seconds in ROLLUP_RESOLUTIONS.items():
+            if span / seconds <= points and retained(resolution):
+                return resolution
+        return list(ROLLUP_RESOLUTIONS)[-1]
+    
+    def get_rollups_by_timerange(self, device_id: str, hours: int = 24, resolution: str = "1m") -> List[Dict]:
+        """Get aggregated readings (avg/min/max per bucket) within specified hours"""
+        if resolution not in ROLLUP_RESOLUTIONS:
+            raise ValueError(f"Unknown resolution: {resolution}")
+        try:
+            cursor = self.connection().cursor()
+            
+            hours_ago = int(datetime.now().timestamp()) - (hours * 3600)
+            
+            cursor.execute(f'''
+                SELECT {ROLLUP_SELECT_COLUMNS}
+                FROM {_rollup_table(resolution)}
+                WHERE device_id = ? AND bucket >= ?
+                ORDER BY bucket DESC
+            ''', (device_id, hours_ago - hours_ago % ROLLUP_RESOLUTIONS[resolution]))
+            
+            return [dict(row) for row in cursor.fetchall()]
+        except Exception as e:
+            print(f"Error getting rollups by timerange: {e}")
+            return []
+    
+    def get_history_columns(self, device_id: str, hours: int = 24, resolution: str = "raw",
+                            since: Optional[int] = None, limit: int = 1000) -> Tuple[List[str], List[tuple]]:
+        """Get readings within specified hours as column names plus plain tuples, oldest first
+
+        Skips the per-row dict construction of the other getters, for callers
+        that post-process or serialize whole columns. With ``since``, only raw
+        readings newer than it are returned, or for rollups the bucket
+        containing it (which may have grown) and every later bucket. With
+        ``hours`` <= 0, the newest ``limit`` raw readings are returned.
+        Results are served from the history cache and must not be mutated.
+        """
+        key = ("history", device_id, hours, resolution, since, limit if hours <= 0 else None)
+        result = self.history_cache.get(key)
+        if result is None:
+            result = self._query_history_columns(device_id, hours, resolution, since, limit)
+            self.history_cache.put(key, [device_id], result)
+        return result
+    
+    def _query_history_columns(self, device_id: str, hours: int, resolution: str,
+                               since: Optional[int], limit: int) -> Tuple[List[str], List[tuple]]:
+        cursor = self.connection().cursor()
+        cursor.row_factory = None
+        
+        if hours <= 0:
+            if self.compact:
+                rows = self._compact_rows(self.connection(), device_id, None, descending=True)
+                return list(READING_FIELDS), list(islice(rows, limit))[::-1]
+            cursor.execute(f'''
+                SELECT {RAW_SELECT_COLUMNS} FROM power_readings
+                WHERE device_id = ?
+                ORDER BY timestamp DESC
+                LIMIT ?
+            ''', (device_id, limit))
+            return list(READING_FIELDS), [_reading_tuple(row) for row in reversed(cursor.fetchall())]
+        
+        start = int(datetime.now().timestamp()) - (hours * 3600)
+        if since is not None:
+            start = max(start, since + 1 if resolution == "raw" else since)
+        
+        if resolution == "raw" and self.compact:
+            return list(READING_FIELDS), list(self._compact_rows(self.connection(), device_id, start))
+        elif resolution == "raw":
+            cursor.execute(f'''
+                SELECT {RAW_SELECT_COLUMNS} FROM power_readings
+                WHERE device_id = ? AND timestamp >= ?
+                ORDER BY timestamp ASC
+            ''', (device_id, start))
+            return list(READING_FIELDS), [_reading_tuple(row) for row in cursor]
+        elif resolution in ROLLUP_RESOLUTIONS:
+            cursor.execute(f'''
+                SELECT {ROLLUP_SELECT_COLUMNS}
+                FROM {_rollup_table(resolution)}
+                WHERE device_id = ? AND bucket >= ?
+                ORDER BY bucket ASC
+            ''', (device_id, start - start % ROLLUP_RESOLUTIONS[resolution]))
+        else:
+            raise ValueError(f"Unknown resolution: {resolution}")
+        
+        columns = [description[0] for description in cursor.description]
+        return columns, cursor.fetchall()
+    
+    def get_bulk_history_columns(self, device_ids: List[str], hours: int = 24, resolution: str = "raw",
+                                 since: Optional[int] = None) -> Tuple[List[str], Dict[str, List[tuple]]]:
+        """Get several devices' history in one query, as column names plus tuples grouped by device
+
+        Rows of each device are oldest first. ``since`` behaves as in
+        get_history_columns, and results are likewise cached and read-only.
+        """
+        key = ("bulk", tuple(device_ids), hours, resolution, since)
+        result = self.history_cache.get(key)
+        if result is None:
+            result = self._query_bulk_history_columns(device_ids, hours, resolution, since)
+            self.history_cache.put(key, device_ids, result)
+        return result
+    
+    def _query_bulk_history_columns(self, device_ids: List[str], hours: int, resolution: str,
+                                    since: Optional[int]) -> Tuple[List[str], Dict[str, List[tuple]]]:
+        start = int(datetime.now().timestamp()) - (hours * 3600)
+        if since is not None:
+            start = max(start, since + 1 if resolution == "raw" else since)
+        placeholders = ", ".join("?" for _ in device_ids)
+        cursor = self.connection().cursor()
+        cursor.row_factory = None
+        
+        if resolution == "raw" and self.compact:
+            conn = self.connection()
+            return list(READING_FIELDS), {
+                device_id: list(self._compact_rows(conn, device_id, start)) for device_id in device_ids
+            }
+        elif resolution == "raw":
+            cursor.execute(f'''
+                SELECT {RAW_SELECT_COLUMNS} FROM power_readings
+                WHERE device_id IN ({placeholders}) AND timestamp >= ?
+                ORDER BY device_id, timestamp ASC
+            ''', (*device_ids, start))
+            grouped = {device_id: [] for device_id in device_ids}
+            for device_id, rows in groupby(cursor, key=itemgetter(0)):
+                grouped[device_id] = [_reading_tuple(row) for row in rows]
+            return list(READING_FIELDS), grouped
+        elif resolution in ROLLUP_RESOLUTIONS:
+            cursor.execute(f'''
+                SELECT {ROLLUP_SELECT_COLUMNS}
+                FROM {_rollup_table(resolution)}
+                WHERE device_id IN ({placeholders}) AND bucket >= ?
+                ORDER BY device_id, bucket ASC
+            ''', (*device_ids, start - start % ROLLUP_RESOLUTIONS[resolution]))
+        else:
+            raise ValueError(f"Unknown resolution: {resolution}")
+        
+        columns = [description[0] for description in cursor.description]
+        grouped: Dict[str, List[tuple]] = {device_id: [] for device_id in device_ids}
+        for device_id, rows in groupby(cursor, key=itemgetter(0)):
+            grouped[device_id] = list(rows)
+        return columns, grouped
+    
+    def iter_readings(self, device_id: Optional[str] = None, hours: int = 24,
+                      batch_size: int = 5000) -> Iterator[List[tuple]]:
+        """Yield raw readings newest first as READING_FIELDS tuples, ``batch_size`` rows at a time
+
+        Covers every device (except 'all') when ``device_id`` is None and the
+        whole history when ``hours`` <= 0, including archived partitions.
+        Rows are read through a cursor on a dedicated connection, so only one
+        batch is in memory at a time and the generator may be resumed from any
+        thread (e.g. between the chunks of a streaming response). Each table is
+        scanned along its timestamp index (partitions newest first), so SQLite
+        does not sort the range in memory either.
+        """
+        start = int(datetime.now().timestamp()) - (hours * 3600) if hours > 0 else None
+        conditions, params = ["device_id != 'all'"], []
+        if device_id is not None:
+            conditions, params = ["device_id = ?"], [device_id]
+        if start is not None:
+            conditions.append("timestamp >= ?")
+            params.append(start)
+        
+        conn = self.connections.open()
+        try:
+            if self.compact:
+                # Rows and sealed chunks are merged, so batches are cut from one stream
+                rows = self._compact_rows(conn, device_id, start, descending=True)
+                yield from iter(lambda: list(islice(rows, batch_size)), [])
+                return
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            for table in self._reading_tables(start):
+                cursor.execute(f'''
+                    SELECT {RAW_SELECT_COLUMNS} FROM {table}
+                    WHERE {" AND ".join(conditions)}
+                    ORDER BY timestamp DESC
+                ''', params)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield rows
+        finally:
+            conn.close()
+        
+        for key, path in reversed(self.get_archives()):
+            if start is None or _partition_bounds(key)[1] > start:
+                yield from read_archive_batches(path, device_id, start, batch_size)
+    
+    def get_latest_timestamps(self, device_ids: List[str]) -> Dict[str, Optional[int]]:
+        """Get the newest reading timestamp of each device in one query (per partition)"""
+        latest = {device_id: None for device_id in device_ids}
+        cursor = self.connection().cursor()
+        # Partitions are checked newest first and only until every device is found
+        for table in self._reading_tables():
+            pending = [device_id for device_id, timestamp in latest.items() if timestamp is None]
+            if not pending:
+                break
+            placeholders = ", ".join("?" for _ in pending)
+            cursor.execute(f'''
+                SELECT device_id, MAX(timestamp) FROM {table}
+                WHERE device_id IN ({placeholders})
+                GROUP BY device_id
+            ''', pending)
+            latest.update((row[0], row[1]) for row in cursor.fetchall())
+        if self.compact and device_ids:
+            placeholders = ", ".join("?" for _ in device_ids)
+            cursor.execute(f'''
+                SELECT k.device_id, MAX(c.last_timestamp)
+                FROM power_chunks c JOIN device_keys k ON k.device_key = c.device_key
+                WHERE k.device_id IN ({placeholders})
+                GROUP BY k.device_id
+            ''', device_ids)
+            for device_id, timestamp in cursor.fetchall():
+                if latest[device_id] is None or timestamp > latest[device_id]:
+                    latest[device_id] = timestamp
+        return latest
+    
+    def get_latest_timestamp(self, device_id: str) -> Optional[int]:
+        """Get the timestamp of a device's newest reading (index-only lookup)"""
+        if self.compact:
+            return self.get_latest_timestamps([device_id])[device_id]
+        cursor = self.connection().cursor()
+        for table in self._reading_tables():
+            cursor.execute(f"SELECT MAX(timestamp) FROM {table} WHERE device_id = ?", (device_id,))
+            timestamp = cursor.fetchone()[0]
+            if timestamp is not None:
+                return timestamp
+        return None
+    
+    def get_device_ids(self, enabled_only: bool = False) -> List[str]:
+        """Get the IDs of registered devices (from memory)"""
+        return [device["device_id"] for device in self.devices.get_all() if device["enabled"] or not enabled_only]
+    
+    def get_devices(self) -> List[Dict]:
+        """Get every registered device (from memory), ordered by device ID"""
+        return self.devices.get_all()
+    
+    def get_device(self, device_id: str) -> Optional[Dict]:
+        """Get a registered device (from memory)"""
+        return self.devices.get(device_id)
+    
+    def rebuild_devices(self) -> int:
+        """Register every device with stored raw readings and return how many there are
+
+        Reads the reading counters; afterwards saves keep the registry current.
+        """
+        spans = [(device_id, first, last)
+                 for device_id, (_, first, last) in sorted(self.reading_counters.get_all().items())]
+        with self.connections.transaction() as conn:
+            conn.executemany(DEVICE_SEEN_SQL, spans)
+        self.devices.load(self.connection())
+        return len(spans)
+    
+    def sync_devices(self, devices: List[Dict]) -> Dict[str, int]:
+        """Register or rename devices from the SwitchBot device list
+
+        Each entry needs ``device_id`` and may have ``name`` and
+        ``device_type``. Devices missing from the list are left as they are.
+        Returns how many devices were added and updated.
+        """
+        now = int(time.time())
+        known = {device["device_id"] for device in self.devices.get_all()}
+        rows = [(device["device_id"], device.get("name"), device.get("device_type"), now)
+                for device in devices if device.get("device_id")]
+        with self.connections.transaction() as conn:
+            conn.executemany('''
+                INSERT INTO devices (device_id, name, device_type, synced_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (device_id) DO UPDATE SET
+                    name = excluded.name,
+                    device_type = excluded.device_type,
+                    synced_at = excluded.synced_at
+            ''', rows)
+        self.devices.load(self.connection())
+        added = sum(1 for row in rows if row[0] not in known)
+        return {"added": added, "updated": len(rows) - added}
+    
+    def set_device_enabled(self, device_id: str, enabled: bool) -> bool:
+        """Enable or disable collection for a registered device; False if it is unknown"""
+        with self.connections.transaction() as conn:
+            updated = conn.execute(
+                "UPDATE devices SET enabled = ? WHERE device_id = ?", (int(enabled), device_id)
+            ).rowcount
+        self.devices.load(self.connection())
+        return bool(updated)
+    
+    def delete_device(self, device_id: str):
+        """Remove a device from the registry"""
+        with self.connections.transaction() as conn:
+            conn.execute("DELETE FROM devices WHERE device_id = ?", (device_id,))
+        self.devices.load(self.connection())
+    
+    def save_events(self, events: List[Dict]):
+        """Record detection events (dicts with device_id, rule, timestamp, value and message)"""
+        with self.connections.transaction() as conn:
+            conn.executemany(
+                "INSERT INTO events (device_id, rule, timestamp, value, message) VALUES (?, ?, ?, ?, ?)",
+                [(event["device_id"], event["rule"], event["timestamp"], event.get("value"), event.get("message"))
+                 for event in events]
+            )
+    
+    def get_events(self, device_id: Optional[str] = None, since: Optional[int] = None,
+                   rule: Optional[str] = None, limit: int = 100) -> List[Dict]:
+        """Get detection events, newest first, optionally for one device and rule since a timestamp"""
+        conditions, params = [], []
+        for column, op, value in (("device_id", "=", device_id), ("timestamp", ">=", since), ("rule", "=", rule)):
+            if value is not None:
+                conditions.append(f"{column} {op} ?")
+                params.append(value)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        cursor = self.connection().execute(
+            f"SELECT {', '.join(EVENT_FIELDS)} FROM events {where} ORDER BY timestamp DESC, id DESC LIMIT ?",
+            (*params, limit)
+        )
+        return [dict(zip(EVENT_FIELDS, row)) for row in cursor.fetchall()]
+    
+    def delete_device_events(self, device_id: str) -> int:
+        """Delete a device's detection events and return how many were deleted"""
+        with self.connections.transaction() as conn:
+            return conn.execute("DELETE FROM events WHERE device_id = ?", (device_id,)).rowcount
+    
+    def _scan_reading_stats(self, conn: sqlite3.Connection) -> Dict[str, List]:
+        """Count each device's raw readings and first/last timestamp with full scans"""
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT device_id, COUNT(*), MIN(timestamp), MAX(timestamp)
+            FROM power_readings
+            WHERE device_id != 'all'
+            GROUP BY device_id
+        ''')
+        stats = {row[0]: list(row[1:]) for row in cursor.fetchall()}
+        if self.compact:
+            cursor.execute('''
+                SELECT k.device_id, TOTAL(c.samples), MIN(c.first_timestamp), MAX(c.last_timestamp)
+                FROM power_chunks c JOIN device_keys k ON k.device_key = c.device_key
+                WHERE k.device_id != 'all'
+                GROUP BY k.device_id
+            ''')
+            for device_id, count, first, last in cursor.fetchall():
+                if device_id in stats:
+                    current = stats[device_id]
+                    stats[device_id] = [current[0] + int(count), min(current[1], first), max(current[2], last)]
+                else:
+                    stats[device_id] = [int(count), first, last]
+        return stats
+    
+    def rebuild_reading_stats(self) -> Dict[str, Dict]:
+        """Recount every device's raw readings into the reading counters
+
+        Runs in one write transaction, so no save or delete lands between the
+        scan and the update. Returns the devices whose counters were off, with
+        the counted and the actual values.
+        """
+        with self.connections.transaction() as conn:
+            if not conn.in_transaction:
+                conn.execute("BEGIN IMMEDIATE")
+            actual = self._scan_reading_stats(conn)
+            counted = {row[0]: list(row[1:]) for row in conn.execute(
+                f"SELECT {', '.join(READING_STATS_FIELDS)} FROM reading_stats"
+            ).fetchall()}
+            conn.execute("DELETE FROM reading_stats")
+            conn.executemany(
+                "INSERT INTO reading_stats (device_id, record_count, first_record, last_record) VALUES (?, ?, ?, ?)",
+                [(device_id, *values) for device_id, values in actual.items()]
+            )
+        self.reading_counters.load(self.connection())
+        return {
+            device_id: {
+                "counted": dict(zip(READING_STATS_FIELDS[1:], counted.get(device_id, [0, None, None]))),
+                "actual": dict(zip(READING_STATS_FIELDS[1:], actual.get(device_id, [0, None, None])))
+            }
+            for device_id in sorted(actual.keys() | counted.keys())
+            if actual.get(device_id) != counted.get(device_id)
+        }
+    
+    def _recent_counts(self, device_ids: Iterable[str], since: int, exact: bool = False) -> Dict[str, int]:
+        """Raw reading count of each device since ``since``
+
+        Unless ``exact``, summed from the 1m rollups (to the minute, at most
+        1440 rows per device and day) instead of counting raw readings. One
+        primary key range per device: a single GROUP BY over the window makes
+        SQLite scan the whole rollup table.
+        """
+        retained = self.retention.get("1m") is None or self.retention["1m"] >= time.time() - since
+        if exact or not retained:
+            return {device_id: self.count_readings(device_id, since) for device_id in device_ids}
+        cursor = self.connection().cursor()
+        sql = f"SELECT TOTAL(samples) FROM {_rollup_table('1m')} WHERE device_id = ? AND bucket >= ?"
+        return {
+            device_id: int(cursor.execute(sql, (device_id, since - since % 60)).fetchone()[0])
+            for device_id in device_ids
+        }
+    
+    def get_device_reading_stats(self, recent_since: int, exact: bool = False) -> List[Dict]:
+        """Get each device's raw reading count, first/last timestamp and count since ``recent_since``
+
+        Served from the reading counters and the 1m rollups. With ``exact``
+        the recent counts come from raw readings; call rebuild_reading_stats
+        first for exact totals too.
+        """
+        stats = self.reading_counters.get_all()
+        recent = self._recent_counts(stats, recent_since, exact)
+        return [{
+            "device_id": device_id,
+            "record_count": count,
+            "first_record": first,
+            "last_record": last,
+            "recent_count": recent.get(device_id, 0),
+        } for device_id, (count, first, last) in sorted(stats.items())]
+    
+    @contextmanager
+    def _deleting_readings(self) -> Iterator[Tuple[sqlite3.Connection, Dict[str, int]]]:
+        """Transaction for deleting raw readings that keeps the reading counters in step
+
+        Callers add each device's number of deleted rows to the yielded dict
+        (counted before deleting them); on commit the counters are reduced
+        by it and the devices' first timestamps moved past the deleted rows.
+        """
+        removed: Dict[str, int] = {}
+        changes = []
+        with self.connections.transaction() as conn:
+            yield conn, removed
+            for device_id, count in removed.items():
+                if not count:
+                    continue
+                first = self._first_timestamp(conn, device_id)
+                if first is None:
+                    conn.execute("DELETE FROM reading_stats WHERE device_id = ?", (device_id,))
+                else:
+                    conn.execute(
+                        "UPDATE reading_stats SET record_count = MAX(record_count - ?, 0), first_record = ? WHERE device_id = ?",
+                        (count, first, device_id)
+                    )
+                changes.append((device_id, count, first))
+        for change in changes:
+            self.reading_counters.remove(*change)
+    
+    def _count_removed(self, conn: sqlite3.Connection, table: str, where: str, params: tuple,
+                       removed: Dict[str, int]):
+        """Add per-device counts of the rows of a raw table matching ``where`` to ``removed``"""
+        if table == "power_samples":
+            sql = f'''
+                SELECT k.device_id, COUNT(*)
+                FROM (SELECT device_key FROM power_samples WHERE {where}) s
+                JOIN device_keys k ON k.device_key = s.device_key
+                GROUP BY k.device_id
+            '''
+        else:
+            sql = f"SELECT device_id, COUNT(*) FROM {table} WHERE {where} GROUP BY device_id"
+        for device_id, count in conn.execute(sql, params).fetchall():
+            removed[device_id] = removed.get(device_id, 0) + count
+    
+    def _first_timestamp(self, conn: sqlite3.Connection, device_id: str) -> Optional[int]:
+        """Timestamp of a device's oldest raw reading (index lookups only)"""
+        if self.compact:
+            row = conn.execute("SELECT device_key FROM device_keys WHERE device_id = ?", (device_id,)).fetchone()
+            if row is None:
+                return None
+            firsts = [
+                conn.execute("SELECT MIN(timestamp) FROM power_samples WHERE device_key = ?", row).fetchone()[0],
+                conn.execute("SELECT MIN(first_timestamp) FROM power_chunks WHERE device_key = ?", row).fetchone()[0],
+            ]
+        else:
+            firsts = [
+                conn.execute(f"SELECT MIN(timestamp) FROM {table} WHERE device_id = ?", (device_id,)).fetchone()[0]
+                for table in self._reading_tables()
+            ]
+        return min((first for first in firsts if first is not None), default=None)
+    
+    def delete_device_readings(self, device_id: str) -> int:
+        """Delete all raw readings of a device and return how many were deleted"""
+        if self.compact:
+            return self._delete_compact_device(device_id)
+        deleted = 0
+        with self._deleting_readings() as (conn, removed):
+            for table in self._reading_tables():
+                deleted += conn.execute(f"DELETE FROM {table} WHERE device_id = ?", (device_id,)).rowcount
+            removed[device_id] = deleted
+        return deleted
+    
+    def _delete_compact_device(self, device_id: str) -> int:
+        """Delete a device's rows, chunks and dictionary key"""
+        with self._deleting_readings() as (conn, removed):
+            row = conn.execute("SELECT device_key FROM device_keys WHERE device_id = ?", (device_id,)).fetchone()
+            if row is None:
+                return 0
+            deleted = conn.execute("DELETE FROM power_samples WHERE device_key = ?", row).rowcount
+            deleted += int(conn.execute("SELECT TOTAL(samples) FROM power_chunks WHERE device_key = ?", row).fetchone()[0])
+            conn.execute("DELETE FROM power_chunks WHERE device_key = ?", row)
+            conn.execute("DELETE FROM device_keys WHERE device_key = ?", row)
+            removed[device_id] = deleted
+        self._device_keys.pop(device_id, None)
+        return deleted
+    
+    def delete_readings_before(self, cutoff: int) -> int:
+        """Delete raw readings older than ``cutoff`` and return how many were deleted
+
+        When partitioned, partitions that end before the cutoff are dropped
+        whole and only the partition containing it is deleted row by row.
+        Compact chunks are likewise deleted whole or re-encoded without the
+        expired rows.
+        """
+        if self.compact:
+            with self._deleting_readings() as (conn, removed):
+                self._count_removed(conn, "power_samples", "timestamp < ?", (cutoff,), removed)
+                deleted = conn.execute("DELETE FROM power_samples WHERE timestamp < ?", (cutoff,)).rowcount
+                deleted += self._delete_expired_chunks(conn, cutoff, removed=removed)
+                for chunk_id, device_id, data in conn.execute('''
+                    SELECT c.chunk_id, k.device_id, c.data
+                    FROM power_chunks c JOIN device_keys k ON k.device_key = c.device_key
+                    WHERE c.bucket < ? AND c.first_timestamp < ?
+                ''', (cutoff, cutoff)).fetchall():
+                    columns = decode_chunk(data)
+                    kept = [index for index, timestamp in enumerate(columns[0]) if timestamp >= cutoff]
+                    deleted += len(columns[0]) - len(kept)
+                    removed[device_id] = removed.get(device_id, 0) + len(columns[0]) - len(kept)
+                    columns = [[column[index] for index in kept] for column in columns]
+                    conn.execute(
+                        "UPDATE power_chunks SET samples = ?, first_timestamp = ?, data = ? WHERE chunk_id = ?",
+                        (len(kept), columns[0][0], encode_chunk(columns), chunk_id)
+                    )
+            return deleted
+        if not self.partition:
+            with self._deleting_readings() as (conn, removed):
+                self._count_removed(conn, "power_readings", "timestamp < ?", (cutoff,), removed)
+                return conn.execute("DELETE FROM power_readings WHERE timestamp < ?", (cutoff,)).rowcount
+        
+        deleted = 0
+        expired = [key for key in self.get_partitions() if _partition_bounds(key)[1] <= cutoff]
+        with self._deleting_readings() as (conn, removed):
+            for key in self.get_partitions():
+                start, end = _partition_bounds(key)
+                if key in expired:
+                    deleted += self._drop_partition(conn, key, removed)
+                elif start < cutoff:
+                    self._count_removed(conn, PARTITION_PREFIX + key, "timestamp < ?", (cutoff,), removed)
+                    deleted += conn.execute(
+                        f"DELETE FROM {PARTITION_PREFIX}{key} WHERE timestamp < ?", (cutoff,)
+                    ).rowcount
+        return deleted
+    
+    def _delete_expired_chunks(self, conn: sqlite3.Connection, cutoff: int, max_rows: Optional[int] = None,
+                               removed: Optional[Dict[str, int]] = None) -> int:
+        """Delete chunks whose readings are all older than ``cutoff`` and return their row count
+
+        With ``max_rows``, stops before the chunk that would exceed it (but
+        always deletes at least one). Per-device row counts are added to
+        ``removed``.
+        """
+        expired, deleted = [], 0
+        for chunk_id, device_id, samples in conn.execute('''
+            SELECT c.chunk_id, k.device_id, c.samples
+            FROM power_chunks c JOIN device_keys k ON k.device_key = c.device_key
+            WHERE c.bucket < ? AND c.last_timestamp < ?
+            ORDER BY c.bucket LIMIT ?
+        ''', (cutoff, cutoff, max_rows if max_rows is not None else -1)).fetchall():
+            if max_rows is not None and expired and deleted + samples > max_rows:
+                break
+            expired.append((chunk_id,))
+            deleted += samples
+            if removed is not None:
+                removed[device_id] = removed.get(device_id, 0) + samples
+        conn.executemany("DELETE FROM power_chunks WHERE chunk_id = ?", expired)
+        return deleted
+    
+    def _drop_partition(self, conn: sqlite3.Connection, key: str, removed: Optional[Dict[str, int]] = None) -> int:
+        """Drop one partition (keeping the view valid) and return its row count
+
+        Per-device row counts are added to ``removed``.
+        """
+        table = PARTITION_PREFIX + key
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        counts: Dict[str, int] = {}
+        self._count_removed(conn, table, "1", (), counts)
+        for device_id, count in counts.items():
+            if removed is not None:
+                removed[device_id] = removed.get(device_id, 0) + count
+        rows = sum(counts.values())
+        remaining = [other for other in self.get_partitions() if other != key]
+        if not remaining:
+            # The view needs at least one table to select from
+            remaining = [_partition_key(int(datetime.now().timestamp()), self.partition)]
+            _create_partition(conn.cursor(), remaining[0])
+        _create_partition_view(conn.cursor(), remaining)
+        conn.execute(f"DROP TABLE {table}")
+        self._partition_keys = set(remaining)
+        return rows
+    
+    def delete_expired_batch(self, source: str, cutoff: int, batch_size: int = 1000) -> int:
+        """Delete up to ``batch_size`` rows older than ``cutoff`` from "raw" or a rollup table
+
+        Each call is one short write transaction, so callers can loop until it
+        returns 0 while collection keeps writing in between. Expired raw
+        partitions are dropped whole, one per call, and compact chunks are
+        deleted once every reading in them has expired.
+        """
+        if source == "raw":
+            key_columns, column = "device_id, timestamp", "timestamp"
+            tables = self._reading_tables()
+            if self.compact:
+                # Sealed hours go first, whole chunks at a time
+                with self._deleting_readings() as (conn, removed):
+                    deleted = self._delete_expired_chunks(conn, cutoff, batch_size, removed)
+                if deleted:
+                    return deleted
+                key_columns, tables = "device_key, timestamp", ["power_samples"]
+            elif self.partition:
+                for key in self.get_partitions():
+                    if _partition_bounds(key)[1] <= cutoff:
+                        with self._deleting_readings() as (conn, removed):
+                            dropped = self._drop_partition(conn, key, removed)
+                        if dropped:
+                            return dropped
+                tables = [PARTITION_PREFIX + key for key in self.get_partitions() if _partition_bounds(key)[0] < cutoff]
+        elif source in ROLLUP_RESOLUTIONS:
+            key_columns, column = "device_id, bucket", "bucket"
+            tables = [_rollup_table(source)]
+        else:
+            raise ValueError(f"Unknown retention source: {source}")
+        
+        with self._deleting_readings() as (conn, removed):
+            for table in tables:
+                if source == "raw":
+                    # The same rows the DELETE below picks: the oldest by the primary key
+                    self._count_removed(
+                        conn, table, f"({key_columns}) IN (SELECT {key_columns} FROM {table} WHERE {column} < ? LIMIT ?)",
+                        (cutoff, batch_size), removed
+                    )
+                deleted = conn.execute(f'''
+                    DELETE FROM {table}
+                    WHERE ({key_columns}) IN (
+                        SELECT {key_columns} FROM {table} WHERE {column} < ? LIMIT ?
+                    )
+                ''', (cutoff, batch_size)).rowcount
+                if deleted:
+                    return deleted
+        return 0
+    
+    def get_auto_vacuum(self) -> str:
+        """Get the database's auto_vacuum mode (none, full or incremental)"""
+        return AUTO_VACUUM_MODES[self.connection().execute("PRAGMA auto_vacuum").fetchone()[0]]
+    
+    def enable_incremental_vacuum(self) -> bool:
+        """Switch an existing database to auto_vacuum=INCREMENTAL
+
+        The mode only takes effect through a full VACUUM, which rewrites the
+        whole file once. Returns True if the database was converted, False if
+        it already was incremental.
+        """
+        if self.get_auto_vacuum() == "incremental":
+            return False
+        conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+        try:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+        return True
+    
+    def vacuum(self):
+        """Rebuild the database file, returning every free page to the filesystem"""
+        conn = sqlite3.connect(self.db_path, isolation_level=None, timeout=30)
+        try:
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+    
+    def get_free_pages(self) -> int:
+        """Get the number of unused pages in the database file"""
+        return self.connection().execute("PRAGMA freelist_count").fetchone()[0]
+    
+    def incremental_vacuum(self, pages: int = 1000) -> int:
+        """Return up to ``pages`` free pages to the filesystem and report how many remain free"""
+        conn = self.connection()
+        # The pragma frees one page per step and returns no rows, so execute() would
+        # stop after the first page; executescript() steps it to completion
+        conn.executescript(f"PRAGMA incremental_vacuum({max(1, int(pages))})")
+        return self.get_free_pages()
+    
+    def get_archives(self) -> List[Tuple[str, str]]:
+        """Get (partition key, path) of every archived partition, oldest first"""
+        if not os.path.isdir(self.archive_dir):
+            return []
+        archives = []
+        for name in sorted(os.listdir(self.archive_dir)):
+            if name.startswith(PARTITION_PREFIX) and name.endswith(".parquet"):
+                archives.append((name[len(PARTITION_PREFIX):-len(".parquet")], os.path.join(self.archive_dir, name)))
+        return archives
+    
+    def archive_partitions(self, before: int) -> List[str]:
+        """Compact partitions that end before ``before`` into Parquet archives and drop them
+
+        Each archive is a zstd-compressed Parquet file (the export schema,
+        newest first) in ``<db_path>.archive``, written read-only. Archives stay
+        queryable with any Parquet reader, and iter_readings (exports) still
+        includes them. Requires the optional pyarrow dependency. Returns the
+        paths written.
+        """
+        if not self.partition:
+            raise ValueError("archiving requires a partitioned database")
+        if not parquet_available():
+            raise RuntimeError("archiving requires pyarrow (install the 'parquet' extra)")
+        
+        written = []
+        for key in self.get_partitions():
+            if _partition_bounds(key)[1] > before:
+                continue
+            os.makedirs(self.archive_dir, exist_ok=True)
+            path = os.path.join(self.archive_dir, f"{PARTITION_PREFIX}{key}.parquet")
+            conn = self.connections.open()
+            try:
+                cursor = conn.cursor()
+                cursor.row_factory = None
+                cursor.execute(f"SELECT {RAW_SELECT_COLUMNS} FROM {PARTITION_PREFIX}{key} ORDER BY timestamp DESC")
+                batches = iter(lambda: cursor.fetchmany(50000), [])
+                with open(path + ".tmp", "wb") as archive:
+                    for chunk in parquet_chunks(batches):
+                        archive.write(chunk)
+                    archive.flush()
+                    os.fsync(archive.fileno())
+            finally:
+                conn.close()
+            os.replace(path + ".tmp", path)
+            os.chmod(path, 0o444)
+            
+            with self._deleting_readings() as (conn, removed):
+                self._drop_partition(conn, key, removed)
+            written.append(path)
+        return written
+    
+    def delete_device_rollups(self, device_id: str):
+        """Delete all rollup and energy rows for a device"""
+        with self.connections.transaction() as conn:
+            for resolution in ROLLUP_RESOLUTIONS:
+                conn.execute(f"DELETE FROM {_rollup_table(resolution)} WHERE device_id = ?", (device_id,))
+            for table in (*ENERGY_TABLES.values(), "power_energy_state"):
+                conn.execute(f"DELETE FROM {table} WHERE device_id = ?", (device_id,))
@@ -0,0 +1,187 @@
+"""Non-blocking database access for the async API handlers
+
+SQLite calls block, so an ``async def`` handler that queries PowerDataStorage
+directly stalls the event loop, and every other request with it, for the
+query's full duration. AsyncDatabase runs them on worker threads instead:
+reads on a bounded pool of reader threads, each with its own pooled
+connection (WAL lets them run alongside the writer), and writes on a single
+writer thread, so handler writes are serialized in process rather than
+waiting on each other inside SQLite's busy timeout. Streams (exports) get
+their own threads, since each holds its thread until the client has
+downloaded everything.
+"""
+
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Dict, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Called after every call with (pool "read", "write" or "stream", function name, seconds it ran, whether it raised)
+CallObserver = Callable[[str, str, float, bool], None]
+
+_DONE = object()
+
+
+class _PoolStats:
+    """Call counts and queue wait of one thread pool"""
+
+    def __init__(self, pool: str, observer: Optional[CallObserver] = None):
+        self.pool = pool
+        self.observer = observer
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.active = 0
+        self.queued = 0
+        self.max_wait = 0.0
+
+    def run(self, fn: Callable[[], T], submitted: float, name: str) -> T:
+        started = time.perf_counter()
+        with self.lock:
+            self.queued -= 1
+            self.active += 1
+            self.max_wait = max(self.max_wait, started - submitted)
+        failed = True
+        try:
+            result = fn()
+            failed = False
+            return result
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.calls += 1
+            if self.observer is not None:
+                try:
+                    self.observer(self.pool, name, time.perf_counter() - started, failed)
+                except Exception as e:
+                    print(f"Error in database call observer: {e}")
+
+    def submitted(self):
+        with self.lock:
+            self.queued += 1
+
+    def metrics(self) -> Dict:
+        with self.lock:
+            return {
+                "calls": self.calls,
+                "active": self.active,
+                "queued": self.queued,
+                "max_wait_ms": round(self.max_wait * 1000, 2),
+            }
+
+
+class AsyncDatabase:
+    """Runs blocking storage calls on reader threads or the single writer thread
+
+    ``read`` and ``write`` take any callable (usually a PowerDataStorage
+    method) plus its arguments and await its result. At most ``readers``
+    reads run at once; more wait in the pool's queue without holding up the
+    event loop. ``iterate`` streams a blocking iterator, such as an export,
+    from one of ``streams`` stream threads, so slow downloads never take
+    reader threads away from other queries. ``observer`` is told how long
+    each call ran (a whole stream, for ``iterate``).
+    """
+
+    def __init__(self, readers: int = 4, streams: int = 2, observer: Optional[CallObserver] = None):
+        self.readers = readers
+        self.streams = streams
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="db-read")
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-write")
+        self._streamers = ThreadPoolExecutor(max_workers=streams, thread_name_prefix="db-stream")
+        self._read_stats = _PoolStats("read", observer)
+        self._write_stats = _PoolStats("write", observer)
+        self._stream_stats = _PoolStats("stream", observer)
+        self._closing = threading.Event()
+
+    async def _submit(self, executor: ThreadPoolExecutor, stats: _PoolStats, fn: Callable[..., T],
+                      args, kwargs) -> T:
+        call = functools.partial(fn, *args, **kwargs)
+        stats.submitted()
+        return await asyncio.get_running_loop().run_in_executor(
+            executor, stats.run, call, time.perf_counter(), getattr(fn, "__name__", "call")
+        )
+
+    async def read(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """Run a query on a reader thread"""
+        return await self._submit(self._readers, self._read_stats, fn, args, kwargs)
+
+    async def write(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """Run a write on the writer thread, after any writes already queued"""
+        return await self._submit(self._writer, self._write_stats, fn, args, kwargs)
+
+    async def iterate(self, iterator: Iterator[T], prefetch: int = 0) -> AsyncIterator[T]:
+        """Yield the items of a blocking iterator, which runs entirely in one stream thread
+
+        Items are produced on demand, at most ``prefetch`` ahead of the
+        consumer: producing while the event loop sends the previous item only
+        competes with it for the GIL. If the consumer stops early (a client
+        disconnecting mid-export), the iterator is closed in its own thread.
+        """
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        slots = threading.Semaphore(prefetch)
+        stopped = threading.Event()
+
+        def hand_over(item, error=None):
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, (item, error))
+            except RuntimeError:
+                # The event loop has already closed
+                stopped.set()
+
+        def produce():
+            try:
+                while True:
+                    # Waits for the consumer, giving up if the database is shutting down
+                    while not slots.acquire(timeout=0.5):
+                        if self._closing.is_set():
+                            stopped.set()
+                            break
+                    if stopped.is_set():
+                        break
+                    item = next(iterator, _DONE)
+                    hand_over(item)
+                    if item is _DONE:
+                        break
+            except Exception as e:
+                hand_over(None, e)
+            finally:
+                close = getattr(iterator, "close", None)
+                if close is not None:
+                    close()
+
+        self._stream_stats.submitted()
+        loop.run_in_executor(self._streamers, self._stream_stats.run, produce, time.perf_counter(),
+                             getattr(iterator, "__name__", "iterate"))
+        try:
+            while True:
+                slots.release()
+                item, error = await queue.get()
+                if error is not None:
+                    raise error
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            stopped.set()
+            slots.release()
+
+    def metrics(self) -> Dict:
+        """Reader, writer and stream pool counters"""
+        return {
+            "reader_threads": self.readers,
+            "stream_threads": self.streams,
+            "reads": self._read_stats.metrics(),
+            "writes": self._write_stats.metrics(),
+            "streams": self._stream_stats.metrics(),
+        }
+
+    def close(self):
+        """Wait for queued calls to finish and stop the threads (unfinished streams are abandoned)"""
+        self._closing.set()
+        self._readers.shutdown(wait=True)
+        self._streamers.shutdown(wait=True)
+        self._writer.shutdown(wait=True)
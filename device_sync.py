@@ -0,0 +1,96 @@
+import asyncio
+from datetime import datetime
+from typing import Dict, Optional
+
+from data_storage import PowerDataStorage
+from db_access import AsyncDatabase
+from switchbot_client import AsyncSwitchBotClient
+
+# Device types whose status reports power (the collector's parser expects Plug Mini bodies)
+POWER_DEVICE_TYPE_PREFIXES = ("Plug Mini",)
+
+
+class DeviceSync:
+    """Periodic sync of the device registry from the SwitchBot device list
+
+    The device list is fetched once at start and then every ``interval``
+    seconds, never per collection cycle, so discovering new plugs costs a
+    handful of API calls a day. Only power-reporting device types are
+    registered; renamed devices get their new name, and devices removed from
+    the account stay registered (and can be disabled).
+    """
+
+    def __init__(self,
+                 client: AsyncSwitchBotClient,
+                 storage: PowerDataStorage,
+                 database: AsyncDatabase,
+                 interval: float = 3600.0):
+        self.client = client
+        self.storage = storage
+        self.database = database
+        self.interval = interval
+        
+        self._task: Optional[asyncio.Task] = None
+        
+        self.syncs = 0
+        self.last_sync: Optional[str] = None
+        self.last_result: Optional[Dict[str, int]] = None
+        self.last_error: Optional[str] = None
+    
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+    
+    def start(self):
+        """Start the periodic sync task on the running event loop"""
+        if not self.running:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+    
+    async def stop(self):
+        """Stop the sync task"""
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+    
+    async def _run(self):
+        while True:
+            await self.sync_once()
+            await asyncio.sleep(self.interval)
+    
+    async def sync_once(self) -> Optional[Dict[str, int]]:
+        """Fetch the device list once and update the registry (None if the fetch failed)"""
+        self.last_sync = datetime.now().isoformat()
+        self.syncs += 1
+        try:
+            devices = await self.client.get_devices()
+            if devices is None:
+                self.last_error = "Failed to get device list"
+                return None
+            
+            plugs = [device for device in devices
+                     if (device.get("device_type") or "").startswith(POWER_DEVICE_TYPE_PREFIXES)]
+            result = await self.database.write(self.storage.sync_devices, plugs)
+            self.last_result = {**result, "listed": len(devices)}
+            self.last_error = None
+            if result["added"]:
+                print(f"{datetime.now().isoformat()}: Registered {result['added']} new devices from the device list")
+            return result
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"{datetime.now().isoformat()}: Device sync failed: {e}")
+            return None
+    
+    def status(self) -> Dict:
+        """Sync interval and counters"""
+        return {
+            "running": self.running,
+            "interval_seconds": self.interval,
+            "syncs": self.syncs,
+            "last_sync": self.last_sync,
+            "last_result": self.last_result,
+            "last_error": self.last_error,
+        }
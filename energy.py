@@ -0,0 +1,88 @@
+"""Energy integration of power readings into per-day totals
+
+Energy is the trapezoidal integral of ``power`` (W) between consecutive
+readings of a device, so it does not depend on the plug's electricity_of_day
+counter and its midnight resets. An interval longer than ``max_gap``, or
+one with a missing power value, is counted as gap time rather than
+guessed. Intervals that cross local midnight are split between the two
+days, with power interpolated linearly at the boundary.
+"""
+
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, Optional, Tuple
+
+PERIODS = ("day", "month")
+
+# Longest interval between two readings that is still integrated (seconds)
+DEFAULT_MAX_GAP = 900
+
+# Per-day accumulator: [energy_wh, covered_seconds, gap_seconds, samples]
+DayTotals = Dict[str, List[float]]
+
+
+# (start, end, key) of the last day looked up; readings arrive in time order,
+# so almost every lookup hits it
+_last_day: Tuple[float, float, str] = (0.0, 0.0, "")
+
+
+def local_day(timestamp: float) -> Tuple[str, float]:
+    """Local calendar day (YYYY-MM-DD) of a timestamp and the timestamp of the following midnight"""
+    global _last_day
+    start, end, key = _last_day
+    if not start <= timestamp < end:
+        day = datetime.fromtimestamp(timestamp).date()
+        start = datetime.combine(day, time()).timestamp()
+        end = datetime.combine(day + timedelta(days=1), time()).timestamp()
+        key = day.isoformat()
+        _last_day = (start, end, key)
+    return key, end
+
+
+def integrate(totals: DayTotals, previous: Optional[Tuple[int, Optional[float]]],
+              current: Tuple[int, Optional[float]], max_gap: int = DEFAULT_MAX_GAP):
+    """Add the interval from ``previous`` to ``current`` (timestamp, power) to ``totals``
+
+    ``current`` must be newer than ``previous``; its reading is counted as a
+    sample of its own day. Without a previous reading only the sample counts.
+    """
+    timestamp, power = current
+    totals.setdefault(local_day(timestamp)[0], [0.0, 0, 0, 0])[3] += 1
+    if previous is None:
+        return
+
+    start, start_power = previous
+    duration = timestamp - start
+    integrated = start_power is not None and power is not None and duration <= max_gap
+    slope = (power - start_power) / duration if integrated else 0.0
+    segment_start = start
+    while segment_start < timestamp:
+        key, midnight = local_day(segment_start)
+        segment_end = min(timestamp, midnight)
+        day = totals.setdefault(key, [0.0, 0, 0, 0])
+        if integrated:
+            begin_power = start_power + slope * (segment_start - start)
+            end_power = start_power + slope * (segment_end - start)
+            day[0] += (begin_power + end_power) / 2 * (segment_end - segment_start) / 3600
+            day[1] += segment_end - segment_start
+        else:
+            day[2] += segment_end - segment_start
+        segment_start = segment_end
+
+
+def month_totals(days: DayTotals) -> DayTotals:
+    """Sum per-day totals into per-month totals (YYYY-MM)"""
+    months: DayTotals = {}
+    for day, values in days.items():
+        month = months.setdefault(day[:7], [0.0, 0, 0, 0])
+        for index, value in enumerate(values):
+            month[index] += value
+    return months
+
+
+def default_range(period: str, today: Optional[date] = None) -> Tuple[str, str]:
+    """Default (start, end) keys: the last 30 days or the last 12 months, including the current one"""
+    today = today or date.today()
+    if period == "month":
+        year, month = divmod(today.year * 12 + today.month - 1 - 11, 12)
+        return f"{year:04d}-{month + 1:02d}", today.strftime("%Y-%m")
+    return (today - timedelta(days=29)).isoformat(), today.isoformat()
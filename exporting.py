@@ -0,0 +1,138 @@
+"""Streaming encoders for reading exports
+
+Each encoder turns batches of READING_FIELDS tuples (as yielded by
+PowerDataStorage.iter_readings) into a stream of byte chunks, one chunk per
+batch, so an export never holds more than one batch in memory.
+"""
+
+import csv
+import io
+import zlib
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional
+
+FORMATS = ("csv", "parquet")
+
+CSV_HEADER = ["timestamp", "datetime", "device_id", "voltage", "electric_current", "power", "electricity_of_day", "power_on"]
+
+
+def parquet_available() -> bool:
+    """Check whether the optional pyarrow dependency is installed"""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def csv_chunks(batches: Iterable[List[tuple]]) -> Iterator[bytes]:
+    """Encode batches as UTF-8 CSV with the dashboard's export columns"""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(CSV_HEADER)
+    for rows in batches:
+        for device_id, timestamp, voltage, electric_current, power, electricity_of_day, power_on in rows:
+            writer.writerow([
+                timestamp,
+                datetime.fromtimestamp(timestamp).isoformat(),
+                device_id,
+                voltage,
+                electric_current,
+                power,
+                electricity_of_day,
+                None if power_on is None else int(power_on)
+            ])
+        yield output.getvalue().encode("utf-8")
+        output.seek(0)
+        output.truncate()
+
+
+def gzip_chunks(chunks: Iterable[bytes], level: int = 6) -> Iterator[bytes]:
+    """Compress a chunk stream into a single gzip member"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file object that hands written bytes back out in chunks"""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+    
+    def writable(self) -> bool:
+        return True
+    
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+    
+    def tell(self) -> int:
+        return self.position
+    
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_chunks(batches: Iterable[List[tuple]]) -> Iterator[bytes]:
+    """Encode batches as a Parquet file with one row group per batch (requires pyarrow)"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    
+    schema = pa.schema([
+        ("timestamp", pa.int64()),
+        ("datetime", pa.timestamp("s", tz="UTC")),
+        ("device_id", pa.string()),
+        ("voltage", pa.float64()),
+        ("electric_current", pa.float64()),
+        ("power", pa.float64()),
+        ("electricity_of_day", pa.float64()),
+        ("power_on", pa.bool_()),
+    ])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    try:
+        for rows in batches:
+            device_ids, timestamps, voltages, currents, powers, energies, power_on = zip(*rows)
+            writer.write_table(pa.table([
+                pa.array(timestamps, pa.int64()),
+                pa.array(timestamps, pa.int64()).cast(pa.timestamp("s", tz="UTC")),
+                pa.array(device_ids, pa.string()),
+                pa.array(voltages, pa.float64()),
+                pa.array(currents, pa.float64()),
+                pa.array(powers, pa.float64()),
+                pa.array(energies, pa.float64()),
+                pa.array([None if value is None else bool(value) for value in power_on], pa.bool_()),
+            ], schema=schema))
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+def read_archive_batches(path: str, device_id: Optional[str] = None, start: Optional[int] = None,
+                         batch_size: int = 5000) -> Iterator[List[tuple]]:
+    """Yield READING_FIELDS tuples from a Parquet file written by parquet_chunks, in file order"""
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    
+    columns = ["device_id", "timestamp", "voltage", "electric_current", "power", "electricity_of_day", "power_on"]
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=columns):
+        if device_id is not None:
+            mask = pc.equal(batch.column("device_id"), device_id)
+        else:
+            mask = pc.not_equal(batch.column("device_id"), "all")
+        if start is not None:
+            mask = pc.and_(mask, pc.greater_equal(batch.column("timestamp"), start))
+        batch = batch.filter(mask)
+        if batch.num_rows:
+            values = [batch.column(column).to_pylist() for column in columns]
+            values[-1] = [None if value is None else int(value) for value in values[-1]]
+            yield list(zip(*values))
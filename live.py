@@ -0,0 +1,99 @@
+import asyncio
+import json
+import threading
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple
+
+
+class ReadingHub:
+    """Fan-out of saved readings to live-stream subscribers
+
+    Every published reading gets a sequence number and is kept in a replay
+    buffer of the last ``replay_size`` readings, so new or reconnecting
+    subscribers catch up from memory. Each subscriber has a bounded queue; a
+    subscriber that falls behind loses its oldest events rather than slowing
+    down the others. ``publish`` may be called from any thread once the hub
+    is bound to the event loop with ``start``.
+    """
+
+    def __init__(self, replay_size: int = 100, queue_size: int = 256):
+        self.replay: Deque[Tuple[int, Dict]] = deque(maxlen=replay_size)
+        self.queue_size = queue_size
+        self.subscribers: Set[asyncio.Queue] = set()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.lock = threading.Lock()
+        self.sequence = 0
+        self.published = 0
+        self.dropped = 0
+    
+    def start(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        """Bind the hub to the event loop that serves subscribers"""
+        self.loop = loop or asyncio.get_running_loop()
+    
+    def publish(self, readings: Iterable[Dict]):
+        """Broadcast readings to every subscriber and remember them for replay"""
+        events = []
+        with self.lock:
+            for data in readings:
+                self.sequence += 1
+                event = (self.sequence, dict(data))
+                self.replay.append(event)
+                events.append(event)
+            self.published += len(events)
+        if not events or self.loop is None or self.loop.is_closed():
+            return
+        
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self.loop:
+            self._fan_out(events)
+        else:
+            self.loop.call_soon_threadsafe(self._fan_out, events)
+    
+    def _fan_out(self, events: List[Tuple[int, Dict]]):
+        for queue in list(self.subscribers):
+            for event in events:
+                if queue.full():
+                    queue.get_nowait()
+                    self.dropped += 1
+                queue.put_nowait(event)
+    
+    def subscribe(self, last_event_id: Optional[int] = None, replay: Optional[int] = None) -> asyncio.Queue:
+        """Register a subscriber queue pre-filled with replayed events
+
+        With ``last_event_id`` only newer events are replayed (everything if
+        the ID is from before a restart); otherwise the last ``replay`` events.
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        with self.lock:
+            events = list(self.replay)
+        if last_event_id is not None and last_event_id <= self.sequence:
+            events = [event for event in events if event[0] > last_event_id]
+        elif replay is not None:
+            events = events[-replay:] if replay > 0 else []
+        for event in events[-self.queue_size:]:
+            queue.put_nowait(event)
+        self.subscribers.add(queue)
+        return queue
+    
+    def unsubscribe(self, queue: asyncio.Queue):
+        """Remove a subscriber queue"""
+        self.subscribers.discard(queue)
+    
+    def metrics(self) -> Dict:
+        """Hub counters for monitoring"""
+        return {
+            "subscribers": len(self.subscribers),
+            "published": self.published,
+            "dropped": self.dropped,
+            "replay_buffered": len(self.replay),
+            "sequence": self.sequence,
+        }
+
+
+def format_event(event: Tuple[int, Dict], event_type: str = "reading") -> str:
+    """Encode a hub event as a Server-Sent Events message"""
+    sequence, data = event
+    return f"id: {sequence}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n"
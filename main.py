@@ -1,23 +1,129 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Query, Request
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, HTMLResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
 import asyncio
 import os
+import time
+import zlib
+from itertools import chain
+import numpy as np
 from datetime import datetime
-from typing import Optional
+from typing import List, Optional
 from dotenv import load_dotenv
-from switchbot_client import SwitchBotClient
-from data_storage import PowerDataStorage
+from switchbot_client import AsyncSwitchBotClient, DEFAULT_BASE_URL
+from data_storage import PowerDataStorage, PARTITION_PREFIX, READING_FIELDS, ROLLUP_RESOLUTIONS
+from db_access import AsyncDatabase
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, MetricsRegistry
+from scheduler import CollectionScheduler
+from rate_limit import AdaptiveInterval, ApiBudget, CircuitBreaker
+from retention import RetentionManager, parse_retention_policy
+from device_sync import DeviceSync
+from live import ReadingHub, format_event
+from anomaly import DetectionEngine, LogSink, WebhookSink, parse_detection_rules
+from exporting import FORMATS as EXPORT_FORMATS, csv_chunks, gzip_chunks, parquet_available, parquet_chunks
+from downsampling import METHODS as DOWNSAMPLE_METHODS, downsample as downsample_points
+from energy import DEFAULT_MAX_GAP as ENERGY_MAX_GAP, PERIODS as ENERGY_PERIODS, default_range as energy_range
+from response_formats import FORMATS, BINARY_MEDIA_TYPE, data_columns, to_columns, encode_binary
 
 # Load environment variables from .env file
 load_dotenv()
 
 app = FastAPI(title="SwitchBot Power Monitor", version="1.0.0")
 templates = Jinja2Templates(directory="templates")
+# Compress larger responses for clients that send Accept-Encoding: gzip
+app.add_middleware(GZipMiddleware, minimum_size=int(os.getenv("GZIP_MINIMUM_SIZE", "1024")))
+
+# Prometheus metrics, served at /metrics
+metrics = MetricsRegistry()
+http_request_seconds = metrics.histogram(
+    "http_request_duration_seconds", "HTTP request duration by method, route and status", ("method", "route", "status")
+)
+app.add_middleware(MetricsMiddleware, histogram=http_request_seconds)
+api_request_seconds = metrics.histogram(
+    "switchbot_api_request_duration_seconds", "SwitchBot API request attempt duration by device", ("device_id",)
+)
+api_responses = metrics.counter(
+    "switchbot_api_responses_total", "SwitchBot API request attempts by device and HTTP status (error: no response)",
+    ("device_id", "status")
+)
+collection_cycle_seconds = metrics.histogram(
+    "power_collection_cycle_duration_seconds", "Collection cycle duration (API requests and saving)"
+)
+collection_results = metrics.counter(
+    "power_collection_results_total", "Device collections by outcome (success or failure)", ("device_id", "result")
+)
+db_call_seconds = metrics.histogram(
+    "power_db_call_duration_seconds", "Database call duration by thread pool and method", ("pool", "method")
+)
+db_call_errors = metrics.counter(
+    "power_db_call_errors_total", "Database calls that raised, by thread pool and method", ("pool", "method")
+)
+readings_saved = metrics.counter("power_readings_saved_total", "Readings saved (written, or queued in the write buffer)")
+detection_events = metrics.counter("power_detection_events_total", "Anomaly detection events by rule", ("rule",))
 
 # Global variables for configuration
-switchbot_client: Optional[SwitchBotClient] = None
-storage = PowerDataStorage()
+switchbot_client: Optional[AsyncSwitchBotClient] = None
+collection_scheduler: Optional[CollectionScheduler] = None
+retention_manager: Optional[RetentionManager] = None
+device_sync: Optional[DeviceSync] = None
+detection_engine: Optional[DetectionEngine] = None
+api_budget: Optional[ApiBudget] = None
+api_breaker: Optional[CircuitBreaker] = None
+storage = PowerDataStorage(
+    without_rowid=os.getenv("POWER_DB_WITHOUT_ROWID", "false").lower() in ("1", "true", "yes"),
+    history_cache_size=int(os.getenv("HISTORY_CACHE_SIZE", "128")),
+    history_cache_ttl=float(os.getenv("HISTORY_CACHE_TTL", "30")),
+    partition=os.getenv("POWER_DB_PARTITION") or None,
+    compact=os.getenv("POWER_DB_COMPACT") or None,
+    energy_max_gap=int(os.getenv("ENERGY_MAX_GAP", str(ENERGY_MAX_GAP)))
+)
+def observe_db_call(pool: str, method: str, seconds: float, failed: bool):
+    """Time every database call made through ``database`` for /metrics"""
+    db_call_seconds.observe(seconds, pool=pool, method=method)
+    if failed:
+        db_call_errors.inc(pool=pool, method=method)
+
+# Handlers run storage queries on reader threads and writes on one writer thread
+database = AsyncDatabase(
+    readers=int(os.getenv("DB_READ_THREADS", "4")),
+    streams=int(os.getenv("DB_EXPORT_THREADS", "2")),
+    observer=observe_db_call
+)
+# Pushes every saved reading to /power/stream subscribers
+live_hub = ReadingHub(replay_size=int(os.getenv("LIVE_REPLAY_SIZE", "100")))
+storage.add_save_listener(live_hub.publish)
+storage.add_save_listener(lambda readings: readings_saved.inc(len(readings)))
+
+def detect_anomalies(readings):
+    """Run saved readings through the anomaly detection engine, if enabled"""
+    if detection_engine:
+        detection_engine.process(readings)
+
+storage.add_save_listener(detect_anomalies)
+
+def database_file_sizes():
+    """Sizes of the database file and its write-ahead log, for /metrics"""
+    return {(name,): os.path.getsize(path) for name, path in (("db", storage.db_path), ("wal", storage.db_path + "-wal"))
+            if os.path.exists(path)}
+
+metrics.gauge("power_db_file_size_bytes", "Database file sizes", ("file",), collect=database_file_sizes)
+metrics.gauge(
+    "power_db_readings", "Stored raw readings per device", ("device_id",),
+    collect=lambda: {(device_id,): stats[0] for device_id, stats in storage.reading_counters.get_all().items()}
+)
+metrics.gauge(
+    "switchbot_api_requests_today", "SwitchBot API requests counted against today's quota",
+    collect=lambda: {(): api_budget.status()["used_today"]} if api_budget else {}
+)
+LIVE_KEEPALIVE_SECONDS = 15
+if int(os.getenv("WRITE_BUFFER_ROWS", "0")) > 0:
+    storage.enable_write_buffer(
+        max_rows=int(os.getenv("WRITE_BUFFER_ROWS")),
+        max_age=float(os.getenv("WRITE_BUFFER_SECONDS", "60")),
+        capacity=int(os.getenv("WRITE_BUFFER_CAPACITY", "10000")),
+        fsync_interval=float(os.getenv("WRITE_BUFFER_FSYNC_SECONDS", "0"))
+    )
 
 def init_switchbot_client():
     """Initialize SwitchBot client with environment variables"""
@@ -27,22 +133,172 @@ def init_switchbot_client():
     if not token or not secret:
         return None
     
-    return SwitchBotClient(token, secret)
+    return AsyncSwitchBotClient(
+        token,
+        secret,
+        base_url=os.getenv("SWITCHBOT_API_BASE_URL", DEFAULT_BASE_URL),
+        max_concurrency=int(os.getenv("SWITCHBOT_MAX_CONCURRENCY", "10")),
+        timeout=float(os.getenv("SWITCHBOT_TIMEOUT", "10")),
+        connect_timeout=float(os.getenv("SWITCHBOT_CONNECT_TIMEOUT", "5")),
+        retries=int(os.getenv("SWITCHBOT_RETRIES", "2")),
+        retry_backoff=float(os.getenv("SWITCHBOT_RETRY_BACKOFF", "0.5")),
+        keepalive=float(os.getenv("SWITCHBOT_KEEPALIVE", "60"))
+    )
+
+def init_api_limits(client: AsyncSwitchBotClient):
+    """Count every API request against the daily quota and feed the circuit breaker"""
+    budget = ApiBudget(
+        daily_quota=int(os.getenv("SWITCHBOT_DAILY_QUOTA", "10000")),
+        reserve=float(os.getenv("SWITCHBOT_QUOTA_RESERVE", "0.05")),
+        state_path=storage.db_path + ".budget"
+    )
+    breaker = CircuitBreaker(
+        failure_threshold=int(os.getenv("SWITCHBOT_CIRCUIT_THRESHOLD", "5")),
+        cooldown=float(os.getenv("SWITCHBOT_CIRCUIT_COOLDOWN", "60"))
+    )
+    
+    def on_response(path, status, retry_after, seconds):
+        budget.record()
+        breaker.record(status, retry_after)
+    
+    client.add_response_listener(on_response)
+    return budget, breaker
+
+def observe_api_request(path, status, retry_after, seconds):
+    """Time SwitchBot API requests per device ("device_list" for the device list) for /metrics"""
+    parts = path.strip("/").split("/")
+    device_id = parts[1] if len(parts) == 3 and parts[2] == "status" else "device_list"
+    api_request_seconds.observe(seconds, device_id=device_id)
+    api_responses.inc(device_id=device_id, status=status if status is not None else "error")
 
 def get_db_connection():
-    """Get database connection with row factory"""
-    import sqlite3
-    conn = sqlite3.connect(storage.db_path)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Get the pooled database connection for the current thread (do not close it)"""
+    return storage.connection()
+
+def init_collection_scheduler():
+    """Create the in-process collection scheduler if enabled in the environment"""
+    if os.getenv("COLLECTION_SCHEDULER", "false").lower() not in ("1", "true", "yes"):
+        return None
+    
+    interval = float(os.getenv("COLLECTION_INTERVAL", "20"))
+    max_interval = float(os.getenv("COLLECTION_MAX_INTERVAL", "300"))
+    return CollectionScheduler(
+        collect=collect_devices,
+        get_device_ids=get_known_device_ids,
+        interval=interval,
+        jitter=float(os.getenv("COLLECTION_JITTER", "1")),
+        max_backoff=float(os.getenv("COLLECTION_MAX_BACKOFF", "600")),
+        budget=api_budget,
+        breaker=api_breaker,
+        adaptive=AdaptiveInterval(interval, max_interval) if max_interval > interval else None
+    )
+
+def init_retention_manager():
+    """Create the background retention manager if a policy is configured"""
+    spec = os.getenv("RETENTION_POLICY", "")
+    if not spec.strip():
+        return None
+    
+    return RetentionManager(
+        storage,
+        database,
+        parse_retention_policy(spec),
+        interval=float(os.getenv("RETENTION_INTERVAL", "3600")),
+        batch_size=int(os.getenv("RETENTION_BATCH_SIZE", "1000"))
+    )
+
+def init_device_sync():
+    """Create the periodic device-list sync unless disabled in the environment"""
+    interval = float(os.getenv("DEVICE_SYNC_INTERVAL", "3600"))
+    if interval <= 0:
+        return None
+    
+    return DeviceSync(switchbot_client, storage, database, interval=interval)
+
+async def store_events(events):
+    """Record detection events in the events table"""
+    for event in events:
+        detection_events.inc(rule=event["rule"])
+    await database.write(storage.save_events, events)
+
+def init_detection_engine():
+    """Create the anomaly detection engine if rules are configured"""
+    spec = os.getenv("ANOMALY_RULES", "")
+    if not spec.strip():
+        return None
+    
+    sinks = []
+    if os.getenv("ANOMALY_LOG_EVENTS", "true").lower() in ("1", "true", "yes"):
+        sinks.append(LogSink())
+    if os.getenv("ANOMALY_WEBHOOK_URL"):
+        sinks.append(WebhookSink(os.getenv("ANOMALY_WEBHOOK_URL"), timeout=float(os.getenv("ANOMALY_WEBHOOK_TIMEOUT", "5"))))
+    engine = DetectionEngine(
+        parse_detection_rules(spec),
+        store=store_events,
+        sinks=sinks,
+        active_devices=lambda: storage.get_device_ids(enabled_only=True),
+        alpha=float(os.getenv("ANOMALY_EWMA_ALPHA", "0.1")),
+        warmup=int(os.getenv("ANOMALY_WARMUP", "10")),
+        cooldown=float(os.getenv("ANOMALY_COOLDOWN", "600")),
+        max_power_margin=float(os.getenv("ANOMALY_MAX_POWER_MARGIN", "0.1")),
+        left_on_hold=float(os.getenv("ANOMALY_LEFT_ON_MINUTES", "60")) * 60
+    )
+    engine.seed(storage.get_latest_readings())
+    return engine
 
 @app.on_event("startup")
 async def startup_event():
-    """Initialize the SwitchBot client on startup"""
-    global switchbot_client
+    """Initialize the SwitchBot client, device sync, collection scheduler, retention and anomaly detection on startup"""
+    global switchbot_client, collection_scheduler, retention_manager, device_sync, api_budget, api_breaker
+    global detection_engine
+    live_hub.start()
+    if os.getenv("CONVERT_INCREMENTAL_VACUUM", "false").lower() in ("1", "true", "yes"):
+        # A full VACUUM blocks every write, so finish it before collection and retention start
+        print("Converting database to auto_vacuum=INCREMENTAL (full VACUUM)...")
+        if await database.write(storage.enable_incremental_vacuum):
+            print("Converted database to auto_vacuum=INCREMENTAL")
+    detection_engine = init_detection_engine()
+    if detection_engine:
+        detection_engine.start()
+        print(f"Anomaly detection started ({os.getenv('ANOMALY_RULES')})")
+    retention_manager = init_retention_manager()
+    if retention_manager:
+        retention_manager.start()
+        print(f"Retention manager started (every {retention_manager.interval}s)")
     switchbot_client = init_switchbot_client()
     if not switchbot_client:
         print("Warning: SwitchBot credentials not configured")
+        return
+    
+    api_budget, api_breaker = init_api_limits(switchbot_client)
+    switchbot_client.add_response_listener(observe_api_request)
+    device_sync = init_device_sync()
+    if device_sync:
+        device_sync.start()
+        print(f"Device sync started (every {device_sync.interval}s)")
+    
+    collection_scheduler = init_collection_scheduler()
+    if collection_scheduler:
+        collection_scheduler.start()
+        print(f"Collection scheduler started (every {collection_scheduler.interval}s)")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background tasks and close pooled HTTP and database connections on shutdown"""
+    if collection_scheduler:
+        await collection_scheduler.stop()
+    if retention_manager:
+        await retention_manager.stop()
+    if device_sync:
+        await device_sync.stop()
+    if detection_engine:
+        await detection_engine.stop()
+    if switchbot_client:
+        await switchbot_client.aclose()
+    if api_budget:
+        api_budget.save()
+    database.close()
+    storage.close()
 
 @app.get("/")
 async def root():
@@ -51,86 +307,431 @@ async def root():
         "message": "SwitchBot Power Monitor API",
         "version": "1.0.0",
         "endpoints": [
+            "/power/history - Get power history for several devices (columnar)",
             "/power/history/{device_id} - Get power history from database",
             "/power/latest/{device_id} - Get latest stored reading",
             "/power/db/latest - Get current readings from database",
+            "/power/stream - Live readings as Server-Sent Events",
+            "/power/energy - Get daily or monthly energy (kWh) totals",
             "/database/stats - Get database statistics",
+            "/database/partitions - List raw-reading partitions and archives",
+            "/collector/status - Get built-in collection scheduler status",
+            "/switchbot/budget - Get SwitchBot API quota usage and circuit state",
+            "/switchbot/latency - Get SwitchBot API request latency breakdown",
+            "/retention/status - Get background retention status",
+            "/devices - List registered devices and device sync status",
+            "/events - Get anomaly detection events",
+            "/detection/status - Get anomaly detection rules and per-device statistics",
+            "/metrics - Prometheus metrics",
             "/dashboard - Web monitoring interface"
         ]
     }
 
 
 
-@app.get("/power/history/{device_id}")
-async def get_power_history(device_id: str, hours: int = 24, limit: int = 1000):
-    """Get power history for a device"""
-    if hours > 0:
-        readings = storage.get_readings_by_timerange(device_id, hours)
+# Rows per export chunk; Parquet writes one row group per chunk, so use larger ones
+EXPORT_BATCH_SIZE = {"csv": 5000, "parquet": 50000}
+
+# When downsampling, read from the finest source with at most this many times
+# the requested points; the decimation itself is cheap array work.
+DOWNSAMPLE_SOURCE_FACTOR = 10
+
+def validate_format(format: str):
+    """Reject unknown response formats with 400"""
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(FORMATS)}")
+
+def binary_response(segments, meta, headers=None):
+    """Packed typed-array response, see response_formats"""
+    return Response(encode_binary(segments, meta), media_type=BINARY_MEDIA_TYPE, headers=headers)
+
+def parse_device_ids(device_ids: Optional[List[str]]) -> List[str]:
+    """Flatten repeated and comma-separated ``device_ids`` query values"""
+    return [device_id for entry in device_ids or [] for device_id in entry.split(",") if device_id]
+
+def validate_history_params(resolution: Optional[str], downsample: str, points: Optional[int]):
+    """Reject unknown history resolution/downsampling options with 400"""
+    if resolution is not None and resolution != "raw" and resolution not in ROLLUP_RESOLUTIONS:
+        raise HTTPException(status_code=400, detail=f"resolution must be one of: raw, {', '.join(ROLLUP_RESOLUTIONS)}")
+    if downsample != "none" and downsample not in DOWNSAMPLE_METHODS:
+        raise HTTPException(status_code=400, detail=f"downsample must be one of: none, {', '.join(DOWNSAMPLE_METHODS)}")
+    if points is not None and points < 3:
+        raise HTTPException(status_code=400, detail="points must be at least 3")
+
+def downsample_rows(columns, rows, points: int, method: str):
+    """Reduce oldest-first row tuples to at most ``points`` by their power series"""
+    if len(rows) <= points:
+        return rows
+    values = list(zip(*rows))
+    x = np.asarray(values[columns.index("timestamp")], dtype=np.float64)
+    y = np.asarray(values[columns.index("power")], dtype=np.float64)
+    return [rows[i] for i in downsample_points(x, y, points, method)]
+
+def bulk_history_response(ids: List[str], hours: int, points: Optional[int], resolution: Optional[str],
+                          downsample: str, since: Optional[int], format: str, latest: dict, headers: dict):
+    """Query and encode a bulk history response (blocking, run on a reader thread)"""
+    if resolution is None:
+        if since is None and points:
+            max_rows = points if downsample == "none" else points * DOWNSAMPLE_SOURCE_FACTOR
+            resolution = storage.choose_resolution(ids, hours, max_rows)
+        else:
+            resolution = "raw"
+    
+    columns, grouped = storage.get_bulk_history_columns(ids, hours, resolution, since=since)
+    segments = {}
+    devices = {}
+    for device_id, rows in grouped.items():
+        source_rows = len(rows)
+        if since is None and points and downsample != "none":
+            rows = downsample_rows(columns, rows, points, downsample)
+        segments[device_id] = (columns, rows)
+        devices[device_id] = {
+            "total_readings": len(rows),
+            "source_readings": source_rows,
+            "latest_timestamp": latest[device_id]
+        }
+    
+    meta = {
+        "timerange_hours": hours,
+        "resolution": resolution,
+        "downsample": downsample if since is None and points and downsample != "none" else None,
+        "since": since
+    }
+    if format == "binary":
+        return binary_response(segments, {**meta, "devices": devices}, headers)
+    
+    for device_id, (_, rows) in segments.items():
+        # One oldest-first array per column
+        devices[device_id].update(to_columns(columns, rows))
+    return JSONResponse({**meta, "columns": data_columns(columns), "devices": devices}, headers=headers)
+
+@app.get("/power/history")
+async def get_bulk_power_history(request: Request, device_ids: Optional[List[str]] = Query(None),
+                                 hours: int = 24, points: Optional[int] = None,
+                                 resolution: Optional[str] = None, downsample: str = "lttb",
+                                 since: Optional[int] = None, format: str = "columnar"):
+    """Get power history for several devices in one query, as columns keyed by device
+
+    ``device_ids`` may be repeated or comma-separated and defaults to every
+    known device. ``points``, ``resolution``, ``downsample`` and ``since``
+    behave as in /power/history/{device_id}, with one resolution shared by
+    all devices; ``since`` returns 304 only when no device has newer data.
+    ``format=binary`` packs one segment per device (see response_formats).
+    """
+    validate_history_params(resolution, downsample, points)
+    validate_format(format)
+    if format == "json":
+        raise HTTPException(status_code=400, detail="Bulk history is columnar; use format=columnar or binary")
+    if hours <= 0:
+        raise HTTPException(status_code=400, detail="hours must be positive")
+    
+    ids = parse_device_ids(device_ids)
+    if not ids:
+        ids = get_known_device_ids()
+    if not ids:
+        raise HTTPException(status_code=404, detail="No known devices")
+    
+    latest = await database.read(storage.get_latest_timestamps, ids)
+    headers = {
+        "ETag": f'W/"{zlib.crc32(repr((sorted(latest.items()), request.url.query)).encode()):08x}"',
+        "Cache-Control": "no-cache"
+    }
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    if since is not None and all(timestamp is None or timestamp <= since for timestamp in latest.values()):
+        return Response(status_code=304, headers=headers)
+    
+    # Query, downsampling and encoding all run in one reader thread
+    return await database.read(bulk_history_response, ids, hours, points, resolution, downsample, since,
+                               format, latest, headers)
+
+def history_response(device_id: str, hours: int, limit: int, points: Optional[int], resolution: Optional[str],
+                     downsample: str, since: Optional[int], format: str, latest_timestamp: Optional[int],
+                     headers: dict):
+    """Query and encode a single-device history response (blocking, run on a reader thread)"""
+    source_rows = None
+    if hours > 0 and since is not None:
+        # Delta since the client's cursor: few rows, no downsampling
+        resolution = resolution or "raw"
+        columns, rows = storage.get_history_columns(device_id, hours, resolution, since=since)
+    elif hours > 0:
+        if resolution is None:
+            if points:
+                max_rows = points if downsample == "none" else points * DOWNSAMPLE_SOURCE_FACTOR
+                resolution = storage.choose_resolution(device_id, hours, max_rows)
+            else:
+                resolution = "raw"
+        
+        columns, rows = storage.get_history_columns(device_id, hours, resolution)
+        if points and downsample != "none":
+            source_rows = len(rows)
+            rows = downsample_rows(columns, rows, points, downsample)
     else:
-        readings = storage.get_all_readings(device_id, limit)
+        resolution = "raw"
+        columns, rows = storage.get_history_columns(device_id, 0, limit=limit)
     
-    return {
+    meta = {
         "device_id": device_id,
-        "total_readings": len(readings),
+        "total_readings": len(rows),
         "timerange_hours": hours if hours > 0 else "all",
-        "readings": readings
+        "resolution": resolution,
+        "downsample": downsample if source_rows is not None else None,
+        "source_readings": source_rows if source_rows is not None else len(rows),
+        "since": since,
+        "latest_timestamp": latest_timestamp
     }
+    if format == "binary":
+        return binary_response({device_id: (columns, rows)}, meta, headers)
+    if format == "columnar":
+        return JSONResponse({**meta, "columns": data_columns(columns), **to_columns(columns, rows)}, headers=headers)
+    
+    # Rows are plain JSON types already, so skip FastAPI's per-value jsonable_encoder pass
+    return JSONResponse({
+        **meta,
+        # Newest first
+        "readings": [dict(zip(columns, row)) for row in reversed(rows)]
+    }, headers=headers)
 
-@app.post("/power/collect/all")
-async def collect_all_power_data():
-    """Collect and store power data for known devices (optimized - no device list fetching)"""
-    if not switchbot_client:
-        raise HTTPException(status_code=500, detail="SwitchBot client not configured")
+@app.get("/power/history/{device_id}")
+async def get_power_history(device_id: str, request: Request, hours: int = 24, limit: int = 1000,
+                            points: Optional[int] = None, resolution: Optional[str] = None,
+                            downsample: str = "lttb", since: Optional[int] = None, format: str = "json"):
+    """Get power history for a device
+
+    With ``points``, history is read from the finest source (raw or a
+    1m/15m/1h rollup) that fits the budget, then reduced to at most ``points``
+    rows with ``downsample`` (lttb, minmax or none). ``resolution`` forces a
+    source explicitly.
+
+    With ``since`` (the ``latest_timestamp`` of a previous response), only
+    newer raw readings are returned, or for rollups the bucket containing
+    ``since`` plus later ones; 304 is returned when nothing is newer. Every
+    response carries an ETag so unchanged full windows also revalidate to 304.
+
+    ``format=columnar`` returns one oldest-first array per column instead of
+    newest-first reading objects; ``format=binary`` packs the same columns as
+    typed arrays (see response_formats).
+    """
+    validate_history_params(resolution, downsample, points)
+    validate_format(format)
     
-    # Get known device IDs from database instead of API
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT DISTINCT device_id FROM power_readings WHERE device_id != 'all'")
-        known_device_ids = [row[0] for row in cursor.fetchall()]
-        conn.close()
-        
-        if not known_device_ids:
-            # Fallback to environment variable if no devices in DB
-            env_device_id = os.getenv("SWITCHBOT_DEVICE_ID")
-            if env_device_id:
-                known_device_ids = [env_device_id]
-            else:
-                raise HTTPException(status_code=500, detail="No known devices found in database or environment")
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to get known devices: {str(e)}")
+    latest_timestamp = await database.read(storage.get_latest_timestamp, device_id)
+    headers = {
+        "ETag": f'W/"{device_id}-{latest_timestamp}-{zlib.crc32(request.url.query.encode()):08x}"',
+        "Cache-Control": "no-cache"
+    }
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    if since is not None and (latest_timestamp is None or latest_timestamp <= since):
+        return Response(status_code=304, headers=headers)
     
+    # Query, downsampling and encoding all run in one reader thread
+    return await database.read(history_response, device_id, hours, limit, points, resolution, downsample, since,
+                               format, latest_timestamp, headers)
+
+def get_known_device_ids():
+    """Get enabled device IDs from the device registry, falling back to SWITCHBOT_DEVICE_ID"""
+    known_device_ids = storage.get_device_ids(enabled_only=True)
+    
+    if not known_device_ids and not storage.get_devices():
+        env_device_id = os.getenv("SWITCHBOT_DEVICE_ID")
+        if env_device_id:
+            known_device_ids = [env_device_id]
+    
+    return known_device_ids
+
+def get_device_name(device_id: str) -> str:
+    """Registered device name, or a generic one with the last 4 ID characters"""
+    device = storage.get_device(device_id)
+    if device and device["name"]:
+        return device["name"]
+    return f"SwitchBot Plug Mini ({device_id[-4:]})"
+
+async def collect_devices(device_ids):
+    """Fetch and store power data for the given devices, returning per-device results"""
     results = {}
-    success_count = 0
+    started = time.perf_counter()
     
-    # Collect power data for each known device (no device list API call needed)
-    for device_id in known_device_ids:
-        power_data = switchbot_client.get_plug_power_data(device_id)
+    # Collect power data for all devices concurrently (no device list API call needed)
+    collected = await switchbot_client.get_many_power_data(device_ids)
+    
+    # Save the whole cycle in one transaction (or one write-buffer hand-off)
+    success = await database.write(storage.save_many_power_data, [data for data in collected.values() if data])
+    
+    for device_id in device_ids:
+        power_data = collected[device_id]
         if power_data:
-            success = storage.save_power_data(power_data)
-            device_name = f"SwitchBot Plug Mini ({device_id[-4:]})"
             results[device_id] = {
-                "name": device_name,
+                "name": get_device_name(device_id),
                 "success": success,
                 "data": power_data if success else None
             }
-            if success:
-                success_count += 1
         else:
             results[device_id] = {
-                "name": f"SwitchBot Plug Mini ({device_id[-4:]})",
+                "name": get_device_name(device_id),
                 "success": False,
                 "error": "Failed to get power data"
             }
+        collection_results.inc(device_id=device_id, result="success" if results[device_id]["success"] else "failure")
+    collection_cycle_seconds.observe(time.perf_counter() - started)
+    
+    return results
+
+@app.post("/power/collect/all")
+async def collect_all_power_data():
+    """Collect and store power data for known devices (optimized - no device list fetching)"""
+    if not switchbot_client:
+        raise HTTPException(status_code=500, detail="SwitchBot client not configured")
+    
+    # Get enabled device IDs from the in-memory registry instead of the API
+    try:
+        known_device_ids = get_known_device_ids()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get known devices: {str(e)}")
+    
+    if not known_device_ids:
+        raise HTTPException(status_code=500, detail="No enabled devices in the registry or environment")
+    
+    if api_breaker and not api_breaker.allows():
+        raise HTTPException(status_code=503, detail=f"SwitchBot API circuit open: {api_breaker.last_trip_reason}")
+    
+    results = await collect_devices(known_device_ids)
+    success_count = sum(1 for result in results.values() if result["success"])
     
     return {
         "message": f"Collected data for {success_count}/{len(known_device_ids)} devices",
         "results": results
     }
 
+@app.get("/collector/status")
+async def get_collector_status():
+    """Get in-process collection scheduler status"""
+    if not collection_scheduler:
+        return {"enabled": False}
+    
+    return {"enabled": True, **collection_scheduler.status()}
+
 
 
+@app.get("/switchbot/budget")
+async def get_switchbot_budget():
+    """Get today's SwitchBot API request count against the daily quota and the circuit breaker state"""
+    if not api_budget:
+        return {"enabled": False}
+    
+    return {"enabled": True, "budget": api_budget.status(), "circuit": api_breaker.status()}
+
+@app.get("/switchbot/latency")
+async def get_switchbot_latency():
+    """Get per-phase latency (queue/connect/TLS/send/wait/receive) of recent SwitchBot API requests"""
+    if not switchbot_client:
+        return {"enabled": False}
+    
+    return {"enabled": True, **switchbot_client.latency.summary()}
+
+@app.get("/retention/status")
+async def get_retention_status():
+    """Get background retention policy status"""
+    if not retention_manager:
+        return {"enabled": False, "auto_vacuum": await database.read(storage.get_auto_vacuum)}
+    
+    return {"enabled": True, **retention_manager.status()}
+
+@app.get("/events")
+async def get_events(device_id: Optional[str] = None, hours: int = 24, rule: Optional[str] = None,
+                     limit: int = Query(100, ge=1, le=10000)):
+    """Get anomaly detection events, newest first"""
+    since = int(datetime.now().timestamp()) - hours * 3600
+    events = await database.read(storage.get_events, device_id, since, rule, limit)
+    return {
+        "events": events,
+        "count": len(events),
+        "hours": hours,
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/detection/status")
+async def get_detection_status():
+    """Get anomaly detection rules, event counters and each device's running statistics"""
+    if not detection_engine:
+        return {"enabled": False}
+    
+    return {"enabled": True, **detection_engine.status()}
+
+@app.get("/devices")
+async def get_devices():
+    """List registered devices (from memory) and device-list sync status"""
+    return {
+        "devices": storage.get_devices(),
+        "sync": {"enabled": True, **device_sync.status()} if device_sync else {"enabled": False}
+    }
+
+@app.post("/devices/sync")
+async def sync_devices():
+    """Sync the device registry from the SwitchBot device list now"""
+    if not switchbot_client:
+        raise HTTPException(status_code=500, detail="SwitchBot client not configured")
+    
+    result = await (device_sync or DeviceSync(switchbot_client, storage, database)).sync_once()
+    if result is None:
+        raise HTTPException(status_code=502, detail="Failed to get device list from SwitchBot API")
+    
+    return {**result, "devices": storage.get_devices()}
+
+@app.post("/devices/{device_id}/enable")
+async def enable_device(device_id: str):
+    """Resume collecting a registered device"""
+    if not await database.write(storage.set_device_enabled, device_id, True):
+        raise HTTPException(status_code=404, detail="Device not registered")
+    
+    return storage.get_device(device_id)
+
+@app.post("/devices/{device_id}/disable")
+async def disable_device(device_id: str):
+    """Stop collecting a registered device (its data is kept)"""
+    if not await database.write(storage.set_device_enabled, device_id, False):
+        raise HTTPException(status_code=404, detail="Device not registered")
+    
+    return storage.get_device(device_id)
+
+@app.get("/power/stream")
+async def stream_readings(request: Request, device_ids: Optional[List[str]] = Query(None),
+                          replay: Optional[int] = None):
+    """Push newly saved readings as Server-Sent Events
+
+    Each ``reading`` event carries one reading as JSON, with the hub sequence
+    number as its event ID. On connect the last ``replay`` readings (default:
+    all the hub keeps, ``LIVE_REPLAY_SIZE``) are sent first; a reconnecting
+    EventSource resumes after its ``Last-Event-ID`` instead. ``device_ids``
+    (repeated or comma-separated) filters the stream. Viewers are served from
+    memory, so they add no database queries.
+    """
+    ids = set(parse_device_ids(device_ids))
+    last_event_id = request.headers.get("last-event-id", "")
+    queue = live_hub.subscribe(int(last_event_id) if last_event_id.isdigit() else None, replay)
+    
+    async def events():
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=LIVE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                if not ids or event[1]["device_id"] in ids:
+                    yield format_event(event)
+        finally:
+            live_hub.unsubscribe(queue)
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        # Keep reverse proxies from buffering the stream
+        "X-Accel-Buffering": "no"
+    })
+
 @app.get("/power/latest/{device_id}")
 async def get_latest_reading(device_id: str):
     """Get the latest stored reading for a device"""
@@ -140,6 +741,55 @@ async def get_latest_reading(device_id: str):
     
     return latest
 
+@app.get("/power/energy")
+async def get_power_energy(device_ids: Optional[List[str]] = Query(None), period: str = "day",
+                           start: Optional[str] = None, end: Optional[str] = None,
+                           price_per_kwh: Optional[float] = None):
+    """Get precomputed energy totals per device and day or month
+
+    ``start``/``end`` are inclusive YYYY-MM-DD (day) or YYYY-MM (month) keys
+    and default to the last 30 days or 12 months. ``price_per_kwh`` (default
+    ENERGY_PRICE_PER_KWH) adds a cost to every entry. ``gap_hours`` is time
+    without usable readings, which is not counted in ``kwh``.
+    """
+    if period not in ENERGY_PERIODS:
+        raise HTTPException(status_code=400, detail=f"period must be one of: {', '.join(ENERGY_PERIODS)}")
+    if price_per_kwh is None and os.getenv("ENERGY_PRICE_PER_KWH"):
+        price_per_kwh = float(os.getenv("ENERGY_PRICE_PER_KWH"))
+    default_start, default_end = energy_range(period)
+    start, end = start or default_start, end or default_end
+    
+    ids = parse_device_ids(device_ids) or get_known_device_ids()
+    devices = {}
+    energy = await database.read(storage.get_energy, ids, period, start, end)
+    for device_id, entries in energy.items():
+        rows = []
+        for entry in entries:
+            row = {
+                period: entry[period],
+                "kwh": round(entry["energy_wh"] / 1000, 4),
+                "covered_hours": round(entry["covered_seconds"] / 3600, 2),
+                "gap_hours": round(entry["gap_seconds"] / 3600, 2),
+                "samples": entry["samples"]
+            }
+            if price_per_kwh is not None:
+                row["cost"] = round(row["kwh"] * price_per_kwh, 2)
+            rows.append(row)
+        total_kwh = round(sum(entry["energy_wh"] for entry in entries) / 1000, 4)
+        devices[device_id] = {
+            "total_kwh": total_kwh,
+            "total_cost": round(total_kwh * price_per_kwh, 2) if price_per_kwh is not None else None,
+            period + "s": rows
+        }
+    
+    return {
+        "period": period,
+        "start": start,
+        "end": end,
+        "price_per_kwh": price_per_kwh,
+        "devices": devices
+    }
+
 @app.get("/dashboard", response_class=HTMLResponse)
 async def dashboard(request: Request):
     """Dashboard UI for power monitoring"""
@@ -148,40 +798,43 @@ async def dashboard(request: Request):
 
 
 @app.get("/power/db/latest")
-async def get_db_latest_readings():
-    """Get latest stored readings from database only (no API calls)"""
+async def get_db_latest_readings(format: str = "json"):
+    """Get latest stored readings from the in-memory cache (no API or database calls)
+
+    ``format=columnar`` returns ``device_ids``/``names`` plus one array per
+    column; ``format=binary`` packs the columns as a single segment with the
+    device IDs and names in the header meta.
+    """
+    validate_format(format)
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Get latest reading for each device
-        cursor.execute("""
-            SELECT device_id, MAX(timestamp) as latest_timestamp
-            FROM power_readings 
-            WHERE device_id != 'all'
-            GROUP BY device_id
-        """)
-        
         results = {}
-        for row in cursor.fetchall():
-            device_id = row['device_id']
-            latest = storage.get_latest_reading(device_id)
-            if latest:
+        for device_id, latest in sorted(storage.get_latest_readings().items()):
+            if device_id != 'all':
                 results[device_id] = {
-                    "name": f"SwitchBot Plug Mini ({device_id[-4:]})",  # Show last 4 chars for identification
+                    "name": get_device_name(device_id),
                     "data": latest
                 }
         
-        conn.close()
-        return results
+        if format == "json":
+            return results
+        
+        columns = [column for column in READING_FIELDS if column != "device_id"]
+        rows = [tuple(device["data"][column] for column in columns) for device in results.values()]
+        meta = {
+            "device_ids": list(results),
+            "names": [device["name"] for device in results.values()]
+        }
+        if format == "binary":
+            return binary_response({"latest": (columns, rows)}, meta)
+        return JSONResponse({**meta, "columns": data_columns(columns), **to_columns(columns, rows)})
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
 
 @app.get("/database/stats")
-async def get_database_stats():
-    """Get database statistics"""
+async def get_database_stats(exact: bool = False):
+    """Get database statistics (``exact`` recounts every reading and corrects the counters)"""
     try:
         import os
         
@@ -189,47 +842,29 @@ async def get_database_stats():
         if not os.path.exists(db_path):
             raise HTTPException(status_code=404, detail="Database file not found")
         
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
         # Get file size
         file_size = os.path.getsize(db_path)
         
-        # Get total records count (exclude 'all' device)
-        cursor.execute("SELECT COUNT(*) as total FROM power_readings WHERE device_id != 'all'")
-        total_records = cursor.fetchone()[0]
-        
-        # Get records count by device (exclude 'all' device)
-        cursor.execute("""
-            SELECT device_id, COUNT(*) as count, 
-                   MIN(timestamp) as first_record, 
-                   MAX(timestamp) as last_record
-            FROM power_readings 
-            WHERE device_id != 'all'
-            GROUP BY device_id 
-            ORDER BY device_id
-        """)
+        # Get records count by device and recent activity (last 24 hours, exclude 'all' device)
         device_stats = []
-        for row in cursor.fetchall():
+        recent_activity = {}
+        corrections = await database.write(storage.rebuild_reading_stats) if exact else None
+        reading_stats = await database.read(
+            storage.get_device_reading_stats, int(datetime.now().timestamp()) - 86400, exact=exact
+        )
+        for stats in reading_stats:
             device_stats.append({
-                "device_id": row[0],
-                "record_count": row[1],
-                "first_record": row[2],
-                "last_record": row[3],
-                "first_record_date": datetime.fromtimestamp(row[2]).isoformat() if row[2] else None,
-                "last_record_date": datetime.fromtimestamp(row[3]).isoformat() if row[3] else None
+                "device_id": stats["device_id"],
+                "name": get_device_name(stats["device_id"]),
+                "record_count": stats["record_count"],
+                "first_record": stats["first_record"],
+                "last_record": stats["last_record"],
+                "first_record_date": datetime.fromtimestamp(stats["first_record"]).isoformat() if stats["first_record"] else None,
+                "last_record_date": datetime.fromtimestamp(stats["last_record"]).isoformat() if stats["last_record"] else None
             })
-        
-        # Get recent activity (last 24 hours, exclude 'all' device)
-        cursor.execute("""
-            SELECT device_id, COUNT(*) as count 
-            FROM power_readings 
-            WHERE timestamp >= ? AND device_id != 'all'
-            GROUP BY device_id
-        """, (int(datetime.now().timestamp()) - 86400,))
-        recent_activity = {row[0]: row[1] for row in cursor.fetchall()}
-        
-        conn.close()
+            if stats["recent_count"]:
+                recent_activity[stats["device_id"]] = stats["recent_count"]
+        total_records = sum(stats["record_count"] for stats in device_stats)
         
         # Format file size with appropriate units
         def format_file_size(size_bytes):
@@ -248,6 +883,12 @@ async def get_database_stats():
             "file_size_formatted": format_file_size(file_size),
             "file_size_mb": round(file_size / 1024 / 1024, 2),
             "total_records": total_records,
+            "exact": exact,
+            "corrections": corrections,
+            "schema_version": await database.read(storage.get_schema_version),
+            "write_buffer": storage.write_buffer.metrics() if storage.write_buffer else None,
+            "history_cache": storage.history_cache.metrics(),
+            "db_threads": database.metrics(),
             "device_statistics": device_stats,
             "recent_activity_24h": recent_activity,
             "timestamp": datetime.now().isoformat()
@@ -256,150 +897,90 @@ async def get_database_stats():
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
+def export_chunks(device_id: Optional[str], hours: int, format: str, compress: bool):
+    """Encoded export chunks, or nothing at all when the range has no readings"""
+    batches = storage.iter_readings(device_id, hours, batch_size=EXPORT_BATCH_SIZE[format])
+    first = next(batches, None)
+    if first is None:
+        return
+    batches = chain([first], batches)
+    chunks = parquet_chunks(batches) if format == "parquet" else csv_chunks(batches)
+    yield from gzip_chunks(chunks) if compress else chunks
+
+async def prepend_chunk(first: bytes, chunks):
+    """Yield ``first`` and then the rest of an async chunk stream, closing it when done"""
+    try:
+        yield first
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        await chunks.aclose()
+
+async def export_response(device_id: Optional[str], hours: int, format: str, compress: bool,
+                          name: str, not_found: str):
+    """Stream an export of raw readings in constant memory
+
+    The query and encoding run in one export thread, so a large export
+    never blocks the event loop or a reader thread.
+    """
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    if format == "parquet" and not parquet_available():
+        raise HTTPException(status_code=501, detail="Parquet export requires pyarrow (install the 'parquet' extra)")
+    
+    chunks = database.iterate(export_chunks(device_id, hours, format, compress))
+    # Wait for the first chunk up front so an empty range is still a 404, not an empty file
+    first = await anext(chunks, None)
+    if first is None:
+        await chunks.aclose()
+        raise HTTPException(status_code=404, detail=not_found)
+    
+    if format == "parquet":
+        media_type, extension = "application/vnd.apache.parquet", "parquet"
+    else:
+        media_type, extension = "text/csv", "csv"
+    if compress:
+        media_type, extension = "application/gzip", extension + ".gz"
+    
+    # Create filename
+    timerange_str = f"{hours}h" if hours > 0 else "all"
+    filename = f"switchbot_data_{name}_{timerange_str}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    
+    return StreamingResponse(
+        prepend_chunk(first, chunks),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 @app.post("/database/export/all")
-async def export_all_data(hours: int = 24):
-    """Export all device data as CSV"""
+async def export_all_data(hours: int = 24, format: str = "csv", compress: bool = False):
+    """Export all device data as CSV or Parquet, optionally gzip-compressed"""
     try:
-        from fastapi.responses import StreamingResponse
-        import csv
-        import io
-        
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        if hours > 0:
-            hours_ago = int(datetime.now().timestamp()) - (hours * 3600)
-            cursor.execute("""
-                SELECT * FROM power_readings 
-                WHERE timestamp >= ? AND device_id != ?
-                ORDER BY timestamp DESC
-            """, (hours_ago, 'all'))
-        else:
-            cursor.execute("SELECT * FROM power_readings WHERE device_id != ? ORDER BY timestamp DESC", ('all',))
-        
-        readings = cursor.fetchall()
-        conn.close()
-        
-        if not readings:
-            raise HTTPException(status_code=404, detail="No data found for ALL DEVICES in the specified time range")
-        
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Write header
-        writer.writerow(['timestamp', 'datetime', 'device_id', 'voltage', 'electric_current', 'power', 'electricity_of_day', 'power_on'])
-        
-        # Write data
-        for reading in readings:
-            dt_str = datetime.fromtimestamp(reading['timestamp']).isoformat()
-            writer.writerow([
-                reading['timestamp'],
-                dt_str,
-                reading['device_id'],
-                reading['voltage'],
-                reading['electric_current'],
-                reading['power'],
-                reading['electricity_of_day'],
-                reading['power_on']
-            ])
-        
-        output.seek(0)
-        
-        # Create filename
-        timerange_str = f"{hours}h" if hours > 0 else "all"
-        filename = f"switchbot_data_all_devices_{timerange_str}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        
-        return StreamingResponse(
-            io.BytesIO(output.getvalue().encode('utf-8')),
-            media_type="text/csv",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
-        )
-        
+        return await export_response(None, hours, format, compress, "all_devices",
+                               "No data found for ALL DEVICES in the specified time range")
     except HTTPException as he:
         raise he
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"All devices export error: {str(e)}")
 
 @app.post("/database/export/{device_id}")
-async def export_device_data(device_id: str, hours: int = 24):
-    """Export device data as CSV"""
+async def export_device_data(device_id: str, hours: int = 24, format: str = "csv", compress: bool = False):
+    """Export device data as CSV or Parquet, optionally gzip-compressed"""
     try:
-        from fastapi.responses import StreamingResponse
-        import csv
-        import io
-        
-        readings = storage.get_readings_by_timerange(device_id, hours) if hours > 0 else storage.get_all_readings(device_id)
-        
-        if not readings:
-            raise HTTPException(status_code=404, detail="No data found for this device")
-        
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Write header
-        writer.writerow(['timestamp', 'datetime', 'device_id', 'voltage', 'electric_current', 'power', 'electricity_of_day', 'power_on'])
-        
-        # Write data
-        for reading in readings:
-            dt_str = datetime.fromtimestamp(reading['timestamp']).isoformat()
-            writer.writerow([
-                reading['timestamp'],
-                dt_str,
-                reading['device_id'],
-                reading['voltage'],
-                reading['electric_current'],
-                reading['power'],
-                reading['electricity_of_day'],
-                reading['power_on']
-            ])
-        
-        output.seek(0)
-        
-        # Create filename
-        timerange_str = f"{hours}h" if hours > 0 else "all"
-        filename = f"switchbot_data_{device_id}_{timerange_str}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        
-        return StreamingResponse(
-            io.BytesIO(output.getvalue().encode('utf-8')),
-            media_type="text/csv",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
-        )
-        
+        return await export_response(device_id, hours, format, compress, device_id, "No data found for this device")
+    except HTTPException as he:
+        raise he
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Export error: {str(e)}")
 
-@app.delete("/database/delete/{device_id}")
-async def delete_device_data(device_id: str, confirm: bool = False):
-    """Delete all data for a specific device"""
-    if not confirm:
-        raise HTTPException(status_code=400, detail="Confirmation required. Add ?confirm=true to delete data.")
-    
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Get count before deletion
-        cursor.execute("SELECT COUNT(*) FROM power_readings WHERE device_id = ?", (device_id,))
-        count_before = cursor.fetchone()[0]
-        
-        if count_before == 0:
-            raise HTTPException(status_code=404, detail="No data found for this device")
-        
-        # Delete data
-        cursor.execute("DELETE FROM power_readings WHERE device_id = ?", (device_id,))
-        conn.commit()
-        conn.close()
-        
-        return {
-            "message": f"Deleted {count_before} records for device {device_id}",
-            "device_id": device_id,
-            "deleted_records": count_before,
-            "timestamp": datetime.now().isoformat()
-        }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Deletion error: {str(e)}")
+def delete_old_records(cutoff_timestamp: int) -> int:
+    """Delete raw readings older than the cutoff and resync the caches"""
+    deleted = storage.delete_readings_before(cutoff_timestamp)
+    if deleted:
+        storage.invalidate_caches()
+    return deleted
 
+# Registered before /database/delete/{device_id}, which would otherwise match "old"
 @app.delete("/database/delete/old")
 async def delete_old_data(minutes: int = 1440, confirm: bool = False):
     """Delete data older than specified minutes (default: 1440 minutes = 24 hours)"""
@@ -410,15 +991,11 @@ async def delete_old_data(minutes: int = 1440, confirm: bool = False):
         raise HTTPException(status_code=400, detail="Minutes must be at least 1")
     
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
         # Calculate cutoff timestamp
         cutoff_timestamp = int(datetime.now().timestamp()) - (minutes * 60)
         
-        # Get count before deletion
-        cursor.execute("SELECT COUNT(*) FROM power_readings WHERE timestamp < ?", (cutoff_timestamp,))
-        count_before = cursor.fetchone()[0]
+        # Delete old data (drops whole partitions when the database is partitioned)
+        count_before = await database.write(delete_old_records, cutoff_timestamp)
         
         if count_before == 0:
             return {
@@ -427,11 +1004,6 @@ async def delete_old_data(minutes: int = 1440, confirm: bool = False):
                 "timestamp": datetime.now().isoformat()
             }
         
-        # Delete old data
-        cursor.execute("DELETE FROM power_readings WHERE timestamp < ?", (cutoff_timestamp,))
-        conn.commit()
-        conn.close()
-        
         return {
             "message": f"Deleted {count_before} records older than {minutes} minutes",
             "deleted_records": count_before,
@@ -439,16 +1011,108 @@ async def delete_old_data(minutes: int = 1440, confirm: bool = False):
             "timestamp": datetime.now().isoformat()
         }
         
+    except HTTPException as he:
+        raise he
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Old data deletion error: {str(e)}")
 
+def delete_device_records(device_id: str):
+    """Delete a device's readings, rollups, events and registry entry"""
+    storage.delete_device_readings(device_id)
+    storage.delete_device_rollups(device_id)
+    storage.delete_device_events(device_id)
+    storage.delete_device(device_id)
+    storage.invalidate_caches(device_id)
+    if detection_engine:
+        detection_engine.forget(device_id)
+
+@app.delete("/database/delete/{device_id}")
+async def delete_device_data(device_id: str, confirm: bool = False):
+    """Delete all data for a specific device"""
+    if not confirm:
+        raise HTTPException(status_code=400, detail="Confirmation required. Add ?confirm=true to delete data.")
+    
+    try:
+        # Get count before deletion
+        count_before = await database.read(storage.count_readings, device_id, 0)
+        
+        if count_before == 0:
+            raise HTTPException(status_code=404, detail="No data found for this device")
+        
+        # Delete data
+        await database.write(delete_device_records, device_id)
+        
+        return {
+            "message": f"Deleted {count_before} records for device {device_id}",
+            "device_id": device_id,
+            "deleted_records": count_before,
+            "timestamp": datetime.now().isoformat()
+        }
+        
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Deletion error: {str(e)}")
+
+def count_partitions() -> List[dict]:
+    """Row count of every raw-reading partition"""
+    conn = get_db_connection()
+    partitions = []
+    for key in storage.get_partitions():
+        count = conn.execute(f"SELECT COUNT(*) FROM {PARTITION_PREFIX}{key}").fetchone()[0]
+        partitions.append({"key": key, "table": PARTITION_PREFIX + key, "records": count})
+    return partitions
+
+@app.get("/database/partitions")
+async def get_partitions():
+    """List raw-reading partitions and archives"""
+    if not storage.partition:
+        return {"partition": None, "partitions": [], "archives": []}
+    
+    partitions = await database.read(count_partitions)
+    archives = [
+        {"key": key, "path": path, "file_size": os.path.getsize(path)}
+        for key, path in storage.get_archives()
+    ]
+    return {"partition": storage.partition, "partitions": partitions, "archives": archives}
+
+def archive_old_partitions(cutoff_timestamp: int) -> List[str]:
+    """Archive partitions older than the cutoff and resync the caches"""
+    paths = storage.archive_partitions(cutoff_timestamp)
+    storage.invalidate_caches()
+    return paths
+
+@app.post("/database/partitions/archive")
+async def archive_partitions(days: int = 90, confirm: bool = False):
+    """Compact partitions entirely older than ``days`` into read-only Parquet archives"""
+    if not confirm:
+        raise HTTPException(status_code=400, detail="Confirmation required. Add ?confirm=true to archive data.")
+    if not storage.partition:
+        raise HTTPException(status_code=400, detail="Database is not partitioned (set POWER_DB_PARTITION)")
+    if not parquet_available():
+        raise HTTPException(status_code=501, detail="Archiving requires pyarrow (install the 'parquet' extra)")
+    
+    cutoff_timestamp = int(datetime.now().timestamp()) - days * 86400
+    paths = await database.write(archive_old_partitions, cutoff_timestamp)
+    return {
+        "message": f"Archived {len(paths)} partitions older than {days} days",
+        "archives": paths,
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics: API, database and route latency histograms, collection counters, database size"""
+    return Response(metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
-        "switchbot_configured": switchbot_client is not None
+        "switchbot_configured": switchbot_client is not None,
+        "live_stream": live_hub.metrics()
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,277 @@
+"""SwitchBot API request budget, circuit breaker and adaptive poll intervals
+
+The cloud API allows a fixed number of requests per day. ApiBudget counts
+every request sent and paces collection with a token bucket whose refill
+rate is the rest of the day's budget spread evenly over the rest of the
+day, so a busy morning slows the afternoon instead of exhausting the quota
+by evening. A ``reserve`` share is kept back for manual collection and
+device-list syncs. CircuitBreaker stops all requests after HTTP 429 or a
+run of server/transport errors and lets one probe through after a cooldown.
+AdaptiveInterval polls plugs whose power is changing at the base interval
+and stretches the interval of idle ones.
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+
+class ApiBudget:
+    """Daily request quota, counted per local day and paced with a token bucket
+
+    ``record`` counts requests actually sent (every caller, through the
+    client's response listener); ``acquire`` decides how many collection
+    requests may go now. The day's count is kept in ``state_path`` (written at
+    most every ``save_interval`` seconds), so a restart does not reset it.
+    """
+
+    def __init__(self,
+                 daily_quota: int = 10000,
+                 reserve: float = 0.05,
+                 burst: int = 20,
+                 day_seconds: int = 86400,
+                 state_path: Optional[str] = None,
+                 save_interval: float = 300.0,
+                 clock: Callable[[], float] = time.time):
+        self.daily_quota = daily_quota
+        self.reserve = reserve
+        self.burst = burst
+        self.day_seconds = day_seconds
+        self.state_path = state_path
+        self.save_interval = save_interval
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        now = clock()
+        self.day_start = self._day_start(now)
+        self.used = 0
+        self.throttled = 0
+        self._tokens = float(burst)
+        self._refilled_at = now
+        self._saved_at = now
+        self._load()
+
+    def _day_start(self, now: float) -> float:
+        # Local midnight, or a multiple of day_seconds since it for shortened test days
+        offset = time.localtime(now).tm_gmtoff
+        return (now + offset) // self.day_seconds * self.day_seconds - offset
+
+    def _load(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+            if state.get("day_start") == self.day_start:
+                self.used = int(state.get("used", 0))
+        except (OSError, ValueError) as e:
+            print(f"Error reading API budget state: {e}")
+
+    def save(self):
+        """Write the day's request count to ``state_path``"""
+        if not self.state_path:
+            return
+        with self._lock:
+            state = {"day_start": self.day_start, "used": self.used}
+            self._saved_at = self.clock()
+        try:
+            with open(self.state_path, "w") as f:
+                json.dump(state, f)
+        except OSError as e:
+            print(f"Error saving API budget state: {e}")
+
+    def _roll(self, now: float):
+        if now >= self.day_start + self.day_seconds:
+            self.day_start = self._day_start(now)
+            self.used = 0
+
+    def record(self, count: int = 1):
+        """Count requests sent to the API"""
+        with self._lock:
+            now = self.clock()
+            self._roll(now)
+            self.used += count
+            due = now - self._saved_at >= self.save_interval
+        if due:
+            self.save()
+
+    def _rate(self, now: float) -> float:
+        remaining = self.daily_quota * (1 - self.reserve) - self.used
+        return max(0.0, remaining) / max(1.0, self.day_start + self.day_seconds - now)
+
+    def rate(self) -> float:
+        """Collection requests per second the rest of today's budget allows"""
+        with self._lock:
+            now = self.clock()
+            self._roll(now)
+            return self._rate(now)
+
+    def acquire(self, wanted: int) -> int:
+        """Take up to ``wanted`` request tokens and return how many were granted"""
+        with self._lock:
+            now = self.clock()
+            self._roll(now)
+            self._tokens = min(float(self.burst), self._tokens + self._rate(now) * (now - self._refilled_at))
+            self._refilled_at = now
+            granted = min(wanted, int(self._tokens))
+            self._tokens -= granted
+            self.throttled += wanted - granted
+            return granted
+
+    def status(self) -> Dict:
+        """Today's usage and pacing"""
+        with self._lock:
+            now = self.clock()
+            self._roll(now)
+            elapsed = max(1.0, now - self.day_start)
+            return {
+                "daily_quota": self.daily_quota,
+                "reserve": self.reserve,
+                "used_today": self.used,
+                "remaining_today": max(0, self.daily_quota - self.used),
+                "usage_ratio": round(self.used / self.daily_quota, 4) if self.daily_quota else None,
+                "projected_today": round(self.used / elapsed * self.day_seconds),
+                "allowed_per_hour": round(self._rate(now) * 3600, 1),
+                "throttled_requests": self.throttled,
+                "resets_in_seconds": round(self.day_start + self.day_seconds - now),
+            }
+
+
+class CircuitBreaker:
+    """Stops API requests after rate limiting or repeated server errors
+
+    Closed: requests flow. HTTP 429 opens the circuit at once (for the
+    response's Retry-After if given); ``failure_threshold`` consecutive 5xx
+    or transport errors open it too. After the cooldown it is half-open and
+    one probe request may go: success closes it, failure reopens it with
+    the cooldown doubled (up to ``max_cooldown``).
+    """
+
+    def __init__(self,
+                 failure_threshold: int = 5,
+                 cooldown: float = 60.0,
+                 max_cooldown: float = 3600.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._open_until: Optional[float] = None
+        self._next_cooldown = cooldown
+
+        self.trips = 0
+        self.rate_limited = 0
+        self.server_errors = 0
+        self.last_trip_reason: Optional[str] = None
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state(self.clock())
+
+    def _state(self, now: float) -> str:
+        if self._open_until is None:
+            return "closed"
+        return "open" if now < self._open_until else "half_open"
+
+    def allows(self) -> bool:
+        """Whether requests may be sent now (only one probe while half-open)"""
+        return self.state != "open"
+
+    def _trip(self, now: float, reason: str, duration: Optional[float] = None):
+        if duration is None:
+            duration = self._next_cooldown
+        self._open_until = now + duration
+        # Reset to ``cooldown`` only once a request succeeds again
+        self._next_cooldown = min(self.max_cooldown, duration * 2)
+        self._failures = 0
+        self.trips += 1
+        self.last_trip_reason = reason
+        print(f"SwitchBot API circuit opened for {round(duration)}s: {reason}")
+
+    def record(self, status: Optional[int], retry_after: Optional[float] = None):
+        """Record one response status (None for a transport error or timeout)"""
+        with self._lock:
+            now = self.clock()
+            if status == 429:
+                self.rate_limited += 1
+                self._trip(now, "rate limited (429)", retry_after)
+            elif status is None or status >= 500:
+                self.server_errors += 1
+                self._failures += 1
+                if self._state(now) == "half_open" or self._failures >= self.failure_threshold:
+                    self._trip(now, f"{self._failures} consecutive errors" if status is None else f"server error ({status})")
+            else:
+                self._failures = 0
+                self._open_until = None
+                self._next_cooldown = self.cooldown
+
+    def status(self) -> Dict:
+        """Circuit state and counters"""
+        with self._lock:
+            now = self.clock()
+            return {
+                "state": self._state(now),
+                "open_for_seconds": round(self._open_until - now, 1) if self._state(now) == "open" else 0,
+                "consecutive_failures": self._failures,
+                "trips": self.trips,
+                "rate_limited_responses": self.rate_limited,
+                "server_errors": self.server_errors,
+                "last_trip_reason": self.last_trip_reason,
+            }
+
+
+class AdaptiveInterval:
+    """Per-device poll interval from how much each plug's power changes
+
+    A reading that moved more than ``min_change`` watts and ``change_ratio``
+    of the previous one resets the device to the base ``interval``; each
+    unchanged reading stretches it by ``growth``, up to ``max_interval``.
+    """
+
+    def __init__(self,
+                 interval: float = 20.0,
+                 max_interval: float = 300.0,
+                 min_change: float = 2.0,
+                 change_ratio: float = 0.05,
+                 growth: float = 1.5):
+        self.interval = interval
+        self.max_interval = max_interval
+        self.min_change = min_change
+        self.change_ratio = change_ratio
+        self.growth = growth
+        self._power: Dict[str, float] = {}
+        self._intervals: Dict[str, float] = {}
+
+    def update(self, device_id: str, power: Optional[float]) -> float:
+        """Record a device's new power reading and return its next poll interval"""
+        previous = self._power.get(device_id)
+        current = self._intervals.get(device_id, self.interval)
+        if power is None or previous is None:
+            interval = self.interval
+        elif abs(power - previous) > max(self.min_change, self.change_ratio * abs(previous)):
+            interval = self.interval
+        else:
+            interval = min(self.max_interval, current * self.growth)
+        if power is not None:
+            self._power[device_id] = power
+        self._intervals[device_id] = interval
+        return interval
+
+    def get(self, device_id: str) -> float:
+        """Current poll interval of a device"""
+        return self._intervals.get(device_id, self.interval)
+
+    def forget(self, device_id: str):
+        """Drop a device's history, so it restarts at the base interval"""
+        self._power.pop(device_id, None)
+        self._intervals.pop(device_id, None)
+
+    def intervals(self) -> Dict[str, float]:
+        """Current poll interval of every tracked device"""
+        return dict(self._intervals)
@@ -0,0 +1,80 @@
+"""Compact encodings for reading responses
+
+``columnar`` turns row tuples into one JSON array per column, so column names
+are sent once instead of once per row. ``binary`` packs the same columns as
+little-endian typed arrays behind a small JSON header:
+
+    uint32 header_length | header JSON (UTF-8, space-padded to 4 bytes) |
+    for each segment, for each header column: rows x dtype (padded to 4 bytes)
+
+The header lists ``columns`` (name + dtype), ``segments`` (key + row count,
+e.g. one per device) and ``meta``. Timestamps are uint32, power_on uint8 and
+every other value float32 with NaN for missing values.
+"""
+
+import json
+import struct
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+FORMATS = ("json", "columnar", "binary")
+BINARY_MEDIA_TYPE = "application/vnd.switchbot-power.columns"
+
+# Bookkeeping and text columns that are not sent in compact formats
+SKIPPED_COLUMNS = ("id", "device_id", "created_at")
+
+COLUMN_DTYPES = {
+    "timestamp": "uint32",
+    "samples": "uint32",
+    "power_on": "uint8",
+}
+
+
+def data_columns(columns: Sequence[str]) -> List[str]:
+    """Columns that compact formats carry"""
+    return [column for column in columns if column not in SKIPPED_COLUMNS]
+
+
+def to_columns(columns: Sequence[str], rows: Sequence[tuple]) -> Dict[str, list]:
+    """Transpose row tuples into ``{column: [values...]}`` without per-row dicts"""
+    values = list(zip(*rows)) if rows else [() for _ in columns]
+    return {
+        column: list(column_values)
+        for column, column_values in zip(columns, values)
+        if column not in SKIPPED_COLUMNS
+    }
+
+
+def _pack(values: Sequence, dtype: str) -> bytes:
+    if dtype == "float32":
+        array = np.asarray(values, dtype=np.float64).astype("<f4")
+    else:
+        array = np.asarray([0 if value is None else value for value in values], dtype=np.int64).astype(
+            "<u4" if dtype == "uint32" else "u1"
+        )
+    data = array.tobytes()
+    return data + b"\0" * (-len(data) % 4)
+
+
+def encode_binary(segments: Dict[str, Tuple[Sequence[str], Sequence[tuple]]], meta: Dict) -> bytes:
+    """Pack ``{key: (columns, rows)}`` segments that share the same column list"""
+    columns: List[str] = []
+    for segment_columns, _ in segments.values():
+        columns = data_columns(segment_columns)
+        break
+    dtypes = [COLUMN_DTYPES.get(column, "float32") for column in columns]
+    
+    header = json.dumps({
+        "columns": [{"name": column, "dtype": dtype} for column, dtype in zip(columns, dtypes)],
+        "segments": [{"key": key, "rows": len(rows)} for key, (_, rows) in segments.items()],
+        "meta": meta,
+    }).encode("utf-8")
+    header += b" " * (-len(header) % 4)
+    
+    parts = [struct.pack("<I", len(header)), header]
+    for segment_columns, rows in segments.values():
+        column_values = to_columns(segment_columns, rows)
+        for column, dtype in zip(columns, dtypes):
+            parts.append(_pack(column_values[column], dtype))
+    return b"".join(parts)
@@ -0,0 +1,166 @@
+import asyncio
+import re
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+from data_storage import PowerDataStorage, ROLLUP_RESOLUTIONS
+from db_access import AsyncDatabase
+
+RETENTION_SOURCES = ("raw",) + tuple(ROLLUP_RESOLUTIONS)
+
+DURATION_UNITS = {"h": 3600, "d": 86400, "w": 7 * 86400, "y": 365 * 86400}
+
+
+def parse_retention_policy(spec: str) -> Dict[str, Optional[int]]:
+    """Parse "raw=30d,1m=1y,1h=forever" into seconds per source (None = keep forever)
+
+    Sources left out of the spec are kept forever.
+    """
+    policy: Dict[str, Optional[int]] = {}
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        source, _, age = entry.partition("=")
+        source, age = source.strip(), age.strip().lower()
+        if source not in RETENTION_SOURCES:
+            raise ValueError(f"Unknown retention source '{source}' (expected one of: {', '.join(RETENTION_SOURCES)})")
+        if age == "forever":
+            policy[source] = None
+            continue
+        match = re.fullmatch(r"(\d+)([hdwy])", age)
+        if not match:
+            raise ValueError(f"Invalid retention age '{age}' for {source} (e.g. 30d, 12w, 1y or forever)")
+        policy[source] = int(match.group(1)) * DURATION_UNITS[match.group(2)]
+    return policy
+
+
+class RetentionManager:
+    """Background retention of raw readings and rollups
+
+    Runs every ``interval`` seconds. Expired rows are deleted in batches of
+    ``batch_size``, each in its own short transaction on the database's
+    writer thread followed by a ``pause``, so retention is serialized with
+    every other write and the collector's writes are never blocked for long. Freed pages are then returned to the filesystem with incremental
+    vacuum if the database uses auto_vacuum=INCREMENTAL. Converting an
+    existing database takes a full VACUUM that locks out every writer, so it
+    is never done here (see CONVERT_INCREMENTAL_VACUUM in main).
+    """
+
+    def __init__(self,
+                 storage: PowerDataStorage,
+                 database: AsyncDatabase,
+                 policy: Dict[str, Optional[int]],
+                 interval: float = 3600.0,
+                 batch_size: int = 1000,
+                 pause: float = 0.05,
+                 vacuum_pages: int = 1000):
+        self.storage = storage
+        self.database = database
+        self.policy = policy
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.vacuum_pages = vacuum_pages
+        
+        self._task: Optional[asyncio.Task] = None
+        
+        self.runs = 0
+        self.last_run_started: Optional[str] = None
+        self.last_run_duration: Optional[float] = None
+        self.last_deleted: Dict[str, int] = {}
+        self.total_deleted: Dict[str, int] = {source: 0 for source in policy}
+        self.last_vacuumed_pages = 0
+        self.last_error: Optional[str] = None
+        
+        storage.retention = dict(policy)
+    
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+    
+    def start(self):
+        """Start the periodic retention task on the running event loop"""
+        if not self.running:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+    
+    async def stop(self):
+        """Stop the retention task (a batch in progress finishes on the writer thread)"""
+        if self._task and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+    
+    async def _run(self):
+        while True:
+            await self.run_once()
+            await asyncio.sleep(self.interval)
+    
+    async def run_once(self) -> Dict[str, int]:
+        """Apply the policy once and return rows deleted per source"""
+        started = time.monotonic()
+        self.last_run_started = datetime.now().isoformat()
+        deleted = {source: 0 for source in self.policy}
+        try:
+            now = int(time.time())
+            for source, age in self.policy.items():
+                if age is None:
+                    continue
+                while True:
+                    count = await self.database.write(
+                        self.storage.delete_expired_batch, source, now - age, self.batch_size
+                    )
+                    if not count:
+                        break
+                    deleted[source] += count
+                    await asyncio.sleep(self.pause)
+            if deleted.get("raw"):
+                await self.database.write(self.storage.invalidate_caches)
+            
+            # Give freed pages back to the filesystem, a chunk at a time
+            vacuumed = 0
+            free_pages = 0
+            if await self.database.read(self.storage.get_auto_vacuum) == "incremental":
+                free_pages = await self.database.read(self.storage.get_free_pages)
+            while free_pages:
+                remaining = await self.database.write(self.storage.incremental_vacuum, self.vacuum_pages)
+                if remaining >= free_pages:
+                    break
+                vacuumed += free_pages - remaining
+                free_pages = remaining
+                await asyncio.sleep(self.pause)
+            self.last_vacuumed_pages = vacuumed
+            self.last_error = None
+            
+            if any(deleted.values()):
+                summary = ", ".join(f"{source}: {count}" for source, count in deleted.items() if count)
+                print(f"{datetime.now().isoformat()}: Retention deleted {summary} rows")
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"{datetime.now().isoformat()}: Retention run failed: {e}")
+        finally:
+            self.runs += 1
+            self.last_run_duration = round(time.monotonic() - started, 3)
+            self.last_deleted = deleted
+            for source, count in deleted.items():
+                self.total_deleted[source] += count
+        return deleted
+    
+    def status(self) -> Dict:
+        """Retention policy and counters"""
+        return {
+            "running": self.running,
+            "interval_seconds": self.interval,
+            "policy_days": {
+                source: None if age is None else round(age / 86400, 2) for source, age in self.policy.items()
+            },
+            "auto_vacuum": self.storage.get_auto_vacuum(),
+            "runs": self.runs,
+            "last_run_started": self.last_run_started,
+            "last_run_duration_seconds": self.last_run_duration,
+            "last_deleted": self.last_deleted,
+            "total_deleted": self.total_deleted,
+            "last_vacuumed_pages": self.last_vacuumed_pages,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,197 @@
+import asyncio
+import random
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from rate_limit import AdaptiveInterval, ApiBudget, CircuitBreaker
+
+
+class CollectionScheduler:
+    """In-process periodic collection of power data
+
+    Ticks are anchored to the scheduler's start time, so a slow cycle never
+    shifts later ticks. Each tick may be delayed by a random jitter. If the
+    previous cycle is still running when a tick arrives, the tick is skipped
+    instead of piling up a second cycle. Devices that fail are backed off
+    exponentially and left out of cycles until their backoff expires.
+    
+    Optionally, ``adaptive`` gives each device its own poll interval (a
+    multiple of ticks), ``budget`` limits how many requests each cycle may
+    send, deferring the rest to later ticks (most overdue first), and
+    ``breaker`` pauses collection while the API circuit is open.
+    """
+
+    def __init__(self,
+                 collect: Callable[[List[str]], Awaitable[Dict[str, Dict]]],
+                 get_device_ids: Callable[[], List[str]],
+                 interval: float = 20.0,
+                 jitter: float = 0.0,
+                 max_backoff: float = 600.0,
+                 budget: Optional[ApiBudget] = None,
+                 breaker: Optional[CircuitBreaker] = None,
+                 adaptive: Optional[AdaptiveInterval] = None):
+        self.collect = collect
+        self.get_device_ids = get_device_ids
+        self.interval = interval
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.budget = budget
+        self.breaker = breaker
+        self.adaptive = adaptive
+        
+        self._task: Optional[asyncio.Task] = None
+        self._cycle: Optional[asyncio.Task] = None
+        self._failures: Dict[str, int] = {}
+        self._retry_at: Dict[str, float] = {}
+        self._next_poll: Dict[str, float] = {}
+        
+        self.ticks = 0
+        self.skipped_ticks = 0
+        self.cycles = 0
+        self.last_cycle_started: Optional[str] = None
+        self.last_cycle_duration: Optional[float] = None
+        self.last_cycle_message: Optional[str] = None
+        self.deferred = 0
+    
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+    
+    def start(self):
+        """Start ticking on the running event loop"""
+        if not self.running:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+    
+    async def stop(self):
+        """Stop ticking and cancel any cycle in progress"""
+        for task in (self._task, self._cycle):
+            if task and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = None
+        self._cycle = None
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        origin = loop.time()
+        tick = 0
+        while True:
+            if self._cycle is not None and not self._cycle.done():
+                self.skipped_ticks += 1
+            else:
+                self._cycle = loop.create_task(self._run_cycle())
+            self.ticks += 1
+            
+            # Next tick on the fixed grid; ticks that already passed are skipped
+            tick = max(tick + 1, int((loop.time() - origin) // self.interval) + 1)
+            delay = origin + tick * self.interval - loop.time()
+            if self.jitter:
+                delay += random.uniform(0, self.jitter)
+            await asyncio.sleep(max(0.0, delay))
+    
+    def _due_devices(self, device_ids: List[str], now: float) -> List[str]:
+        # Half a tick of slack, so a device due just after this tick is not pushed to the next one
+        horizon = now + self.interval / 2
+        due = [
+            device_id for device_id in device_ids
+            if self._retry_at.get(device_id, 0.0) <= now and self._next_poll.get(device_id, 0.0) <= horizon
+        ]
+        return sorted(due, key=lambda device_id: self._next_poll.get(device_id, 0.0))
+    
+    def _record_result(self, device_id: str, success: bool, now: float):
+        if success:
+            self._failures.pop(device_id, None)
+            self._retry_at.pop(device_id, None)
+            return
+        failures = self._failures.get(device_id, 0) + 1
+        self._failures[device_id] = failures
+        # 1st failure waits one extra interval, then 2, 4, 8... intervals
+        backoff = min(self.interval * 2 ** (failures - 1), self.max_backoff)
+        self._retry_at[device_id] = now + backoff
+    
+    async def _run_cycle(self):
+        started = time.monotonic()
+        self.last_cycle_started = datetime.now().isoformat()
+        try:
+            device_ids = self.get_device_ids()
+            due = self._due_devices(device_ids, started)
+            if not due:
+                self.last_cycle_message = f"No devices due ({len(device_ids)} known)"
+                return
+            
+            if self.breaker is not None:
+                if not self.breaker.allows():
+                    self.last_cycle_message = f"API circuit open, skipped {len(due)} devices"
+                    return
+                if self.breaker.state == "half_open":
+                    # One probe request decides whether the circuit closes
+                    due = due[:1]
+            deferred = 0
+            if self.budget is not None:
+                granted = self.budget.acquire(len(due))
+                deferred = len(due) - granted
+                self.deferred += deferred
+                due = due[:granted]
+                if not due:
+                    self.last_cycle_message = f"API budget exhausted for now, deferred {deferred} devices"
+                    return
+            
+            results = await self.collect(due)
+            now = time.monotonic()
+            # A rate limit or outage is the API's fault, not the devices'
+            api_failure = self.breaker is not None and self.breaker.state != "closed"
+            success_count = 0
+            for device_id in due:
+                result = results.get(device_id, {})
+                success = result.get("success", False)
+                if success or not api_failure:
+                    self._record_result(device_id, success, now)
+                if success:
+                    # Also orders devices deferred by the budget before ones polled since
+                    self._next_poll[device_id] = started + (self.adaptive.update(
+                        device_id, (result.get("data") or {}).get("power")
+                    ) if self.adaptive is not None else self.interval)
+                success_count += success
+            
+            skipped = len(device_ids) - len(due) - deferred
+            self.last_cycle_message = f"Collected data for {success_count}/{len(due)} devices" + (
+                f" ({skipped} not due or backed off)" if skipped else ""
+            ) + (f" ({deferred} deferred by API budget)" if deferred else "")
+            print(f"{datetime.now().isoformat()}: {self.last_cycle_message}")
+        except Exception as e:
+            self.last_cycle_message = f"Collection cycle failed: {e}"
+            print(f"{datetime.now().isoformat()}: {self.last_cycle_message}")
+        finally:
+            self.cycles += 1
+            self.last_cycle_duration = round(time.monotonic() - started, 3)
+    
+    def status(self) -> Dict:
+        """Scheduler counters and per-device backoff state"""
+        now = time.monotonic()
+        return {
+            "running": self.running,
+            "interval_seconds": self.interval,
+            "jitter_seconds": self.jitter,
+            "ticks": self.ticks,
+            "skipped_ticks": self.skipped_ticks,
+            "cycles": self.cycles,
+            "cycle_in_progress": self._cycle is not None and not self._cycle.done(),
+            "last_cycle_started": self.last_cycle_started,
+            "last_cycle_duration_seconds": self.last_cycle_duration,
+            "last_cycle_message": self.last_cycle_message,
+            "deferred_requests": self.deferred,
+            "budget": self.budget.status() if self.budget is not None else None,
+            "circuit": self.breaker.status() if self.breaker is not None else None,
+            "poll_intervals": self.adaptive.intervals() if self.adaptive is not None else None,
+            "backoff": {
+                device_id: {
+                    "consecutive_failures": self._failures[device_id],
+                    "retry_in_seconds": round(max(0.0, retry_at - now), 1)
+                }
+                for device_id, retry_at in self._retry_at.items()
+            }
+        }
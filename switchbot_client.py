@@ -1,32 +1,222 @@
 import hashlib
 import hmac
 import time
-import json
 import base64
+import random
+import threading
 import uuid
-import requests
-from typing import Dict, Optional
+import asyncio
+import httpx
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+DEFAULT_BASE_URL = "https://api.switch-bot.com/v1.1"
+
+# Request phases timed by RequestTrace, in order (connect includes the DNS lookup)
+LATENCY_PHASES = ("queue", "connect", "tls", "send", "wait", "receive", "total")
+
+# Called after every request with (path, HTTP status or None on transport error, Retry-After seconds,
+# seconds the attempt took)
+ResponseListener = Callable[[str, Optional[int], Optional[float], float], None]
+
+
+def _retry_after(headers) -> Optional[float]:
+    """Retry-After header in seconds, if it is given as a number"""
+    try:
+        return float(headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+class RequestTrace:
+    """Timestamps of one request's httpcore trace events, split into phases
+
+    queue is the wait for a concurrency slot or pooled connection; connect
+    (DNS lookup and TCP) and tls are zero on a reused keep-alive connection;
+    wait is the time to the first response byte after the request was sent.
+    """
+    
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.events: Dict[str, float] = {}
+    
+    def record(self, name: str, info: Dict):
+        # "connection.connect_tcp.started" -> "connect_tcp.started"
+        self.events[name.split(".", 1)[-1]] = time.perf_counter()
+    
+    async def arecord(self, name: str, info: Dict):
+        self.record(name, info)
+    
+    def _span(self, start: str, end: str) -> float:
+        if start in self.events and end in self.events:
+            return self.events[end] - self.events[start]
+        return 0.0
+    
+    @property
+    def new_connection(self) -> bool:
+        return "connect_tcp.started" in self.events
+    
+    def phases(self) -> Dict[str, float]:
+        """Seconds spent in each of LATENCY_PHASES"""
+        finished = time.perf_counter()
+        first = min(self.events.values(), default=finished)
+        return {
+            "queue": first - self.started,
+            "connect": self._span("connect_tcp.started", "connect_tcp.complete"),
+            "tls": self._span("start_tls.started", "start_tls.complete"),
+            "send": self._span("send_request_headers.started", "send_request_body.complete"),
+            "wait": self._span("send_request_body.complete", "receive_response_headers.complete"),
+            "receive": self._span("receive_response_headers.complete", "receive_response_body.complete"),
+            "total": finished - self.started,
+        }
+
+
+class LatencyStats:
+    """Phase latencies of the last ``size`` requests, plus request counters"""
+    
+    def __init__(self, size: int = 1000):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=size)
+        self.requests = 0
+        self.failed = 0
+        self.retries = 0
+        self.new_connections = 0
+    
+    def add(self, trace: RequestTrace, failed: bool):
+        """Record a finished request attempt"""
+        phases = trace.phases()
+        with self._lock:
+            self._samples.append(phases)
+            self.requests += 1
+            self.failed += failed
+            self.new_connections += trace.new_connection
+    
+    def record_retry(self):
+        """Count a request attempt that is about to be retried"""
+        with self._lock:
+            self.retries += 1
+    
+    def summary(self) -> Dict:
+        """Counters and p50/p95/max milliseconds per phase over the kept samples"""
+        with self._lock:
+            samples = list(self._samples)
+            counters = {
+                "requests": self.requests,
+                "failed": self.failed,
+                "retries": self.retries,
+                "new_connections": self.new_connections,
+            }
+        phases = {}
+        for phase in LATENCY_PHASES:
+            values = sorted(sample[phase] for sample in samples)
+            if values:
+                phases[phase] = {
+                    "p50_ms": round(values[len(values) // 2] * 1000, 2),
+                    "p95_ms": round(values[min(len(values) - 1, int(len(values) * 0.95))] * 1000, 2),
+                    "max_ms": round(values[-1] * 1000, 2),
+                }
+        return {**counters, "samples": len(samples), "phases": phases}
 
 
 class SwitchBotClient:
-    def __init__(self, token: str, secret: str):
+    """SwitchBot API client over a pooled keep-alive HTTP connection
+
+    Each attempt may take ``connect_timeout`` seconds to connect and
+    ``timeout`` seconds per read. Transport errors and 5xx responses are
+    retried up to ``retries`` times with jittered exponential backoff
+    (``retry_backoff`` seconds, doubled per attempt); 429 is not retried, it
+    is left to the response listeners' rate limiting. Idle connections are
+    kept for ``keepalive`` seconds, longer than the usual poll interval, so a
+    collection cycle does not reconnect. Phase latencies of recent requests
+    are kept in ``latency``.
+    """
+    
+    def __init__(self, token: str, secret: str, base_url: str = DEFAULT_BASE_URL,
+                 max_concurrency: int = 10, timeout: float = 10.0, connect_timeout: float = 5.0,
+                 retries: int = 2, retry_backoff: float = 0.5, keepalive: float = 60.0):
         self.token = token
         self.secret = secret
-        self.base_url = "https://api.switch-bot.com/v1.1"
+        self.base_url = base_url.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.keepalive = keepalive
+        self.response_listeners: List[ResponseListener] = []
+        self.latency = LatencyStats()
+        # Keyed once; each request copies it and signs its own timestamp and nonce
+        self._mac = hmac.new(bytes(secret, 'utf-8'), digestmod=hashlib.sha256)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._http = self._open_http()
     
-    def _generate_signature(self, token: str, secret: str, nonce: str, timestamp: str) -> str:
+    def _http_options(self) -> Dict:
+        return {
+            "timeout": httpx.Timeout(self.timeout, connect=self.connect_timeout),
+            "limits": httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency,
+                                   keepalive_expiry=self.keepalive)
+        }
+    
+    def _open_http(self):
+        return httpx.Client(**self._http_options())
+    
+    def add_response_listener(self, listener: ResponseListener):
+        """Call ``listener`` after every API request, e.g. to count quota, trip a circuit breaker or time requests"""
+        self.response_listeners.append(listener)
+    
+    def _notify(self, path: str, status: Optional[int], retry_after: Optional[float], seconds: float):
+        for listener in self.response_listeners:
+            try:
+                listener(path, status, retry_after, seconds)
+            except Exception as e:
+                print(f"Error in response listener: {e}")
+    
+    def _finish(self, path: str, trace: RequestTrace, response: Optional[httpx.Response]):
+        """Record an attempt's latency and tell the response listeners"""
+        seconds = time.perf_counter() - trace.started
+        self.latency.add(trace, failed=response is None or response.status_code >= 400)
+        if response is None:
+            self._notify(path, None, None, seconds)
+        else:
+            self._notify(path, response.status_code, _retry_after(response.headers), seconds)
+    
+    def _retry_delay(self, attempt: int) -> float:
+        """Jittered exponential backoff before retry number ``attempt + 1``"""
+        self.latency.record_retry()
+        return self.retry_backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+    
+    def _get(self, path: str) -> Dict:
+        """GET a path with fresh auth headers, retrying transport errors and 5xx"""
+        for attempt in range(self.retries + 1):
+            trace = RequestTrace()
+            try:
+                response = self._http.get(f"{self.base_url}{path}", headers=self._get_headers(),
+                                          extensions={"trace": trace.record})
+            except httpx.TransportError:
+                self._finish(path, trace, None)
+                if attempt < self.retries:
+                    time.sleep(self._retry_delay(attempt))
+                    continue
+                raise
+            self._finish(path, trace, response)
+            if response.status_code >= 500 and attempt < self.retries:
+                time.sleep(self._retry_delay(attempt))
+                continue
+            response.raise_for_status()
+            return response.json()
+    
+    def _generate_signature(self, nonce: str, timestamp: str) -> str:
         """Generate signature for SwitchBot API authentication"""
-        string_to_sign = token + timestamp + nonce
-        string_to_sign_b = bytes(string_to_sign, 'utf-8')
-        secret_b = bytes(secret, 'utf-8')
-        sign = base64.b64encode(hmac.new(secret_b, string_to_sign_b, hashlib.sha256).digest())
-        return str(sign, 'utf-8')
+        mac = self._mac.copy()
+        mac.update(bytes(self.token + timestamp + nonce, 'utf-8'))
+        return str(base64.b64encode(mac.digest()), 'utf-8')
     
     def _get_headers(self) -> Dict[str, str]:
         """Generate authentication headers for API requests"""
         nonce = str(uuid.uuid4())
         timestamp = str(int(round(time.time() * 1000)))
-        sign = self._generate_signature(self.token, self.secret, nonce, timestamp)
+        sign = self._generate_signature(nonce, timestamp)
         
         return {
             "Authorization": self.token,
@@ -40,17 +230,48 @@ class SwitchBotClient:
     def get_device_status(self, device_id: str) -> Optional[Dict]:
         """Get status of a specific device"""
         try:
-            headers = self._get_headers()
-            response = requests.get(f"{self.base_url}/devices/{device_id}/status", headers=headers)
-            response.raise_for_status()
-            return response.json()
-        except requests.RequestException as e:
+            return self._get(f"/devices/{device_id}/status")
+        except (httpx.HTTPError, ValueError) as e:
             print(f"Error getting device status: {e}")
             return None
     
+    def get_devices(self) -> Optional[List[Dict]]:
+        """Get the account's physical devices (None on failure)"""
+        try:
+            return self._parse_device_list(self._get("/devices"))
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"Error getting device list: {e}")
+            return None
+    
     def get_plug_power_data(self, device_id: str) -> Optional[Dict]:
         """Get power consumption data from SwitchBot Plug Mini"""
-        status = self.get_device_status(device_id)
+        return self._parse_plug_power_data(device_id, self.get_device_status(device_id))
+    
+    def get_many_power_data(self, device_ids: List[str]) -> Dict[str, Optional[Dict]]:
+        """Get power data for several devices concurrently on a thread pool (max_concurrency threads)"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="switchbot")
+        return dict(zip(device_ids, self._executor.map(self.get_plug_power_data, device_ids)))
+    
+    def close(self):
+        """Close pooled HTTP connections and worker threads"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self._http.close()
+    
+    def _parse_device_list(self, payload: Dict) -> List[Dict]:
+        """Convert a device list response into device_id/name/device_type entries"""
+        if payload.get("statusCode", 100) != 100:
+            raise ValueError(f"device list failed: {payload.get('statusCode')} {payload.get('message')}")
+        return [{
+            "device_id": device["deviceId"],
+            "name": device.get("deviceName"),
+            "device_type": device.get("deviceType")
+        } for device in (payload.get("body") or {}).get("deviceList", []) if device.get("deviceId")]
+    
+    def _parse_plug_power_data(self, device_id: str, status: Optional[Dict]) -> Optional[Dict]:
+        """Convert a Plug Mini status response into a power reading"""
         if status and "body" in status:
             body = status["body"]
             
@@ -64,4 +285,83 @@ class SwitchBotClient:
                 "power_on": body.get("power") == "on"
             }
             return power_data
-        return None
\ No newline at end of file
+        return None
+
+
+class AsyncSwitchBotClient(SwitchBotClient):
+    """SwitchBot client for asyncio code, backed by a pooled keep-alive HTTP client
+
+    Same signing, timeouts, retries and response parsing as SwitchBotClient,
+    but the request methods are coroutines so they can fan out over many
+    devices without blocking the event loop. Each attempt also has an
+    overall ``timeout`` deadline.
+    """
+    
+    def __init__(self, token: str, secret: str, base_url: str = DEFAULT_BASE_URL,
+                 max_concurrency: int = 10, timeout: float = 10.0, connect_timeout: float = 5.0,
+                 retries: int = 2, retry_backoff: float = 0.5, keepalive: float = 60.0):
+        super().__init__(token, secret, base_url, max_concurrency, timeout, connect_timeout, retries, retry_backoff,
+                         keepalive)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+    
+    def _open_http(self):
+        return httpx.AsyncClient(**self._http_options())
+    
+    async def _get(self, path: str) -> Dict:
+        """GET a path with fresh auth headers, retrying transport errors, timeouts and 5xx"""
+        for attempt in range(self.retries + 1):
+            trace = RequestTrace()
+            try:
+                async with self._semaphore:
+                    response = await asyncio.wait_for(
+                        self._http.get(f"{self.base_url}{path}", headers=self._get_headers(),
+                                       extensions={"trace": trace.arecord}),
+                        timeout=self.timeout
+                    )
+            except (asyncio.TimeoutError, httpx.TransportError):
+                self._finish(path, trace, None)
+                if attempt < self.retries:
+                    await asyncio.sleep(self._retry_delay(attempt))
+                    continue
+                raise
+            self._finish(path, trace, response)
+            if response.status_code >= 500 and attempt < self.retries:
+                await asyncio.sleep(self._retry_delay(attempt))
+                continue
+            response.raise_for_status()
+            return response.json()
+    
+    async def get_device_status(self, device_id: str) -> Optional[Dict]:
+        """Get status of a specific device"""
+        try:
+            return await self._get(f"/devices/{device_id}/status")
+        except asyncio.TimeoutError:
+            print(f"Error getting device status: {device_id} timed out after {self.timeout}s")
+            return None
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"Error getting device status: {e}")
+            return None
+    
+    async def get_devices(self) -> Optional[List[Dict]]:
+        """Get the account's physical devices (None on failure)"""
+        try:
+            return self._parse_device_list(await self._get("/devices"))
+        except asyncio.TimeoutError:
+            print(f"Error getting device list: timed out after {self.timeout}s")
+            return None
+        except (httpx.HTTPError, ValueError) as e:
+            print(f"Error getting device list: {e}")
+            return None
+    
+    async def get_plug_power_data(self, device_id: str) -> Optional[Dict]:
+        """Get power consumption data from SwitchBot Plug Mini"""
+        return self._parse_plug_power_data(device_id, await self.get_device_status(device_id))
+    
+    async def get_many_power_data(self, device_ids: List[str]) -> Dict[str, Optional[Dict]]:
+        """Get power data for several devices concurrently (at most max_concurrency in flight)"""
+        readings = await asyncio.gather(*(self.get_plug_power_data(device_id) for device_id in device_ids))
+        return dict(zip(device_ids, readings))
+    
+    async def aclose(self):
+        """Close pooled HTTP connections"""
+        await self._http.aclose()
@@ -0,0 +1,41 @@
+import random
+
+from anomaly import DetectionEngine, parse_detection_rules
+
+START = 1_790_000_000
+
+
+def readings(powers, device_id="D", start=START, interval=20):
+    return [{"device_id": device_id, "timestamp": start + i * interval, "power": power}
+            for i, power in enumerate(powers)]
+
+
+def max_power_events(engine, powers):
+    return [event for event in engine.process(readings(powers)) if event["rule"] == "max_power"]
+
+
+def test_max_power_hovering_around_limit_is_one_event():
+    engine = DetectionEngine(parse_detection_rules("max_power=60"))
+    random.seed(1)
+    # A day of readings every 20 s between 50 and 66 W, crossing 60 W thousands of times
+    powers = [random.uniform(50.5, 66) for _ in range(4320)]
+
+    assert len(max_power_events(engine, powers)) == 1
+
+
+def test_max_power_reports_each_real_excursion():
+    engine = DetectionEngine(parse_detection_rules("max_power=60"))
+    excursion = [58, 61, 59, 62, 58, 63, 59]
+    powers = [5] * 10 + excursion + [5] * 10 + excursion + [5] * 10
+
+    events = max_power_events(engine, powers)
+
+    assert [event["value"] for event in events] == [61, 61]
+
+
+def test_max_power_margin_is_a_fraction_of_the_limit():
+    engine = DetectionEngine(parse_detection_rules("max_power=1500"), max_power_margin=0.1)
+    # 1400 W is not 10% below 1500 W, so it is still the same excursion; 1300 W re-arms
+    powers = [1000, 1600, 1400, 1550, 1300, 1550]
+
+    assert [event["value"] for event in max_power_events(engine, powers)] == [1600, 1550]
@@ -0,0 +1,48 @@
+import importlib
+import sys
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture(scope="module")
+def api(tmp_path_factory):
+    # main opens power_data.db in the working directory on import
+    directory = tmp_path_factory.mktemp("api")
+    with pytest.MonkeyPatch.context() as patch:
+        patch.chdir(directory)
+        for name in ("SWITCHBOT_TOKEN", "SWITCHBOT_SECRET", "ANOMALY_RULES", "RETENTION_POLICY"):
+            patch.setenv(name, "")
+        sys.modules.pop("main", None)
+        main = importlib.import_module("main")
+        with TestClient(main.app) as client:
+            yield main, client
+        sys.modules.pop("main", None)
+
+
+def test_delete_old_data_deletes_only_old_readings(api):
+    main, client = api
+    now = int(time.time())
+    main.storage.save_many_power_data([
+        {"device_id": "OLD", "timestamp": now - 3 * 86400, "power": 1.0},
+        {"device_id": "OLD", "timestamp": now - 60, "power": 2.0},
+    ])
+
+    response = client.delete("/database/delete/old?minutes=1440&confirm=true")
+
+    assert response.status_code == 200
+    assert response.json()["deleted_records"] == 1
+    assert main.storage.count_readings("OLD", 0) == 1
+
+
+def test_delete_old_data_requires_confirmation(api):
+    _, client = api
+
+    assert client.delete("/database/delete/old?minutes=1440").status_code == 400
+
+
+def test_delete_unknown_device_is_404(api):
+    _, client = api
+
+    assert client.delete("/database/delete/NO_SUCH_DEVICE?confirm=true").status_code == 404
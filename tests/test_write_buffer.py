@@ -0,0 +1,54 @@
+import json
+import time
+
+from data_storage import PowerDataStorage, WriteBuffer
+
+
+def reading(timestamp):
+    return {"device_id": "D", "timestamp": timestamp, "power": 1.0}
+
+
+def test_failed_forced_flush_rejects_readings_past_capacity(tmp_path):
+    inserted = []
+    healthy = {"value": False}
+
+    def insert(batch):
+        if not healthy["value"]:
+            raise RuntimeError("database is locked")
+        inserted.extend(batch)
+
+    buffer = WriteBuffer(insert, str(tmp_path / "spool"), max_rows=1000, max_age=3600, capacity=3)
+    try:
+        assert buffer.add_many([reading(1), reading(2), reading(3)])
+        assert not buffer.add_many([reading(4)])
+        assert len(buffer.pending_readings()) == 3
+        assert buffer.metrics()["rows_rejected"] == 1
+
+        healthy["value"] = True
+        assert buffer.add_many([reading(4)])
+        assert [row["timestamp"] for row in inserted] == [1, 2, 3]
+    finally:
+        buffer.close()
+
+    assert [row["timestamp"] for row in inserted] == [1, 2, 3, 4]
+
+
+def test_replayed_spool_skips_rows_committed_before_a_crash(tmp_path):
+    db_path = str(tmp_path / "power.db")
+    start = int(time.time()) // 60 * 60 - 3600
+    committed = [dict(reading(start + i * 60), power=float(i)) for i in range(3)]
+    storage = PowerDataStorage(db_path)
+    storage.save_many_power_data(committed)
+    storage.close()
+    # Crash after the flush committed but before the spool was truncated
+    with open(db_path + ".spool", "w", encoding="utf-8") as spool:
+        spool.writelines(json.dumps(data) + "\n" for data in committed + [reading(start + 180)])
+
+    storage = PowerDataStorage(db_path)
+    storage.enable_write_buffer(max_rows=1000, max_age=3600)
+    storage.close()
+
+    storage = PowerDataStorage(db_path)
+    assert storage.count_readings("D", 0) == 4
+    assert [row["samples"] for row in storage.get_rollups_by_timerange("D", hours=2)] == [1, 1, 1, 1]
+    storage.close()